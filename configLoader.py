@@ -0,0 +1,140 @@
+#
+# scheduLight - automation tool for BigBlueButton and Greenlight
+# copyright Martin Thomas Schrott 2020
+#
+# This file is part of scheduLight
+# scheduLight is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# You should have received a copy of the GNU General Public License along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+#
+import os, sys, stat, logging, marshal, hashlib, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+
+# use the libyaml bindings if available
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+# keep the parsed config in a sidecar file next to the config file, it is used as long as mtime and size of the file are unchanged
+# the sidecar contains the secrets of the config: it is only readable by its owner and only used if it is owned by the current user
+use_cache = True
+# format of the sidecar file (marshal, data only), cached configs of other formats are parsed again
+cache_format = 2
+
+logger = logging.getLogger('scheduLight')
+
+def cache_file(dataFile):
+    # the sidecar file of a config file: .config.yml.cache
+    (directory, name) = os.path.split(os.path.abspath(dataFile))
+    return os.path.join(directory, ".{}.cache".format(name))
+
+def read_cache(dataFile, fileStat):
+    try:
+        fd = os.open(cache_file(dataFile), os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return None
+    try:
+        with os.fdopen(fd, 'rb') as stream:
+            cacheStat = os.fstat(stream.fileno())
+            if cacheStat.st_uid != os.getuid() or cacheStat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                logger.error("ignoring config cache {}: not owned by the current user or writable by others".format(cache_file(dataFile)))
+                return None
+            (format, mtime, size, config) = marshal.load(stream)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if format != cache_format or mtime != fileStat.st_mtime_ns or size != fileStat.st_size:
+        return None
+    logger.debug("loaded config {} from cache".format(dataFile))
+    return config
+
+def write_cache(dataFile, fileStat, config):
+    # write the sidecar file atomically and only readable by the owner, a config dir without write permissions only disables the cache
+    # configs with values marshal can not store (e.g. dates) are not cached
+    tmpFile = "{}.{}".format(cache_file(dataFile), os.getpid())
+    try:
+        raw = marshal.dumps((cache_format, fileStat.st_mtime_ns, fileStat.st_size, config))
+    except ValueError as ERR:
+        logger.debug("could not cache config {}: {}".format(dataFile, ERR))
+        return
+    try:
+        fd = os.open(tmpFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(raw)
+        os.replace(tmpFile, cache_file(dataFile))
+    except OSError as ERR:
+        logger.debug("could not cache config {}: {}".format(dataFile, ERR))
+        try:
+            os.remove(tmpFile)
+        except OSError:
+            pass
+
+def write_yaml(dataFile, config):
+    with open(dataFile, 'w') as outfile:
+        yaml.dump(config, outfile, Dumper=Dumper, default_flow_style=False, allow_unicode=True)
+
+def load_yaml(dataFile):
+    # parse a yaml file or take it from the cache, raises OSError and yaml.YAMLError
+    fileStat = os.stat(dataFile)
+    if use_cache:
+        config = read_cache(dataFile, fileStat)
+        if config is not None:
+            return config
+    with open(dataFile, 'r') as stream:
+        config = yaml.load(stream, Loader=Loader)
+    if use_cache and config is not None:
+        write_cache(dataFile, fileStat, config)
+    return config
+
+def read_yaml(dataFile, ignore_missing_file = False):
+    try:
+        return load_yaml(dataFile)
+    except FileNotFoundError as ERR:
+        if ignore_missing_file  != True:
+            sys.exit()
+        return None
+    except yaml.YAMLError as ERR:
+        logger.error(ERR)
+        sys.exit()
+
+def fragment_files(configDir):
+    # the yaml fragments of a config directory in the order they are merged
+    try:
+        names = os.listdir(configDir)
+    except FileNotFoundError:
+        return []
+    return sorted([name for name in names if name.endswith(('.yml', '.yaml')) and not name.startswith('.')])
+
+def file_hash(dataFile):
+    with open(dataFile, 'rb') as stream:
+        return hashlib.sha1(stream.read()).hexdigest()
+
+def read_fragment(dataFile):
+    """ parse a config fragment, runs in the worker processes
+
+    returns the mtime, size and hash of the parsed content and the config, the error instead of the config if it can not be parsed
+    """
+    try:
+        fileStat = os.stat(dataFile)
+        with open(dataFile, 'rb') as stream:
+            raw = stream.read()
+        config = yaml.load(raw, Loader=Loader)
+    except (OSError, yaml.YAMLError) as ERR:
+        return (None, None, None, None, str(ERR))
+    if config is None:
+        config = {}
+    if not isinstance(config, dict):
+        return (None, None, None, None, "{} is not a mapping".format(dataFile))
+    return (fileStat.st_mtime_ns, fileStat.st_size, hashlib.sha1(raw).hexdigest(), config, None)
+
+def read_fragments(files, workers=1):
+    """ parse config fragments in workers processes
+
+    yields (dataFile, result of read_fragment) in the order of files
+    """
+    if workers <= 1 or len(files) <= 1:
+        for dataFile in files:
+            yield (dataFile, read_fragment(dataFile))
+        return
+    # the scripts are not import safe, fork the workers instead of starting new interpreters
+    with ProcessPoolExecutor(max_workers=min(workers, len(files)), mp_context=multiprocessing.get_context('fork')) as pool:
+        for (dataFile, result) in zip(files, pool.map(read_fragment, files)):
+            yield (dataFile, result)
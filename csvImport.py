@@ -0,0 +1,189 @@
+#
+# scheduLight - automation tool for BigBlueButton and Greenlight
+# copyright Martin Thomas Schrott 2020
+#
+# This file is part of scheduLight
+# scheduLight is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# You should have received a copy of the GNU General Public License along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+#
+import csv, os, shutil, collections, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+import dataSchema
+from configLoader import Dumper, read_fragment
+
+# fields of a row, separated by ;
+columns = ['givenname', 'sn', 'email', 'password', 'startdate', 'room_url', 'live_url', 'title', 'server']
+# validate and store n rows at once
+batch_size = 500
+# schema of the worker process
+meeting_schema = None
+
+def meeting_from_row(row):
+    """ the id and the meeting of one row """
+    (givenname, sn, email, password, startdate, room_url, live_url, title, server) = [field.strip() for field in row]
+    name = "{} {}".format(givenname, sn)
+    orig_email = email
+    email = email.lower()
+    if startdate  == '0000-00-00':
+        startdate = None
+    meetingKey = email.replace('@', '_').replace('.', '_')
+
+    # meeting infos
+    mDict = {}
+    mDict['id'] = meetingKey
+    mDict['server'] = server
+    mDict['meetingName'] = "{}".format(name)
+    mDict['meetingTitle'] = title
+    if startdate:
+        mDict['startDate'] = startdate
+    # owner info
+    mDict['owner'] = {}
+    mDict['useHomeRoom'] = True
+    mDict['owner']['email'] = email
+    mDict['owner']['password'] = password
+    mDict['owner']['socialUid'] = "CN={},OU=USERS,OU=EXTERNAL,DC=ldap,DC=domain,DC=tld".format(orig_email)
+    mDict['owner']['fullName'] = name
+    # templates
+    mDict['meetingOwnerInfoTemplate'] = "imported-meetingOwnerInfoTemplate.j2"
+    mDict['meetingModeratorInfoTemplate'] = "imported-meetingModeratorInfoTemplate.j2"
+    mDict['meetingShareInfoTemplate'] = "imported-meetingShareInfoTemplate.j2"
+    mDict['meetingInvitationInfoTemplate'] = "imported-meetingInvitationInfoTemplate.j2"
+    mDict['meetingOwnerStartedTemplate'] = "imported-meetingOwnerStartedTemplate.j2"
+    mDict['meetingOwnerReminderTemplate'] = "imported-meetingOwnerReminderTemplate.j2"
+    #settings
+    mDict['muteOnStart'] = "true"
+    mDict['maxParticipants'] = 150
+    mDict['logoutURL'] = "importet.logout.url"
+    # prepare liveStreaming parameters
+    mDict['liveStreaming'] = {}
+    mDict['liveStreaming']['playIntro'] = "/video/5min.mp4"
+    mDict['liveStreaming']['streamerHost'] = live_url
+    mDict['liveStreaming']['targetUrl'] = "rtmp://{}/stream/bbb".format(live_url)
+    return (meetingKey, mDict)
+
+def validate_rows(rows):
+    """ build and validate the meetings of a batch of (line, row), runs in the worker processes
+
+    returns (line, meetingKey, mDict, errors) per row, mDict is None if the row is invalid
+    """
+    global meeting_schema
+    if meeting_schema is None:
+        meeting_schema = dataSchema.meetingSchema()
+    results = []
+    for (line, row) in rows:
+        if len(row) != len(columns):
+            results.append((line, None, None, {'row': ["expected {} fields ({}), got {}".format(len(columns), ";".join(columns), len(row))]}))
+            continue
+        (meetingKey, mDict) = meeting_from_row(row)
+        try:
+            errors = meeting_schema.validate(mDict)
+        except Exception as ERR:
+            errors = {'row': [str(ERR)]}
+        results.append((line, meetingKey, None if errors else mDict, errors))
+    return results
+
+def read_batches(csvFile):
+    # the rows of the csv file with their line number in batches of batch_size, empty lines are skipped
+    with open(csvFile, 'r', newline='') as stream:
+        reader = csv.reader(stream, delimiter=';')
+        batch = []
+        for row in reader:
+            if not row or not ''.join(row).strip():
+                continue
+            batch.append((reader.line_num, row))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def validated_batches(csvFile, workers):
+    """ validate the batches of the csv file in workers processes, in the order of the file
+
+    At most two batches per worker are read ahead of the batch that is stored.
+    """
+    if workers <= 1:
+        for batch in read_batches(csvFile):
+            yield validate_rows(batch)
+        return
+    # the scripts are not import safe, fork the workers instead of starting new interpreters
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        pending = collections.deque()
+        for batch in read_batches(csvFile):
+            pending.append(pool.submit(validate_rows, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def import_csv(sl, csvFile, logger, expire=None, workers=1, meetings=None, fragmentFile=None):
+    """ import the meetings of a csv file to redis
+
+    The meetings of every batch are stored with one request. Invalid rows are logged with their line number and skipped.
+    meetings: dict the imported meetings are added to (e.g. the meetings of the configFile)
+    fragmentFile: add the imported meetings to this yaml file, they replace meetings with the same id, all other entries are kept
+    returns the number of imported and failed rows
+    """
+    imported = 0
+    failed = 0
+    out = None
+    existing = {}
+    importedKeys = set()
+    if fragmentFile and os.path.exists(fragmentFile):
+        (mtime, size, contentHash, existing, error) = read_fragment(fragmentFile)
+        if error:
+            raise ValueError("can not add the meetings to {}: {}".format(fragmentFile, error))
+    if fragmentFile:
+        tmpFile = "{}.{}".format(fragmentFile, os.getpid())
+        out = open(tmpFile, 'w')
+        if os.path.exists(fragmentFile):
+            # the fragment keeps its permissions
+            shutil.copymode(fragmentFile, tmpFile)
+    try:
+        for results in validated_batches(csvFile, workers):
+            pipe = sl.r.pipeline()
+            for (line, meetingKey, mDict, errors) in results:
+                if errors:
+                    logger.error("line {}: {}".format(line, errors))
+                    failed += 1
+                    continue
+                if meetingKey in importedKeys:
+                    logger.error("line {}: meeting {} was already imported from another line".format(line, meetingKey))
+                    failed += 1
+                    continue
+                version = sl.store_meeting(meetingKey, mDict, expire, pipe)
+                pipe.sadd('meetings', meetingKey)
+                pipe.hset('configHashes', 'meeting:{}'.format(meetingKey), '{}:{}'.format(sl.config_hash(mDict), version))
+                if meetings is not None:
+                    meetings[meetingKey] = mDict
+                if out:
+                    if not importedKeys:
+                        out.write("meetings:\n")
+                    text = yaml.dump({meetingKey: mDict}, Dumper=Dumper, default_flow_style=False, allow_unicode=True)
+                    out.write(''.join(["  " + line for line in text.splitlines(True)]))
+                importedKeys.add(meetingKey)
+                imported += 1
+            pipe.execute()
+            logger.debug("imported {} meetings, {} rows failed".format(imported, failed))
+        if out:
+            # keep the meetings of the fragment that were not imported again and its other entries
+            kept = { key: value for (key, value) in (existing.get('meetings') or {}).items() if key not in importedKeys }
+            if kept:
+                if not importedKeys:
+                    out.write("meetings:\n")
+                text = yaml.dump(kept, Dumper=Dumper, default_flow_style=False, allow_unicode=True)
+                out.write(''.join(["  " + line for line in text.splitlines(True)]))
+            elif not importedKeys:
+                out.write("meetings: {}\n")
+            others = { key: value for (key, value) in existing.items() if key != 'meetings' }
+            if others:
+                out.write(yaml.dump(others, Dumper=Dumper, default_flow_style=False, allow_unicode=True))
+            out.close()
+            os.replace(tmpFile, fragmentFile)
+    finally:
+        if out and not out.closed:
+            out.close()
+            os.remove(tmpFile)
+    return (imported, failed)
@@ -84,6 +84,7 @@ class serverSchema(Schema):
         - mailPassword (str)
         - mailServer (Str)
         - mailUser (str)
+        - mailStarttls (bool)
     """
     id = fields.Str(required=True)
     BBB_SECRET = fields.Str(required=True)
@@ -98,6 +99,7 @@ class serverSchema(Schema):
     mailPassword = fields.Str(required=True)
     mailServer = fields.Str(required=True)
     mailUser = fields.Str(required=True)
+    mailStarttls = fields.Bool(required=False)
 
 class commandSchema(Schema):
     """ /api/commands post
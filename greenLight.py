@@ -11,12 +11,71 @@
 #
 import logging
 import psycopg2
+import psycopg2.pool
+import psycopg2.extras
+import sys
+import time
+import threading
 import uuid
 import random
 import string
 import json
+import select
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
 from datetime import datetime, timedelta
 
+def transactional(method):
+    # run the method in one transaction, or as part of the transaction of the calling thread
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.transaction():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class lookupCache:
+    """ thread safe LRU cache of lookup results, entries expire after ttl seconds """
+    missing = object()
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return self.missing
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, table=None):
+        # remove the entries of a table, or all entries
+        with self.lock:
+            if table is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == table]:
+                    del self.entries[key]
+
 class greenLight:
     """ provides some methods to interact with greenlight """
     # set startTime
@@ -25,8 +84,12 @@ class greenLight:
     usersTableList = ['id', 'room_id', 'provider', 'uid', 'name', 'username', 'email', 'social_uid', 'image', 'password_digest', 'accepted_terms', 'created_at', 'updated_at', 'email_verified', 'language', 'reset_digest', 'reset_sent_at', 'activation_digest', 'activated_at', 'deleted', 'role_id']
     roomsTableList = ['id', 'user_id', 'name', 'uid', 'bbb_id', 'sessions', 'last_session', 'created_at', 'updated_at', 'room_settings', 'moderator_pw', 'attendee_pw', 'access_code', 'deleted']
     sharedTableList = ['id', 'room_id', 'user_id', 'created_at', 'updated_at']
+    # lookups of these tables are cached
+    cachedTables = ['users', 'rooms']
+    # channel of the triggers notifying changes of the cached tables
+    notifyChannel = 'schedulight_cache'
 
-    def __init__(self, gl_dbName, gl_dbUser, gl_dbPassword, gl_dbHost, gl_dbPort, gl_logFile='greenLight.log'):
+    def __init__(self, gl_dbName, gl_dbUser, gl_dbPassword, gl_dbHost, gl_dbPort, gl_logFile='greenLight.log', gl_minConn=1, gl_maxConn=4, gl_healthCheck=30, gl_retries=3, gl_cacheSize=10000, gl_cacheTTL=60, gl_notify=False):
         ## create logger with 'greenLight'
         self.logger = logging.getLogger('greenLight')
         self.logger.setLevel(logging.DEBUG)
@@ -47,13 +110,207 @@ class greenLight:
         #
         self.logger.debug("starting...")
         # connect to greenlight database
+        # every operation takes a connection from the pool, so threads can use the database concurrently
         self.logger.debug("connecting to database...")
-        self.con = psycopg2.connect(database=gl_dbName, user=gl_dbUser, password=gl_dbPassword, host=gl_dbHost, port=gl_dbPort)
-        self.cur = self.con.cursor()
+        self.maxConn = int(gl_maxConn)
+        # connections idle for more than n seconds are checked before they are used
+        self.healthCheck = int(gl_healthCheck)
+        # reconnect n times before an operation fails
+        self.retries = int(gl_retries)
+        try:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(int(gl_minConn), self.maxConn, database=gl_dbName, user=gl_dbUser, password=gl_dbPassword, host=gl_dbHost, port=gl_dbPort)
+        except psycopg2.OperationalError as ERR:
+            self.logger.error("could not connect to database. {}".format(ERR))
+            sys.exit()
+        # wait for a free connection instead of failing if all connections are in use
+        self.available = threading.BoundedSemaphore(self.maxConn)
+        self.lastUsed = {}
+        # connection of the transaction running in the current thread
+        self.local = threading.local()
+        # cache of user and room lookups, cleared by the writes of this module
+        self.cache = lookupCache(gl_cacheSize, gl_cacheTTL)
+        # optionally clear it on changes made by greenlight itself
+        self.listener = None
+        self.lastPoll = 0
+        if gl_notify:
+            self.listen(database=gl_dbName, user=gl_dbUser, password=gl_dbPassword, host=gl_dbHost, port=gl_dbPort)
         # check greenlight database compatibility
         self.logger.debug("check database compatibility...")
         self.check_compatibility()
 
+    def healthy(self, con):
+        # check connections that were idle for a while, a restarted database closes them
+        if con.closed:
+            return False
+        if time.time() - self.lastUsed.get(id(con), 0) < self.healthCheck:
+            return True
+        try:
+            with con.cursor() as cur:
+                cur.execute("SELECT 1;")
+            con.rollback()
+            return True
+        except psycopg2.Error as ERR:
+            self.logger.debug("discarding broken database connection. {}".format(ERR))
+            return False
+
+    def get_connection(self):
+        # healthy connection from the pool, reconnects if the database was restarted
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt * 0.5, 10))
+            try:
+                con = self.pool.getconn()
+            except psycopg2.OperationalError as ERR:
+                self.logger.error("could not connect to database (attempt {} of {}). {}".format(attempt + 1, self.retries + 1, ERR))
+                continue
+            if self.healthy(con):
+                return con
+            self.put_connection(con, True)
+        raise psycopg2.OperationalError("no database connection available")
+
+    def put_connection(self, con, broken=False):
+        # return the connection to the pool, broken connections are closed and replaced on demand
+        broken = broken or con.closed != 0
+        if broken:
+            self.lastUsed.pop(id(con), None)
+        else:
+            self.lastUsed[id(con)] = time.time()
+        self.pool.putconn(con, close=broken)
+
+    def listen(self, **dsn):
+        # install triggers notifying changes of the cached tables and listen to them on a separate connection
+        sql = "CREATE OR REPLACE FUNCTION schedulight_notify() RETURNS trigger AS $$ BEGIN PERFORM pg_notify('{}', TG_TABLE_NAME); RETURN NULL; END; $$ LANGUAGE plpgsql;".format(self.notifyChannel)
+        for table in self.cachedTables:
+            sql += " DROP TRIGGER IF EXISTS schedulight_cache ON {}; CREATE TRIGGER schedulight_cache AFTER INSERT OR UPDATE OR DELETE ON {} FOR EACH STATEMENT EXECUTE PROCEDURE schedulight_notify();".format(table, table)
+        try:
+            self.execute(sql)
+            self.listener = psycopg2.connect(**dsn)
+            self.listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with self.listener.cursor() as cur:
+                cur.execute("LISTEN {};".format(self.notifyChannel))
+            self.logger.debug("listening to changes of {}".format(", ".join(self.cachedTables)))
+        except psycopg2.Error as ERR:
+            self.logger.error("could not listen to changes, cached lookups expire after {} seconds. {}".format(self.cache.ttl, ERR))
+            self.listener = None
+
+    def poll_notifications(self):
+        # clear the cache of tables changed by others, at most once per second
+        if self.listener is None or time.time() - self.lastPoll < 1:
+            return
+        self.lastPoll = time.time()
+        try:
+            if select.select([self.listener], [], [], 0)[0]:
+                self.listener.poll()
+            while self.listener.notifies:
+                table = self.listener.notifies.pop(0).payload
+                self.logger.debug("{} changed, clearing cached lookups".format(table))
+                self.cache.invalidate(table)
+        except psycopg2.Error as ERR:
+            # without notifications changes could be missed, so nothing cached is trusted
+            self.logger.error("lost the notification connection. {}".format(ERR))
+            self.cache.invalidate()
+            self.listener = None
+
+    def invalidate(self, *tables):
+        # clear the cached lookups of tables written to, again when the transaction ends
+        for table in tables:
+            self.cache.invalidate(table)
+        if getattr(self.local, 'con', None) is not None:
+            self.local.dirty.update(tables)
+
+    def cached_row(self, key, sql):
+        # first row of the query, cached by key (table, column, value, fields). raises IndexError if there is no row
+        if key[0] not in self.cachedTables:
+            return self.execute(sql)[1][0]
+        self.poll_notifications()
+        row = self.cache.get(key)
+        if row is lookupCache.missing:
+            row = self.execute(sql)[1][0]
+            self.cache.set(key, row)
+        return row
+
+    @contextmanager
+    def transaction(self):
+        """ run all operations of the block in one transaction
+
+        The operations of the current thread use the connection of the transaction and do not commit on their own.
+        The transaction is committed at the end of the block and rolled back if the block or one of its statements failed.
+        Nested blocks join the outer transaction.
+        """
+        if getattr(self.local, 'con', None) is not None:
+            yield
+            return
+        with self.available:
+            con = self.get_connection()
+            self.local.con = con
+            self.local.failed = None
+            self.local.dirty = set()
+            broken = False
+            try:
+                yield
+                if self.local.failed is not None:
+                    # a failed statement aborts the transaction, even if the error was handled
+                    raise self.local.failed
+                con.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            except Exception:
+                con.rollback()
+                raise
+            finally:
+                self.local.con = None
+                self.put_connection(con, broken)
+                # other threads could have cached the state before the commit
+                for table in self.local.dirty:
+                    self.cache.invalidate(table)
+
+    @contextmanager
+    def cursor(self):
+        """ cursor on a connection of the pool, commits if the block succeeds and rolls back otherwise """
+        con = getattr(self.local, 'con', None)
+        if con is not None:
+            # part of the transaction of this thread
+            try:
+                with con.cursor() as cur:
+                    yield cur
+            except psycopg2.Error as ERR:
+                self.local.failed = ERR
+                raise
+            return
+        with self.available:
+            con = self.get_connection()
+            broken = False
+            try:
+                with con.cursor() as cur:
+                    yield cur
+                con.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            except Exception:
+                con.rollback()
+                raise
+            finally:
+                self.put_connection(con, broken)
+
+    def execute(self, sql, data=None):
+        """ run a single statement and commit it
+
+        returns the rowcount and the fetched rows. If the connection was lost, the statement is run again on a new connection.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.cursor() as cur:
+                    cur.execute(sql, data)
+                    rows = cur.fetchall() if cur.description else []
+                    return (cur.rowcount, rows)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as ERR:
+                # a transaction can not be continued on a new connection
+                if attempt == self.retries or getattr(self.local, 'con', None) is not None:
+                    raise
+                self.logger.error("lost database connection, retrying. {}".format(ERR))
+
     def check_compatibility(self):
         # check users table
         if self.usersTableList != self.table_as_list('users'):
@@ -71,52 +328,80 @@ class greenLight:
     def table_as_list(self, table):
         # list table columns as list
         sql = "SELECT column_name FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{}';".format(table)
-        self.cur.execute(sql)
+        (count, rows) = self.execute(sql)
         tableRows = []
-        for field in self.cur.fetchall():
+        for field in rows:
             tableRows.append(field[0])
         return tableRows
     
+    @transactional
     def user_role(self, email, role=1):
         sql = "Update users set role_id = %s where email = %s;"
+        self.invalidate('users')
         data = (role, email, )
-        self.cur.execute(sql, data) 
-        self.con.commit() 
-        return self.cur.rowcount
+        return self.execute(sql, data)[0]
     
+    @transactional
     def update_field(self, table, update_by, user_id, field, value):
         sql = "Update {} set {} = %s where {} = %s;".format(table, field, update_by)
+        self.invalidate(table)
         data = (value, user_id)
-        self.cur.execute(sql, data) 
-        self.con.commit() 
-        return self.cur.rowcount
+        return self.execute(sql, data)[0]
     
+    def sync_room(self, room_data, desired):
+        """ update the columns of a room that differ from the desired values with one statement
+
+        room_data: row of the room as returned by table_row_as_dict, desired: column -> value
+        returns the row with the desired values, nothing is written if all values match
+        """
+        changes = {}
+        for field in desired:
+            (current, value) = (room_data.get(field), desired[field])
+            # values from the config may be numbers for text columns
+            if current != value and (current is None or value is None or str(current) != str(value)):
+                changes[field] = value
+        if not changes:
+            return room_data
+        fields = sorted(changes)
+        sql = "Update rooms set {}, updated_at = %s where id = %s;".format(", ".join(["{} = %s".format(field) for field in fields]))
+        data = tuple([changes[field] for field in fields]) + (self.NOW, room_data['id'], )
+        self.invalidate('rooms')
+        self.execute(sql, data)
+        self.logger.debug("updated {} of room {}".format(", ".join(fields), room_data['id']))
+        room_data = dict(room_data)
+        room_data.update(changes)
+        return room_data
+
+    @transactional
     def delete_user(self, user_id, delete_by='email'):
-        user_id = self.get_table_field('users', delete_by, user_id, 'id')
-        sql = "DELETE from users WHERE  id= '{}';".format(user_id)
-        self.cur.execute(sql)
-        self.con.commit() # <- We MUST commit to reflect the deleted data
-        res = self.cur.rowcount
-        if res > 0:
-            self.logger.debug("deleted user {}".format(user_id))
-            sql = "DELETE from users_roles WHERE user_id = '{}';".format(user_id)
-            self.cur.execute(sql)
-            self.con.commit() # <- We MUST commit to reflect the deleted data
-            res2 = self.cur.rowcount
-            if res2 > 0:
-                self.logger.debug("deleted user roles of {}".format(user_id))
-            else:
-                self.logger.debug("no user roles of {}".format(user_id))
-            self.logger.debug("deleting rooms of user {}".format(user_id))
-            sql = "SELECT id from rooms where user_id = '{}';".format(user_id)
-            tableRows = []
-            self.cur.execute(sql)
-            for field in self.cur.fetchall():
-                tableRows.append(field[0])
-            for room in tableRows:
-                self.delete_room(room, 'id')
-        return res
-    
+        return len(self.delete_users([user_id], delete_by))
+
+    @transactional
+    def delete_users(self, users, delete_by='email'):
+        """ delete many users with their roles, shares and rooms in one transaction
+
+        returns the ids of the deleted users by the value of the delete_by column
+        """
+        if not users:
+            return {}
+        sql = "DELETE from users WHERE {} = ANY(%s) RETURNING {}, id;".format(delete_by, delete_by)
+        self.invalidate('users')
+        deleted = dict(self.execute(sql, (list(users), ))[1])
+        for user in users:
+            if user not in deleted:
+                self.logger.error("Error: no user {} {} found.".format(delete_by, user))
+        if deleted:
+            user_ids = list(deleted.values())
+            self.logger.debug("deleted users {}".format(", ".join([str(user_id) for user_id in user_ids])))
+            sql = "DELETE from users_roles WHERE user_id = ANY(%s);"
+            self.logger.debug("deleted {} user roles".format(self.execute(sql, (user_ids, ))[0]))
+            sql = "DELETE from shared_accesses WHERE user_id = ANY(%s);"
+            self.logger.debug("deleted {} shares with the users".format(self.execute(sql, (user_ids, ))[0]))
+            self.logger.debug("deleting rooms of users")
+            self.delete_rooms(user_ids, 'user_id')
+        return deleted
+
+    @transactional
     def create_user(self, email, fullName=None, uid=None, social_uid=None, password=None, role_id=1, provider='ldap'):
         if self.get_table_field('users', 'email', email, 'id'):
             self.logger.error("email {} does already exist. Could not create user {}.".format(email, fullName))
@@ -130,11 +415,10 @@ class greenLight:
         if not uid:
             self.logger.debug("creating uid...")
             uid = "sl-{}".format(self.random_secret())
+        self.invalidate('users')
         sql = "INSERT INTO users (room_id, provider, uid, name, username, email, social_uid, image, password_digest, accepted_terms, created_at, updated_at, email_verified, language, reset_digest, reset_sent_at, activation_digest, activated_at, deleted, role_id) VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;"
         data = (None, provider, uid, fullName, uid, email, social_uid, None, password, True, self.NOW, self.NOW, True, None, None, None, None, self.NOW, False, role_id)
-        self.cur.execute(sql, data) 
-        self.con.commit() 
-        id = self.cur.fetchone()[0]
+        id = self.execute(sql, data)[1][0][0]
         if id:
             return 1
         else:
@@ -145,6 +429,7 @@ class greenLight:
             # bugfix (default role not set on create)
             # fixed in 2.6.2         res2 = self.user_role(email, 1)
     
+    @transactional
     def create_room(self, email, meetingName=None, meetingUID=None, room_settings=None, bbb_id=None, attendeePW=None, moderatorPW=None, accessCode=None):
         user_id = self.get_id_by_email(email)
         if not user_id:
@@ -174,22 +459,91 @@ class greenLight:
             room_settings = {"muteOnStart":True,"requireModeratorApproval":False,"anyoneCanStart":False,"joinModerator":False}
             room_settings = json.dumps(room_settings)
     
+        self.invalidate('rooms')
         sql = "INSERT INTO rooms (user_id, name, uid, bbb_id, sessions, last_session, created_at, updated_at, room_settings, moderator_pw, attendee_pw, access_code, deleted) VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;"
         data = (user_id, meetingName, meetingUID, bbb_id, 0, None, self.NOW, self.NOW, room_settings, moderatorPW, attendeePW, accessCode, False)
-        self.cur.execute(sql, data) 
-        self.con.commit() 
-        return self.cur.fetchone()[0]
+        return self.execute(sql, data)[1][0][0]
     
+    @transactional
+    def bulk_create_users(self, users):
+        """ create many users with one query for the existing emails and one insert
+
+        users: list of dicts with the email and optional fullName, uid, social_uid, password, role_id and provider (see create_user)
+        returns the ids of the created users by email
+        """
+        if not users:
+            return {}
+        sql = "SELECT email from users where email = ANY(%s);"
+        existing = set([row[0] for row in self.execute(sql, ([user['email'] for user in users], ))[1]])
+        rows = []
+        for user in users:
+            email = user['email']
+            fullName = user.get('fullName')
+            if email in existing:
+                self.logger.error("email {} does already exist. Could not create user {}.".format(email, fullName))
+                continue
+            existing.add(email)
+            password = user.get('password') or self.random_secret()
+            if not fullName:
+                fullName = email.partition('@')[0]
+            uid = user.get('uid') or "sl-{}".format(self.random_secret())
+            rows.append((None, user.get('provider') or 'ldap', uid, fullName, uid, email, user.get('social_uid'), None, password, True, self.NOW, self.NOW, True, None, None, None, None, self.NOW, False, user.get('role_id') or 1))
+        if not rows:
+            return {}
+        self.invalidate('users')
+        sql = "INSERT INTO users (room_id, provider, uid, name, username, email, social_uid, image, password_digest, accepted_terms, created_at, updated_at, email_verified, language, reset_digest, reset_sent_at, activation_digest, activated_at, deleted, role_id) VALUES %s RETURNING id, email;"
+        with self.cursor() as cur:
+            created = psycopg2.extras.execute_values(cur, sql, rows, page_size=1000, fetch=True)
+        self.logger.debug("created {} users".format(len(created)))
+        return { email: id for (id, email) in created }
+
+    @transactional
+    def bulk_create_rooms(self, rooms):
+        """ create many rooms with one query for the owners, one for the existing uids and one insert
+
+        rooms: list of dicts with the email of the owner and optional meetingName, meetingUID, room_settings, bbb_id, attendeePW, moderatorPW and accessCode (see create_room)
+        returns the ids of the created rooms by uid
+        """
+        if not rooms:
+            return {}
+        sql = "SELECT email, id from users where email = ANY(%s);"
+        user_ids = dict(self.execute(sql, (list(set([room['email'] for room in rooms])), ))[1])
+        sql = "SELECT uid from rooms where uid = ANY(%s);"
+        existing = set([row[0] for row in self.execute(sql, ([room['meetingUID'] for room in rooms if room.get('meetingUID')], ))[1]])
+        default_settings = json.dumps({"muteOnStart":True,"requireModeratorApproval":False,"anyoneCanStart":False,"joinModerator":False})
+        rows = []
+        for room in rooms:
+            email = room['email']
+            meetingName = room.get('meetingName') or email
+            if email not in user_ids:
+                self.logger.error("user {} does not exist. Could not create room {} for this user.".format(email, meetingName))
+                continue
+            meetingUID = room.get('meetingUID') or self.random_secret()
+            if meetingUID in existing:
+                self.logger.error("room {} does already exist. Could not create room {}.".format(meetingUID, meetingName))
+                continue
+            existing.add(meetingUID)
+            rows.append((user_ids[email], meetingName, meetingUID, room.get('bbb_id') or uuid.uuid4().hex, 0, None, self.NOW, self.NOW, room.get('room_settings') or default_settings, room.get('moderatorPW') or self.random_secret(), room.get('attendeePW') or self.random_secret(), room.get('accessCode'), False))
+        if not rows:
+            return {}
+        self.invalidate('rooms')
+        sql = "INSERT INTO rooms (user_id, name, uid, bbb_id, sessions, last_session, created_at, updated_at, room_settings, moderator_pw, attendee_pw, access_code, deleted) VALUES %s RETURNING id, uid;"
+        with self.cursor() as cur:
+            created = psycopg2.extras.execute_values(cur, sql, rows, page_size=1000, fetch=True)
+        self.logger.debug("created {} rooms".format(len(created)))
+        return { uid: id for (id, uid) in created }
+
+    @transactional
     def rename_room(self, old_value, new_value, rename_by='uid'):
         if rename_by not in ['uid', 'name']:
             self.logger.error("renaming rooms is only allowed by uid or name. given: {}".format(rename_by))
             return 0
         sql = "Update rooms set {} = %s where {} = %s".format(rename_by, rename_by)
+        self.invalidate('rooms')
         data = (new_value, old_value, )
-        self.cur.execute(sql, data) # Note: no % operator
-        self.con.commit() # <- We MUST commit to reflect the inserted data
-        return self.cur.rowcount
+        return self.execute(sql, data)[0]
     
+    @transactional
     def share_room(self, room_id, email, share_by='room_id'):
         user_id = self.get_id_by_email(email)
         if not user_id:
@@ -204,21 +558,95 @@ class greenLight:
     
         sql = "INSERT INTO shared_accesses(room_id, user_id, created_at, updated_at) VALUES(%s, %s, %s, %s)"
         data = (room_id, user_id, self.NOW, self.NOW, )
-        self.cur.execute(sql, data) # Note: no % operator
-        self.con.commit() # <- We MUST commit to reflect the inserted data
-        return self.cur.rowcount
+        return self.execute(sql, data)[0]
     
+    @transactional
+    def share_rooms(self, room_id, emails, share_by='room_id'):
+        """ share a room with many users with one query for the users and one insert
+
+        users the room is already shared with are skipped
+        returns the emails of the users the room is shared with, including the ones it was shared with before
+        """
+        #get room_id if not provided
+        if share_by != 'room_id':
+            room_id = self.get_table_field('rooms', share_by, room_id, 'id')
+        if not room_id:
+            self.logger.error("room {} does not exist. Could not share room with {}.".format(room_id, ", ".join(emails)))
+            return []
+        sql = "SELECT users.email, users.id, shared_accesses.id from users left join shared_accesses on shared_accesses.user_id = users.id and shared_accesses.room_id = %s where users.email = ANY(%s);"
+        users = {}
+        for (email, user_id, shared_id) in self.execute(sql, (room_id, list(emails), ))[1]:
+            users[email] = (user_id, shared_id)
+        rows = {}
+        for email in emails:
+            if email not in users:
+                self.logger.error("user {} does not exist. Could not share room {} with this user.".format(email, room_id))
+            elif not users[email][1]:
+                rows[users[email][0]] = (room_id, users[email][0], self.NOW, self.NOW)
+        if rows:
+            sql = "INSERT INTO shared_accesses(room_id, user_id, created_at, updated_at) VALUES %s"
+            with self.cursor() as cur:
+                psycopg2.extras.execute_values(cur, sql, list(rows.values()), page_size=1000)
+            self.logger.debug("shared room {} with {} users".format(room_id, len(rows)))
+        return [email for email in emails if email in users]
+
+    @transactional
+    def unshare_rooms(self, room_id, emails, share_by='room_id'):
+        """ unshare a room with many users with one delete
+
+        returns the emails of the users the room was unshared with
+        """
+        #get room_id if not provided
+        if share_by != 'room_id':
+            room_id = self.get_table_field('rooms', share_by, room_id, 'id')
+        if not room_id:
+            self.logger.error("room {} does not exist. Could not unshare room with {}.".format(room_id, ", ".join(emails)))
+            return []
+        sql = "DELETE from shared_accesses USING users WHERE shared_accesses.user_id = users.id and shared_accesses.room_id = %s and users.email = ANY(%s) RETURNING users.email;"
+        unshared = set([row[0] for row in self.execute(sql, (room_id, list(emails), ))[1]])
+        return [email for email in emails if email in unshared]
+
     def show_table(self, table):
         sql = "SELECT * from {};".format(table)
-        self.cur.execute(sql)
-        return self.cur.fetchall()
+        return self.execute(sql)[1]
     
+    def prefetch(self, emails, uids):
+        """ load the users with their home rooms by email and the rooms by uid into the lookup cache
+
+        the lookups of get_id_by_email, get_field_by_email, get_table_field and table_row_as_dict for these users and rooms are answered from the cache afterwards
+        returns the number of users and rooms loaded
+        """
+        if self.cache.maxsize <= 0 or self.cache.ttl <= 0:
+            return (0, 0)
+        self.poll_notifications()
+        users = 0
+        rooms = {}
+        if emails:
+            sql = "SELECT users.id, users.email, users.room_id, rooms.* from users left join rooms on rooms.id = users.room_id where users.email = ANY(%s);"
+            for row in self.execute(sql, (list(emails), ))[1]:
+                (user_id, email, room_id) = row[:3]
+                self.cache.set(('users', 'email', email, 'id'), (user_id, ))
+                self.cache.set(('users', 'email', email, 'room_id'), (room_id, ))
+                if row[3] is not None:
+                    rooms[row[3]] = row[3:]
+                users += 1
+        if uids:
+            sql = "SELECT * from rooms where uid = ANY(%s);"
+            for row in self.execute(sql, (list(uids), ))[1]:
+                rooms[row[0]] = row
+        for room_id in rooms:
+            room = dict(zip(self.roomsTableList, rooms[room_id]))
+            self.cache.set(('rooms', 'id', room_id, '*'), rooms[room_id])
+            self.cache.set(('rooms', 'id', room_id, 'uid'), (room['uid'], ))
+            self.cache.set(('rooms', 'uid', room['uid'], 'id'), (room_id, ))
+        self.logger.debug("prefetched {} users and {} rooms".format(users, len(rooms)))
+        return (users, len(rooms))
+
     def get_id_by_email(self, email):
         self.logger.debug("fetching user_id of {}".format(email))
         sql = "SELECT id from users where email = '{}';".format(email)
-        self.cur.execute(sql)
         try:
-            id = self.cur.fetchall()[0][0]
+            id = self.cached_row(('users', 'email', email, 'id'), sql)[0]
         except IndexError as ERR:
             self.logger.error("Error: no user {} found. {}".format(email, ERR))
             return 0
@@ -227,9 +655,8 @@ class greenLight:
     def get_field_by_email(self, email, field='room_id'):
         self.logger.debug("fetching {} of {}".format(field, email))
         sql = "SELECT {} from users where email = '{}';".format(field, email)
-        self.cur.execute(sql)
         try:
-            id = self.cur.fetchall()[0][0]
+            id = self.cached_row(('users', 'email', email, field), sql)[0]
         except IndexError as ERR:
             self.logger.error("Error: no user {} found. {}".format(email, ERR))
             return 0
@@ -238,14 +665,14 @@ class greenLight:
     def get_table_field(self, table, key, value, field='room_id'):
         self.logger.debug("fetching {} of {} {}".format(field, key, value))
         sql = "SELECT {} from {} where {} = '{}';".format(field, table, key, value)
-        self.cur.execute(sql)
         try:
-            id = self.cur.fetchall()[0][0]
+            id = self.cached_row((table, key, value, field), sql)[0]
         except IndexError as ERR:
             self.logger.error("Error: no {} {} found. {}".format(key, value, ERR))
             return 0
         return id
     
+    @transactional
     def unshare_room(self, room_id, email, share_by='room_id'):
         user_id = self.get_id_by_email(email)
         if not user_id:
@@ -260,47 +687,41 @@ class greenLight:
             return 0
 
         sql = "DELETE from shared_accesses WHERE room_id =  '{}' and user_id = '{}';".format(room_id, user_id)
-        self.cur.execute(sql)
-        self.con.commit() # <- We MUST commit to reflect the deleted data
-        return self.cur.rowcount
+        return self.execute(sql)[0]
     
+    @transactional
     def delete_room(self, room_id, delete_by='uid'):
         self.logger.debug("deleting room {} {}".format(delete_by, room_id))
-        sql = "SELECT id from rooms where {} = '{}';".format(delete_by, room_id)
-        self.cur.execute(sql)
-        try:
-            id = self.cur.fetchall()[0][0]
-        except IndexError as ERR:
-            self.logger.error("Error: no room {} {} found. {}".format(delete_by, room_id, ERR))
-            return 0
-        room_id = int(id)
-    
-        sql = "DELETE from rooms WHERE id = '{}';".format(room_id)
-        self.cur.execute(sql)
-        self.con.commit() # <- We MUST commit to reflect the deleted data
-        res = self.cur.rowcount
-        if res > 0:
-            self.logger.debug("deleted room {} {}".format(delete_by, room_id))
-            # delete home room entry if available
-            res3 = self.update_field('users', 'room_id', room_id, 'room_id', None)
-            if res3 > 0:
-                self.logger.debug("deleted homeroom")
-            # delete shared rooms entries of this room
-            sql = "DELETE from shared_accesses WHERE room_id = '{}';".format(room_id)
-            self.cur.execute(sql)
-            self.con.commit() # <- We MUST commit to reflect the deleted data
-            res2 = self.cur.rowcount
-            if res2 > 0:
-                self.logger.debug("deleted {} shared rooms".format(res2))
-        else:
-            self.logger.debug("could not delete room {} {}".format(delete_by, room_id))
+        res = len(self.delete_rooms([room_id], delete_by))
+        if res == 0:
+            self.logger.error("Error: no room {} {} found.".format(delete_by, room_id))
         return res
+
+    @transactional
+    def delete_rooms(self, rooms, delete_by='uid'):
+        """ delete many rooms with their home room entries and shares in one transaction
+
+        returns the ids of the deleted rooms
+        """
+        if not rooms:
+            return []
+        sql = "DELETE from rooms WHERE {} = ANY(%s) RETURNING id;".format(delete_by)
+        self.invalidate('rooms', 'users')
+        room_ids = [row[0] for row in self.execute(sql, (list(rooms), ))[1]]
+        if room_ids:
+            self.logger.debug("deleted rooms {}".format(", ".join([str(room_id) for room_id in room_ids])))
+            # delete home room entries
+            sql = "Update users set room_id = NULL where room_id = ANY(%s);"
+            self.logger.debug("deleted {} home rooms".format(self.execute(sql, (room_ids, ))[0]))
+            # delete shared rooms entries of these rooms
+            sql = "DELETE from shared_accesses WHERE room_id = ANY(%s);"
+            self.logger.debug("deleted {} shared rooms".format(self.execute(sql, (room_ids, ))[0]))
+        return room_ids
     
     def table_rows_as_dict(self, table, field, value, column_list):
         sql = "SELECT * from {} where {} like '{}';".format(table, field, value)
-        self.cur.execute(sql)
         tableRows = {}
-        for row in self.cur.fetchall():
+        for row in self.execute(sql)[1]:
             tableRow = []
             for i in range(len(row)):
                 tableRow.append(row[i])
@@ -310,16 +731,14 @@ class greenLight:
     
     def table_row_as_dict(self, table, field, value, column_list):
         sql = "SELECT * from {} where {} = '{}';".format(table, field, value)
-        self.cur.execute(sql)
-        row = self.cur.fetchall()[0]
+        row = self.cached_row((table, field, value, '*'), sql)
         tableRow = []
         for i in range(len(row)):
             tableRow.append(row[i])
         return dict(zip(column_list, tableRow))
     
     def close(self):
-        self.cur.close()
-        self.con.close()
+        self.pool.closeall()
 
     def random_secret(self, stringLength=11):
         lettersAndDigits = string.ascii_letters + string.digits
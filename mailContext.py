@@ -0,0 +1,104 @@
+#
+# scheduLight - automation tool for BigBlueButton and Greenlight
+# copyright Martin Thomas Schrott 2020
+#
+# This file is part of scheduLight
+# scheduLight is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# You should have received a copy of the GNU General Public License along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+#
+from collections import namedtuple
+from collections.abc import Mapping
+
+# the fields available in the templates of each mail type
+# the recipient fields (mailFrom, mailFromName, mailTo, mailToName) are added when the mail is rendered
+ownerInfo = namedtuple('ownerInfo', ['meetingName', 'meetingLink', 'startDate'], defaults=(None,))
+ownerStarted = namedtuple('ownerStarted', ['meetingName', 'meetingLink'])
+ownerReminder = namedtuple('ownerReminder', ['meetingName', 'meetingLink', 'minutesLeft'])
+share = namedtuple('share', ['meetingName', 'meetingLink', 'ownerFullName'])
+invitation = namedtuple('invitation', ['meetingName', 'meetingLink', 'ownerFullName', 'startDate'], defaults=(None,))
+moderator = namedtuple('moderator', ['meetingName', 'moderatorLink', 'ownerFullName', 'startDate'], defaults=(None,))
+roomShared = namedtuple('roomShared', ['command', 'roomUID', 'meetingLink'])
+roomUnshared = namedtuple('roomUnshared', ['command', 'roomUID', 'meetingLink'])
+digest = namedtuple('digest', ['items'])
+
+contexts = {
+    'ownerInfo': ownerInfo,
+    'ownerStarted': ownerStarted,
+    'ownerReminder': ownerReminder,
+    'share': share,
+    'invitation': invitation,
+    'moderator': moderator,
+    'roomShared': roomShared,
+    'roomUnshared': roomUnshared,
+    'digest': digest,
+}
+
+recipientFields = ['mailFrom', 'mailFromName', 'mailTo', 'mailToName']
+# fields differing between the recipients of one meeting, filled into the text rendered once per meeting
+personalFields = ['mailTo', 'mailToName', 'moderatorLink']
+
+def legacy_vars(context):
+    """ vars dict as used by templates written for vars=locals() """
+    legacy = {}
+    for field in ['meetingName', 'meetingLink', 'moderatorLink', 'minutesLeft', 'command', 'items']:
+        if field in context:
+            legacy[field] = context[field]
+    if 'roomUID' in context:
+        legacy['cElement'] = context['roomUID']
+    legacy['mDict'] = {'meetingName': context.get('meetingName'), 'owner': {'fullName': context.get('ownerFullName')}}
+    if context.get('startDate'):
+        legacy['mDict']['startDate'] = context['startDate']
+    legacy['mail_properties'] = { field: context[field] for field in recipientFields if field in context }
+    return legacy
+
+class lazyVars(Mapping):
+    """ builds the vars shim only if a template accesses it """
+    def __init__(self, context):
+        self.context = context
+        self.legacy = None
+
+    def vars(self):
+        if self.legacy is None:
+            self.legacy = legacy_vars(self.context)
+        return self.legacy
+
+    def __getitem__(self, key):
+        return self.vars()[key]
+
+    def __iter__(self):
+        return iter(self.vars())
+
+    def __len__(self):
+        return len(self.vars())
+
+def template_context(mail_properties):
+    """ context to render the template of a mail job with
+
+    The fields of the mail type and the recipient fields are available by name.
+    Custom templates written for vars=locals() keep working with the vars shim.
+    """
+    params = mail_properties.get('params', {})
+    if 'mDict' in params:
+        # job queued with the vars of the template, provide the fields by name as well
+        context = { field: params[field] for field in params if field not in ['mDict', 'cElement'] }
+        context['ownerFullName'] = params['mDict']['owner']['fullName']
+        context['startDate'] = params['mDict'].get('startDate')
+        if 'cElement' in params:
+            context['roomUID'] = params['cElement']
+    elif mail_properties.get('type') in contexts:
+        context = contexts[mail_properties['type']](**params)._asdict()
+    else:
+        context = dict(params)
+    for field in recipientFields:
+        if field in mail_properties:
+            context[field] = mail_properties[field]
+    context['vars'] = lazyVars(dict(context))
+    return context
+
+def with_fields(context, values):
+    """ copy of the context with the given fields replaced """
+    context = { field: context[field] for field in context if field != 'vars' }
+    context.update(values)
+    context['vars'] = lazyVars(dict(context))
+    return context
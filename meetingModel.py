@@ -0,0 +1,146 @@
+#
+# scheduLight - automation tool for BigBlueButton and Greenlight
+# copyright Martin Thomas Schrott 2020
+#
+# This file is part of scheduLight
+# scheduLight is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# You should have received a copy of the GNU General Public License along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# fields of the mail jobs, set on the server and overridden by the meeting
+mailFields = ['mailFrom', 'mailFromName', 'mailTo', 'mailToName']
+# templates of the mail types and their defaults
+templateDefaults = {
+    'meetingOwnerInfoTemplate': "meetingOwnerInfoTemplate.j2",
+    'meetingOwnerStartedTemplate': "meetingOwnerStartedTemplate.j2",
+    'meetingOwnerReminderTemplate': "meetingOwnerReminderTemplate.j2",
+    'meetingShareInfoTemplate': "meetingShareInfoTemplate.j2",
+    'meetingInvitationInfoTemplate': "meetingInvitationInfoTemplate.j2",
+    'meetingModeratorInfoTemplate': "meetingModeratorInfoTemplate.j2",
+}
+
+def recipients(value):
+    """ email -> fullName of a recipient list, None if the list is not a dict """
+    if not isinstance(value, dict):
+        return None
+    recipientList = {}
+    for email in value:
+        fullName = None
+        if isinstance(value[email], dict):
+            fullName = value[email].get('fullName')
+        if not fullName:
+            fullName = email.partition('@')[0]
+        recipientList[email] = fullName
+    return recipientList
+
+class meetingModel:
+    """ a stored meeting with all defaults resolved
+
+    Built once per version of the meeting document and of its server config, the processor only reads attributes.
+    Parameters:
+        - mDict: the validated meeting document
+        - serverDict: the config of the server of the meeting
+        - defaults: minutes used if the meeting does not set them (preStartMinutes, preOpenMinutes, endAfterMinutes, reminderMinutes)
+        - get_date: parses the startDate
+    """
+    __slots__ = ('id', 'server', 'sendEmails', 'mailOverrides',
+        'hasOwner', 'ownerEmail', 'ownerFullName', 'socialUid', 'ownerPassword', 'ownerUid',
+        'meetingID', 'meetingName', 'meetingUID', 'accessCode', 'useHomeRoom',
+        'startDate', 'startTime', 'preStartMinutes', 'preOpenMinutes', 'endAfterMinutes', 'reminderMinutes',
+        'muteOnStart', 'welcome', 'bannerText', 'maxParticipants', 'logoutURL', 'record', 'duration', 'autoStartRecording', 'allowStartStopRecording',
+        'liveStreaming', 'streamTarget', 'streamerHost', 'playIntro',
+        'ownerInfoTemplate', 'ownerStartedTemplate', 'ownerReminderTemplate', 'shareTemplate', 'invitationTemplate', 'moderatorTemplate',
+        'shareWith', 'sendInvitationLink', 'sendModeratorLink')
+
+    def __init__(self, mDict, serverDict, defaults, get_date):
+        self.id = mDict.get('id')
+        self.server = mDict['server']
+        self.sendEmails = mDict.get('send_emails', serverDict.get('send_emails', False))
+        # sender and receiver set on the server, overridden by the meeting
+        self.mailOverrides = {}
+        for field in mailFields:
+            if field in mDict:
+                self.mailOverrides[field] = mDict[field]
+            elif field in serverDict:
+                self.mailOverrides[field] = serverDict[field]
+
+        # owner
+        owner = mDict.get('owner')
+        self.hasOwner = isinstance(owner, dict)
+        if not self.hasOwner:
+            owner = {}
+        self.ownerEmail = None
+        self.ownerFullName = None
+        if owner.get('email'):
+            self.ownerEmail = owner['email'].lower()
+            self.ownerFullName = owner.get('fullName', owner['email'].partition('@')[0])
+        self.socialUid = owner.get('socialUid')
+        self.ownerPassword = owner.get('password')
+        self.ownerUid = owner.get('uid')
+
+        # room
+        self.meetingID = mDict.get('meetingID')
+        self.meetingName = mDict.get('meetingName', self.ownerFullName)
+        self.meetingUID = mDict.get('meetingUID')
+        self.accessCode = mDict.get('accessCode')
+        self.useHomeRoom = mDict.get('useHomeRoom') == True
+
+        # schedule
+        self.startDate = mDict.get('startDate')
+        self.startTime = None
+        if self.startDate:
+            self.startTime = get_date(self.startDate)
+        self.preStartMinutes = mDict.get('preStartMinutes', int(defaults['preStartMinutes']))
+        self.preOpenMinutes = mDict.get('preOpenMinutes', int(defaults['preOpenMinutes']))
+        self.endAfterMinutes = mDict.get('endAfterMinutes', int(defaults['endAfterMinutes']))
+        self.reminderMinutes = mDict.get('reminderMinutes', int(defaults['reminderMinutes'] or 0))
+
+        # meeting settings, __startDate__ in welcome and bannerText is replaced by the startDate
+        self.muteOnStart = mDict.get('muteOnStart')
+        self.welcome = mDict.get('welcome')
+        self.bannerText = mDict.get('bannerText')
+        if self.startDate:
+            if self.welcome:
+                self.welcome = self.welcome.replace('__startDate__', self.startDate)
+            if self.bannerText:
+                self.bannerText = self.bannerText.replace('__startDate__', self.startDate)
+        self.maxParticipants = mDict.get('maxParticipants')
+        self.logoutURL = mDict.get('logoutURL')
+        self.record = mDict.get('record')
+        self.duration = mDict.get('duration')
+        self.autoStartRecording = mDict.get('autoStartRecording')
+        self.allowStartStopRecording = mDict.get('allowStartStopRecording')
+
+        # liveStreaming, configured but without targetUrl or streamerHost it is not started
+        self.liveStreaming = 'liveStreaming' in mDict
+        liveStreaming = mDict.get('liveStreaming')
+        if not isinstance(liveStreaming, dict):
+            liveStreaming = {}
+        self.streamTarget = liveStreaming.get('targetUrl')
+        self.streamerHost = liveStreaming.get('streamerHost')
+        self.playIntro = liveStreaming.get('playIntro', "")
+
+        # templates
+        templates = { field: mDict.get(field, templateDefaults[field]) for field in templateDefaults }
+        self.ownerInfoTemplate = templates['meetingOwnerInfoTemplate']
+        self.ownerStartedTemplate = templates['meetingOwnerStartedTemplate']
+        self.ownerReminderTemplate = templates['meetingOwnerReminderTemplate']
+        self.shareTemplate = templates['meetingShareInfoTemplate']
+        self.invitationTemplate = templates['meetingInvitationInfoTemplate']
+        self.moderatorTemplate = templates['meetingModeratorInfoTemplate']
+
+        # recipients (email -> fullName)
+        self.shareWith = recipients(mDict.get('shareWith'))
+        self.sendInvitationLink = recipients(mDict.get('sendInvitationLink'))
+        self.sendModeratorLink = recipients(mDict.get('sendModeratorLink'))
+
+    def start_params(self):
+        """ the settings passed to start_meeting """
+        return (self.muteOnStart, self.welcome, self.bannerText, self.maxParticipants, self.logoutURL, self.record, self.duration, self.autoStartRecording, self.allowStartStopRecording)
+
+    def mail_addresses(self, mailFrom, mailFromName, mailTo, mailToName):
+        """ sender and receiver of a mail job, overridden if set on the server or the meeting """
+        addresses = {'mailFrom': mailFrom, 'mailFromName': mailFromName, 'mailTo': mailTo, 'mailToName': mailToName}
+        addresses.update(self.mailOverrides)
+        return addresses
@@ -10,7 +10,7 @@
 # You should have received a copy of the GNU General Public License along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
 #
 import logging.handlers
-import sys, os, logging, urllib, json
+import sys, os, logging, urllib, json, zlib, base64, hashlib
 import redis
 from bigbluebutton_api_python import BigBlueButton
 from bigbluebutton_api_python import util as bbbUtil
@@ -20,11 +20,22 @@ from socket import gethostbyname,gaierror
 import random
 import string
 import smtplib
+import time
 import jinja2
+import jinja2.meta
 from marshmallow import Schema, fields, INCLUDE, post_load, validates, ValidationError
 from schema import Schema as dictSchema
 from schema import And, Use, Optional, Regex, SchemaError
 import dataSchema
+import mailContext
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 class scheduLight:
     """ core functions for processing of commands and meetings  """
@@ -36,6 +47,30 @@ class scheduLight:
     bbbUrl = None
     # keep status entris for n seconds
     keep_redis_cache ="31536000"
+    # remove acknowledged stream entries older than n seconds
+    stream_retention = 604800
+    # run the stream compaction at most every n seconds
+    trim_interval = 3600
+    # queue the mails of a recipient list in chunks of n
+    fanout_chunk = 100
+    # compress mail jobs before queueing them
+    compress_mail_jobs = False
+    # codec of stored meeting and server documents, see encode_doc
+    doc_codec = 'msgpack+zlib' if msgpack else 'json'
+    # codec of archived meeting documents
+    archive_codec = 'msgpack+zlib' if msgpack else 'json+zlib'
+    # directory for the compiled bytecode of the templates (optional)
+    template_cache_dir = None
+    # template environment shared by all instances of this process
+    template_env = None
+    # keep about n mail jobs that could not be processed in mailDeadLetter
+    dead_letter_maxlen = 10000
+    # redis instance holding the meetings, servers and streams
+    redis_host = 'localhost'
+    redis_port = 6380
+    redis_db = 1
+    # consumer groups reading the streams
+    stream_groups = {'mailStream': 'mailNotifications', 'commandStream': 'commandNotifications'}
     # write to this logFile
     logFile = 'scheduLight.log'
     # define schemas
@@ -53,6 +88,28 @@ class scheduLight:
             self.keep_redis_cache = args.keep_redis_cache
         if 'logFile' in args: 
             self.logFile = args.logFile
+        if 'stream_retention' in args:
+            self.stream_retention = int(args.stream_retention)
+        if 'trim_interval' in args:
+            self.trim_interval = int(args.trim_interval)
+        if 'compress_mails' in args:
+            self.compress_mail_jobs = args.compress_mails
+        if 'template_cache_dir' in args:
+            self.template_cache_dir = args.template_cache_dir
+        if 'doc_codec' in args and args.doc_codec:
+            self.doc_codec = args.doc_codec
+        if 'redis_host' in args and args.redis_host:
+            self.redis_host = args.redis_host
+        if 'redis_port' in args and args.redis_port:
+            self.redis_port = int(args.redis_port)
+        if 'redis_db' in args and args.redis_db is not None:
+            self.redis_db = int(args.redis_db)
+        # last run of the compaction per stream
+        self.last_trim = {}
+        # mail texts rendered once per template and meeting, see render_mail
+        self.rendered = {}
+        # loaded template and if it prints the personal fields only as they are, by template name
+        self.plain_templates = {}
 
         ## create logger with 'scheduLight'
         self.logger = logging.getLogger('scheduLight')
@@ -73,8 +130,18 @@ class scheduLight:
         self.logger.addHandler(ch)
         #
 
+        # check the codecs of stored documents
+        for codec in [self.doc_codec, self.archive_codec]:
+            (format, plus, compression) = codec.partition('+')
+            if format not in ['json', 'msgpack'] or compression not in ['', 'zlib', 'zstd']:
+                self.logger.error("unknown document codec: {}".format(codec))
+                sys.exit()
+            if (format == 'msgpack' and msgpack is None) or (compression == 'zstd' and zstandard is None):
+                self.logger.error("document codec {} requires the python package {}".format(codec, 'msgpack' if format == 'msgpack' and msgpack is None else 'zstandard'))
+                sys.exit()
+
         # connect to redis db
-        self.r = redis.StrictRedis( host="localhost", port="6380", db=1, ssl=False, charset="utf-8", decode_responses=True)
+        self.r = redis.StrictRedis( host=self.redis_host, port=self.redis_port, db=self.redis_db, ssl=False, charset="utf-8", decode_responses=True)
         try:
             self.r.info()
         except redis.exceptions.ConnectionError as ERR:
@@ -95,9 +162,9 @@ class scheduLight:
 
     def init_bbb(self, server):
         servers = {}
-        res = self.r.get("server:{}".format(server))
+        res = self.get_server(server)
         if res:
-            servers[server] = json.loads(res)
+            servers[server] = res
             BBB_URL= servers[server]['BBB_URL']
             BBB_SECRET= servers[server]['BBB_SECRET']
             self.bbb = BigBlueButton(BBB_URL,BBB_SECRET)
@@ -111,16 +178,105 @@ class scheduLight:
         format_string = "%Y-%m-%d %H:%M"
         return datetime.strptime(dateString, format_string)
     
+    def get_template_env(self):
+        # create the template environment once per process
+        # compiled templates are cached and recompiled if the mtime of the template file changes
+        if scheduLight.template_env is None:
+            bytecode_cache = None
+            if self.template_cache_dir:
+                os.makedirs(self.template_cache_dir, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(self.template_cache_dir)
+            templateLoader = jinja2.FileSystemLoader(searchpath=os.path.dirname(__file__)+'/templates/')
+            scheduLight.template_env = jinja2.Environment(loader=templateLoader, auto_reload=True, bytecode_cache=bytecode_cache)
+        return scheduLight.template_env
+
+    def template_exists(self, template):
+        # check a mail template before jobs using it are queued
+        try:
+            self.get_template_env().get_template(template)
+        except jinja2.TemplateNotFound as ERR:
+            self.logger.error("Mail Template {} not found!".format(os.path.dirname(__file__)+'/templates/'+template))
+            return False
+        return True
+
+    def load_template(self, template):
+        # raises jinja2.TemplateNotFound
+        try:
+            return self.get_template_env().get_template(template)
+        except jinja2.TemplateNotFound as ERR:
+            self.logger.error("Mail Template {} not found!".format(os.path.dirname(__file__)+'/templates/'+template))
+            raise
+
     def render_template(self, template, **kwargs):
-        template_file = os.path.dirname(__file__)+'/templates/'+template
-        if not os.path.exists(template_file):
-            self.logger.error("Mail Template {} not found!".format(template_file))
-            sys.exit()
-        templateLoader = jinja2.FileSystemLoader(searchpath=os.path.dirname(__file__)+'/templates/')
-        templateEnv = jinja2.Environment(loader=templateLoader)
-        templ = templateEnv.get_template(template)
-        return templ.render(**kwargs)
-    
+        # raises jinja2.TemplateNotFound and the errors of rendering the template
+        return self.load_template(template).render(**kwargs)
+
+    def personal_fields_plain(self, template, seen=None):
+        """ check if the template and the templates it includes print the personal fields only as they are
+
+        A personal field may only be printed by {{ field }}, it must not be used in conditions, filters, assignments, macros or through vars.
+        """
+        env = self.get_template_env()
+        if seen is None:
+            seen = set()
+        if template in seen:
+            return True
+        seen.add(template)
+        ast = env.parse(env.loader.get_source(env, template)[0])
+        # blocks that change or capture the text printed inside them
+        if next(ast.find_all((jinja2.nodes.FilterBlock, jinja2.nodes.AssignBlock, jinja2.nodes.CallBlock, jinja2.nodes.Macro, jinja2.nodes.ScopedEvalContextModifier)), None) is not None:
+            return False
+        printed = set()
+        for output in ast.find_all(jinja2.nodes.Output):
+            printed.update(id(node) for node in output.nodes if isinstance(node, jinja2.nodes.Name))
+        for name in ast.find_all(jinja2.nodes.Name):
+            if name.name == 'vars' or (name.name in mailContext.personalFields and id(name) not in printed):
+                return False
+        for child in jinja2.meta.find_referenced_templates(ast):
+            if child is None or not self.personal_fields_plain(child, seen):
+                return False
+        return True
+
+    def render_mail(self, mail_properties):
+        """ render the template of a mail job, once per template and meeting
+
+        Templates printing the personal fields of the recipient only as they are (see personal_fields_plain) are rendered once with markers
+        in place of these fields, the text is reused for all recipients with the same remaining context and only the markers are replaced.
+        All other templates are rendered in full for every recipient.
+        """
+        template = mail_properties['template']
+        context = mailContext.template_context(mail_properties)
+        templ = self.load_template(template)
+        if template not in self.plain_templates or self.plain_templates[template][0] is not templ:
+            # the template was changed on disk, check it again
+            self.plain_templates[template] = (templ, self.personal_fields_plain(template))
+            if not self.plain_templates[template][1]:
+                self.logger.debug("template {} uses the personal fields, render it for every recipient".format(template))
+        if not self.plain_templates[template][1]:
+            return templ.render(**context)
+        personal = { field: context[field] for field in mailContext.personalFields if field in context }
+        for value in personal.values():
+            if not isinstance(value, str) or '\x00' in value:
+                return templ.render(**context)
+        invariant = json.dumps([template, { field: context[field] for field in context if field not in personal and field != 'vars' }], sort_keys=True, default=str)
+        if invariant not in self.rendered or self.rendered[invariant][0] is not templ:
+            markers = { field: "\x00{}\x00".format(field) for field in personal }
+            text = templ.render(**mailContext.with_fields(context, markers))
+            rest = text
+            for marker in markers.values():
+                rest = rest.replace(marker, '')
+            if '\x00' in rest:
+                # a marker was changed while rendering
+                self.logger.debug("template {} changes the personal fields, render it for every recipient".format(template))
+                text = None
+            self.rendered[invariant] = (templ, text)
+        text = self.rendered[invariant][1]
+        if text is None:
+            return templ.render(**context)
+        for field in personal:
+            text = text.replace("\x00{}\x00".format(field), personal[field])
+        return text
+
     def config_exists(self, my_dict, my_list):
         for my_item in my_list:
             if my_item not in my_dict:
@@ -131,6 +287,89 @@ class scheduLight:
         lettersAndDigits = string.ascii_letters + string.digits
         return ''.join((random.choice(lettersAndDigits) for i in range(stringLength)))
     
+    def queue_message(self, stream, item, pipe=None):
+        # add the item to the stream, it is only trimmed by trim_stream once it was acknowledged
+        if pipe is None:
+            pipe = self.r
+        return pipe.xadd(stream, item)
+
+    def encode_mail_job(self, job):
+        # serialize a mail job, optionally zlib compressed
+        raw = json.dumps(job, separators=(',', ':'))
+        if self.compress_mail_jobs:
+            return 'z:' + base64.b64encode(zlib.compress(raw.encode('utf-8'))).decode('ascii')
+        return raw
+
+    def decode_mail_job(self, raw):
+        if raw.startswith('z:'):
+            raw = zlib.decompress(base64.b64decode(raw[2:])).decode('utf-8')
+        return json.loads(raw)
+
+    def queue_mail(self, key, job, pipe=None):
+        # queue a mail job containing the server id, template name and template parameters
+        # the mailProcessor resolves the mail server credentials and renders the template
+        return self.queue_message('mailStream', { key: self.encode_mail_job(job) }, pipe)
+
+    def stream_id(self, id):
+        # split a stream id into a comparable tuple
+        (ms, seq) = id.split('-')
+        return (int(ms), int(seq))
+
+    def trim_stream(self, stream, group=None, force=False):
+        # remove acknowledged entries older than stream_retention seconds
+        if not group:
+            group = self.stream_groups[stream]
+        if not force and time.time() - self.last_trim.get(stream, 0) < self.trim_interval:
+            return None
+        self.last_trim[stream] = time.time()
+        minid = "{}-0".format(int((time.time() - self.stream_retention) * 1000))
+        # never trim entries that are still pending in the consumer group or were not delivered to it yet
+        try:
+            pending = self.r.xpending(stream, group)
+            groups = { info['name']: info for info in self.r.xinfo_groups(stream) }
+        except redis.exceptions.ResponseError as ERR:
+            self.logger.debug("could not fetch pending entries of {}: {}".format(stream, ERR))
+            return None
+        if group not in groups:
+            self.logger.debug("consumer group {} of {} does not exist, not trimming".format(group, stream))
+            return None
+        if pending['pending'] > 0 and self.stream_id(pending['min']) < self.stream_id(minid):
+            minid = pending['min']
+        (ms, seq) = self.stream_id(groups[group]['last-delivered-id'])
+        if (ms, seq + 1) < self.stream_id(minid):
+            minid = "{}-{}".format(ms, seq + 1)
+        trimmed = self.r.xtrim(stream, minid=minid, approximate=False)
+        retention_key = "stream:{}:retention".format(stream)
+        pipe = self.r.pipeline()
+        pipe.hincrby(retention_key, 'trimmed', trimmed)
+        pipe.hset(retention_key, mapping={'lastTrim': str(datetime.now()), 'lastTrimmed': trimmed, 'lastMinId': minid})
+        pipe.execute()
+        self.logger.debug("trimmed {} entries from {} (minid {})".format(trimmed, stream, minid))
+        return trimmed
+
+    def stream_stats(self, stream, group=None):
+        # collect retention metrics of a stream
+        if not group:
+            group = self.stream_groups[stream]
+        stats = {'stream': stream, 'length': self.r.xlen(stream), 'pending': 0, 'firstEntry': None, 'lastEntry': None}
+        try:
+            stats['pending'] = self.r.xpending(stream, group)['pending']
+        except redis.exceptions.ResponseError as ERR:
+            self.logger.debug("could not fetch pending entries of {}: {}".format(stream, ERR))
+        first = self.r.xrange(stream, count=1)
+        if first:
+            stats['firstEntry'] = first[0][0]
+        last = self.r.xrevrange(stream, count=1)
+        if last:
+            stats['lastEntry'] = last[0][0]
+        try:
+            stats['memoryBytes'] = self.r.memory_usage(stream)
+        except redis.exceptions.ResponseError as ERR:
+            stats['memoryBytes'] = None
+        stats['retentionSeconds'] = self.stream_retention
+        stats.update(self.r.hgetall("stream:{}:retention".format(stream)))
+        return stats
+
     def get_status(self, base, path, displayType='returnCode', type='meeting'):
         search_base = "{}:{}:status".format(type, base)
         search_path = str.join("_", path)
@@ -171,6 +410,312 @@ class scheduLight:
             self.logger.debug("set status: {} {} ({})".format(returnCode, message, search_path))    
             return True
 
+    def encode_doc(self, doc, codec=None):
+        """ serialize a meeting or server document for redis
+
+        codec: json, msgpack, optionally compressed with zlib or zstd (json+zlib, msgpack+zlib, msgpack+zstd...)
+        Documents not stored as plain json are prefixed with the version of the encoding and the codec (sl1:msgpack+zlib:)
+        and stored base64 encoded. Plain json documents stored by older versions are read as well.
+        """
+        codec = codec or self.doc_codec
+        if codec == 'json':
+            return json.dumps(doc)
+        (format, plus, compression) = codec.partition('+')
+        if format == 'msgpack':
+            raw = msgpack.packb(doc, use_bin_type=True)
+        else:
+            raw = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+        if compression == 'zlib':
+            raw = zlib.compress(raw)
+        elif compression == 'zstd':
+            raw = zstandard.ZstdCompressor().compress(raw)
+        return 'sl1:{}:{}'.format(codec, base64.b64encode(raw).decode('ascii'))
+
+    def decode_doc(self, raw):
+        # parse a document stored by encode_doc or as plain json
+        if not raw.startswith('sl1:'):
+            return json.loads(raw)
+        (prefix, codec, raw) = raw.split(':', 2)
+        raw = base64.b64decode(raw)
+        (format, plus, compression) = codec.partition('+')
+        if compression == 'zlib':
+            raw = zlib.decompress(raw)
+        elif compression == 'zstd':
+            raw = zstandard.ZstdDecompressor().decompress(raw)
+        if format == 'msgpack':
+            return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+        return json.loads(raw.decode('utf-8'))
+
+    def get_server(self, id):
+        # the config of a server or None
+        raw = self.r.get('server:{}'.format(id))
+        if raw is None:
+            return None
+        return self.decode_doc(raw)
+
+    def store_server(self, id, doc, expire=None, pipe=None):
+        # store the config of a server, returns the version of the stored document
+        raw = self.encode_doc(doc)
+        p = pipe if pipe is not None else self.r
+        p.set('server:{}'.format(id), raw, ex=expire)
+        return self.doc_version(raw)
+
+    def doc_version(self, raw):
+        # version of a stored document: the hash of its content
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        return hashlib.sha1(raw).hexdigest()
+
+    def config_hash(self, entry):
+        # hash of a config entry and the codec it is stored with, unchanged entries are not written again
+        return hashlib.sha1(json.dumps([self.doc_codec, entry], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def store_meeting(self, id, doc, expire=None, pipe=None):
+        """ store a meeting document together with its version
+
+        returns the version of the stored document
+        """
+        raw = self.encode_doc(doc)
+        version = self.doc_version(raw)
+        p = pipe if pipe is not None else self.r.pipeline()
+        p.set('meeting:{}'.format(id), raw, ex=expire)
+        p.set('meeting:{}:version'.format(id), version, ex=expire)
+        if pipe is None:
+            p.execute()
+        return version
+
+    def ingest_meeting(self, doc):
+        """ validate a meeting before it is stored and normalize it
+
+        returns the validation errors and the normalized document
+        """
+        errors = self.meeting_schema.validate(doc)
+        if errors:
+            return (errors, None)
+        doc = dict(doc)
+        if isinstance(doc.get('owner'), dict) and isinstance(doc['owner'].get('email'), str):
+            doc['owner'] = dict(doc['owner'])
+            doc['owner']['email'] = doc['owner']['email'].lower().strip()
+        return ({}, doc)
+
+    def load_meetings(self, meetings, models=None):
+        """ load meeting documents with one request
+
+        Documents stored with their version were validated when they were stored and are not validated again.
+        Documents stored by older versions are validated once, invalid ones are skipped.
+        models: the parsed documents by version returned before, reused for unchanged documents
+        returns the parsed documents and their versions by meeting
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for meeting in meetings:
+            pipe.get('meeting:{}'.format(meeting))
+            pipe.get('meeting:{}:version'.format(meeting))
+        res = pipe.execute()
+        docs = {}
+        versions = {}
+        for (meeting, raw, stored_version) in zip(meetings, res[0::2], res[1::2]):
+            if raw is None:
+                self.logger.error("meeting {} not found".format(meeting))
+                continue
+            version = self.doc_version(raw)
+            if models is not None and version in models:
+                doc = models[version]
+            else:
+                doc = self.decode_doc(raw)
+                if stored_version != version:
+                    errors = self.meeting_schema.validate(doc)
+                    if errors:
+                        self.logger.error("please provide all required fields for the meeting {}: {}".format(meeting, errors))
+                        continue
+            docs[meeting] = doc
+            versions[meeting] = version
+        return (docs, versions)
+
+    def archive_meeting(self, id, expire=None):
+        """ move a meeting that can not produce any more work from meetings to archivedMeetings
+
+        The document is stored compressed (archive_codec) together with its version, the status is kept.
+        expire: remove the archived meeting and its status after n seconds (optional)
+        returns True if the meeting was archived
+        """
+        key = 'meeting:{}'.format(id)
+        with self.r.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                raw = pipe.get(key)
+                if raw is None:
+                    return False
+                pipe.multi()
+                pipe.hset('meeting:{}:archive'.format(id), mapping={
+                    'doc': self.encode_doc(self.decode_doc(raw), self.archive_codec),
+                    'version': self.doc_version(raw),
+                    'date': str(datetime.now()),
+                })
+                pipe.delete(key, 'meeting:{}:version'.format(id))
+                pipe.smove('meetings', 'archivedMeetings', id)
+                if expire:
+                    pipe.expire('meeting:{}:archive'.format(id), expire)
+                    pipe.expire('meeting:{}:status'.format(id), expire)
+                pipe.execute()
+                self.logger.debug("archived meeting {}".format(id))
+                return True
+            except redis.WatchError:
+                self.logger.debug("meeting {} was changed while archiving, not archiving".format(id))
+                return False
+
+    def archived_meetings(self):
+        # ids of the archived meetings, meetings whose archive expired are removed from the set
+        meetings = list(self.r.smembers('archivedMeetings'))
+        pipe = self.r.pipeline(transaction=False)
+        for meeting in meetings:
+            pipe.exists('meeting:{}:archive'.format(meeting))
+        expired = [ meeting for (meeting, exists) in zip(meetings, pipe.execute()) if not exists ]
+        if expired:
+            self.r.srem('archivedMeetings', *expired)
+        return [ meeting for meeting in meetings if meeting not in expired ]
+
+    def archived_meeting(self, id):
+        """ the document and version of an archived meeting
+
+        returns (doc, version) or (None, None) if the meeting is not archived
+        """
+        (doc, version) = self.r.hmget('meeting:{}:archive'.format(id), ['doc', 'version'])
+        if doc is None:
+            return (None, None)
+        return (self.decode_doc(doc), version)
+
+    def drop_archive(self, id, pipe=None):
+        # forget the archived document of a meeting
+        p = pipe if pipe is not None else self.r.pipeline()
+        p.delete('meeting:{}:archive'.format(id))
+        p.srem('archivedMeetings', id)
+        if pipe is None:
+            p.execute()
+
+    def restore_meeting(self, id):
+        """ move an archived meeting back to meetings
+
+        The status of the meeting is set to 200, the status of sent mails and shared rooms is kept.
+        returns True if the meeting was restored
+        """
+        (doc, version) = self.archived_meeting(id)
+        if doc is None:
+            return False
+        pipe = self.r.pipeline()
+        self.store_meeting(id, doc, pipe=pipe)
+        self.drop_archive(id, pipe)
+        pipe.sadd('meetings', id)
+        pipe.persist('meeting:{}:status'.format(id))
+        pipe.execute()
+        self.set_status(id, ['status'], '200', 'restored from archive')
+        self.logger.debug("restored meeting {}".format(id))
+        return True
+
+    def get_status_many(self, base, paths, type='meeting'):
+        # fetch the returnCodes of many status paths with one request
+        search_base = "{}:{}:status".format(type, base)
+        returnCodes = []
+        for statusList in self.r.hmget(search_base, [str.join("_", path) for path in paths]):
+            returnCode = None
+            if statusList != None:
+                statusList = json.loads(statusList)
+                if isinstance(statusList, list) and statusList:
+                    returnCode = statusList[-1].split("|")[1]
+            returnCodes.append(returnCode)
+        return returnCodes
+
+    def set_status_many(self, base, entries, type='meeting'):
+        # set the status of many paths with one request. entries: list of (path, returnCode, message)
+        if not entries:
+            return 0
+        search_base = "{}:{}:status".format(type, base)
+        search_paths = [str.join("_", path) for (path, returnCode, message) in entries]
+        newStatus = {}
+        for (entry, search_path, oldStatus) in zip(entries, search_paths, self.r.hmget(search_base, search_paths)):
+            (path, returnCode, message) = entry
+            if search_path in newStatus:
+                oldStatus = newStatus[search_path]
+            statusList = []
+            if oldStatus != None:
+                statusList = json.loads(oldStatus)
+                if not isinstance(statusList, list):
+                    statusList = []
+            if statusList and statusList[-1].split('|')[1] == returnCode:
+                continue
+            statusList.append("{}|{}|{}".format(self.NOW, returnCode, message))
+            newStatus[search_path] = json.dumps(statusList)
+            self.logger.debug("set status: {} {} ({})".format(returnCode, message, search_path))
+        if newStatus:
+            pipe = self.r.pipeline()
+            pipe.hset(search_base, mapping=newStatus)
+            pipe.expire(search_base, self.keep_redis_cache)
+            pipe.execute()
+        return len(newStatus)
+
+    def fanout_pending(self, base, name, recipients, done_status, type='meeting'):
+        """ recipients of the list name that are not completed yet
+
+        Completed recipients are kept in a set, a fan-out is marked complete with the digest of its recipients.
+        Once all recipients are completed, the list is skipped with a single request until it changes.
+        done_status: the (path, returnCode) status entries below [name, recipient] marking a recipient as completed
+        """
+        if not recipients:
+            return []
+        digest = self.fanout_digest(recipients)
+        fanout_key = "{}:{}:fanout".format(type, base)
+        if self.r.hget(fanout_key, name) == digest:
+            return []
+        done = self.r.smembers("{}:{}:fanout:{}".format(type, base, name))
+        if not done:
+            # take over the recipients completed according to their status entries
+            paths = [ [name, recipient] + path for recipient in recipients for (path, returnCode) in done_status ]
+            returnCodes = iter(self.get_status_many(base, paths, type))
+            for recipient in recipients:
+                if all([next(returnCodes) == returnCode for (path, returnCode) in done_status]):
+                    done.add(recipient)
+            self.fanout_done(base, name, list(done), type)
+        pending = [ recipient for recipient in recipients if recipient not in done ]
+        if not pending:
+            pipe = self.r.pipeline()
+            pipe.hset(fanout_key, name, digest)
+            pipe.expire(fanout_key, self.keep_redis_cache)
+            pipe.execute()
+            self.logger.debug("fan-out {} of {} complete".format(name, base))
+        return pending
+
+    def fanout_digest(self, recipients):
+        # digest of a recipient list, marks the fan-out to exactly these recipients as complete
+        return hashlib.sha1('\n'.join(sorted(recipients)).encode('utf-8')).hexdigest()
+
+    def fanout_complete(self, base, lists, type='meeting'):
+        # check with one request if the fan-outs to all recipient lists (name -> recipients) are complete
+        lists = { name: recipients for (name, recipients) in lists.items() if recipients }
+        if not lists:
+            return True
+        digests = self.r.hmget("{}:{}:fanout".format(type, base), list(lists))
+        return all([ digest == self.fanout_digest(recipients) for (digest, recipients) in zip(digests, lists.values()) ])
+
+    def fanout_done(self, base, name, recipients, type='meeting'):
+        # mark recipients of the list name as completed
+        if not recipients:
+            return 0
+        done_key = "{}:{}:fanout:{}".format(type, base, name)
+        pipe = self.r.pipeline()
+        pipe.sadd(done_key, *recipients)
+        pipe.expire(done_key, self.keep_redis_cache)
+        return pipe.execute()[0]
+
+    def reset_fanout(self, base, name=None, type='meeting', pipe=None):
+        # forget the completed recipients, they are taken over from the status entries again
+        fanout_key = "{}:{}:fanout".format(type, base)
+        names = [name] if name else self.r.hkeys(fanout_key) + ['shareWith', 'sendInvitationLink', 'sendModeratorLink']
+        p = pipe if pipe is not None else self.r.pipeline()
+        for name in set(names):
+            p.hdel(fanout_key, name)
+            p.delete("{}:{}:fanout:{}".format(type, base, name))
+        if pipe is None:
+            p.execute()
+
     def meeting_info(self, bbb_id):
         try:
             minfo = self.bbb.get_meeting_info(bbb_id)
@@ -26,11 +26,15 @@ import dataSchema
 from scheduLight import scheduLight
 
 def get_meeting_by_id(meeting_id):
-    return sl.r.get('meeting:{}'.format(meeting_id))
+    # the stored document as dict, documents are stored in the codec of scheduLight and returned as json
+    meeting = sl.r.get('meeting:{}'.format(meeting_id))
+    if meeting is None:
+        return None
+    return sl.decode_doc(meeting)
 
 
 def get_server_by_id(server_id):
-    return sl.r.get('server:{}'.format(server_id))
+    return sl.get_server(server_id)
 
 class servers(Resource):
     def get(self):
@@ -42,7 +46,7 @@ class servers(Resource):
         if errors:
             abort(400, str(errors))
         sl.r.sadd('servers', args['id'])
-        sl.r.set('server:{}'.format(args['id']), json.dumps(args))
+        sl.store_server(args['id'], args)
         return {"message": "server added", "data": args}, 201
 
 class server(Resource):
@@ -50,7 +54,7 @@ class server(Resource):
         server = get_server_by_id(id)
         if not server:
             return {"message": "server not found"}, 404 
-        return { 'message': 'server found', 'data': server}, 200 
+        return { 'message': 'server found', 'data': json.dumps(server)}, 200 
 
     def put(self, id):
         args = request.get_json()
@@ -59,7 +63,7 @@ class server(Resource):
             abort(400, str(errors))
         server = get_server_by_id(id)
         if server:
-            sl.r.set('server:{}'.format(id), json.dumps(args))
+            sl.store_server(id, args)
             return { 'message': 'updated server', 'data': args}, 201
         else:
             return { 'message': 'no server with this id'}, 404
@@ -82,11 +86,12 @@ class meetings(Resource):
 
     def post(self):
         args = request.get_json()
-        errors = sl.meeting_schema.validate(args)
+        (errors, args) = sl.ingest_meeting(args)
         if errors:
             abort(400, str(errors))
         sl.r.sadd('meetings', args['id'])
-        sl.r.set('meeting:{}'.format(args['id']), json.dumps(args))
+        sl.store_meeting(args['id'], args)
+        sl.drop_archive(args['id'])
         return {"message": "meeting added", "data": args}, 201
 
 class meeting(Resource):
@@ -94,26 +99,27 @@ class meeting(Resource):
         meeting = get_meeting_by_id(id)
         if not meeting:
             return {"message": "meeting not found"}, 404 
-        return { 'message': 'meeting found', 'data': meeting}, 200 
+        return { 'message': 'meeting found', 'data': json.dumps(meeting)}, 200 
 
     def put(self, id):
         args = request.get_json()
-        errors = sl.meeting_schema.validate(args)
+        (errors, args) = sl.ingest_meeting(args)
         if errors:
             abort(400, str(errors))
         meeting = get_meeting_by_id(id)
         if meeting:
-            sl.r.set('meeting:{}'.format(id), json.dumps(args))
+            sl.store_meeting(id, args)
             return { 'message': 'updated meeting', 'data': args}, 201
         else:
             return { 'message': 'no meeting with this id'}, 404
 
     def delete(self, id):
         sl.r.srem('meetings', id)
-        sl.r.delete('meetings:{}:status'.format(id))
+        sl.r.delete('meeting:{}:status'.format(id))
+        sl.drop_archive(id)
         meeting = get_meeting_by_id(id)
         if meeting:
-            if sl.r.delete('meetings:{}'.format(id)):
+            if sl.r.delete('meeting:{}'.format(id), 'meeting:{}:version'.format(id)):
                 return {"message": "Deleted meeting {}".format(meeting['meetingName'])}, 204 
             else:
                 return {"message": "could not delete meeting {}".format(meeting['meetingName'])}, 404 
@@ -131,6 +137,8 @@ class meetingStatus(Resource):
         return { 'message': 'status found', 'data': status}, 200 
 
     def delete(self, id):
+        # recipients are taken over from the remaining status again
+        sl.reset_fanout(id)
         if sl.r.delete('meeting:{}:status'.format(id)):
             return {"message": "Deleted status {}".format(status_base)}, 204 
         else:
@@ -153,6 +161,7 @@ class meetingProcessStatus(Resource):
             abort(400, 'Please provide status_code and status_message: {}'.format(args_json))
         meeting = get_meeting_by_id(id)
         if meeting:
+            sl.reset_fanout(id, status_base.split('_')[0])
             if sl.set_status(id, status_base.split('_'), args['status_code'], args['status_message']):
                 return { 'message': 'set status', 'data': args_json}, 201
             else:
@@ -161,11 +170,30 @@ class meetingProcessStatus(Resource):
             return { 'message': 'no meeting with this id'}, 404
 
     def delete(self, id, status_base):
+        sl.reset_fanout(id, status_base.split('_')[0])
         if sl.r.hdel('meeting:{}:status'.format(id), status_base):
             return {"message": "Deleted status {}".format(status_base)}, 204 
         else:
             return {"message": "could not delete status {}".format(status_base)}, 404 
 
+class archivedMeetings(Resource):
+    def get(self):
+        return { 'message': 'found archived meetings', 'data': sl.archived_meetings()}, 200
+
+class archivedMeeting(Resource):
+    def get(self, id):
+        (meeting, version) = sl.archived_meeting(id)
+        if not meeting:
+            return {"message": "archived meeting not found"}, 404 
+        return { 'message': 'archived meeting found', 'data': meeting}, 200 
+
+class meetingRestore(Resource):
+    def post(self, id):
+        if sl.restore_meeting(id):
+            return { 'message': 'restored meeting {}'.format(id)}, 201
+        else:
+            return { 'message': 'no archived meeting with this id'}, 404
+
 class commands(Resource):
     def post(self):
         args = request.get_json()
@@ -173,20 +201,36 @@ class commands(Resource):
         if errors:
             abort(400, str(errors))
         try:
-            sl.r.xadd('commandStream', { args['command']: json.dumps(args) })
+            sl.queue_message('commandStream', { args['command']: json.dumps(args) })
             return {"message": "command queued successfully", "data": args}, 201
         except Exception as ERR:
             abort(400, str(ERR))
 
+class stream(Resource):
+    def get(self, name):
+        if name not in sl.stream_groups:
+            return {"message": "stream not found"}, 404
+        return { 'message': 'stream found', 'data': sl.stream_stats(name)}, 200
+
+    def delete(self, name):
+        if name not in sl.stream_groups:
+            return {"message": "stream not found"}, 404
+        trimmed = sl.trim_stream(name, force=True)
+        return { 'message': 'trimmed stream {}'.format(name), 'data': trimmed}, 200
+
 app = Flask(__name__)
 api = Api(app, prefix="/api/v1")
 api.add_resource(meetings, '/meetings')
 api.add_resource(meeting, '/meetings/<string:id>')
 api.add_resource(meetingStatus, '/meetings/<string:id>/status')
 api.add_resource(meetingProcessStatus, '/meetings/<string:id>/status/<string:status_base>')
+api.add_resource(meetingRestore, '/meetings/<string:id>/restore')
+api.add_resource(archivedMeetings, '/archivedMeetings')
+api.add_resource(archivedMeeting, '/archivedMeetings/<string:id>')
 api.add_resource(commands, '/commands')
 api.add_resource(servers, '/servers')
 api.add_resource(server, '/servers/<string:id>')
+api.add_resource(stream, '/streams/<string:name>')
 
 if __name__ == '__main__':
     app.debug = True 
@@ -198,4 +242,5 @@ if __name__ == '__main__':
 # example curl calls
 #curl -d '{"startDate": "2020-06-24 11:00", "id": "ms_tsy_at2", "meetingName": "test Meeting via Api", "owner": {"email": "ms@tsy.at", "fullName": "Martin T"}}' -H 'Content-Type: application/json' -X POST http://localhost:8008/api/v1/meetings
 #curl -X GET http://localhost:8008/api/v1/meetings
+#curl -X GET http://localhost:8008/api/v1/streams/mailStream
 # curl -d '{"command": "rename_room", "server": "server_to_use", "data": {"roomUID_to_rename": { "roomUID": "new_roomUID"}}}' -H 'Content-Type: application/json' -X POST http://localhost:8008/api/v1/commands
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# scheduLight - automation tool for BigBlueButton and Greenlight
+# copyright Martin Thomas Schrott 2020
+#
+# This file is part of scheduLight
+# scheduLight is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# You should have received a copy of the GNU General Public License along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
+#
+# benchmarks for the scheduLight pipelines
+# mail: starts a local smtp sink, floods the mailStream with synthetic mails and measures the mailProcessor
+#       the mails are queued to the mailStream of --redis_host/--redis_port/--redis_db, use a test redis instance
+#       the benchmarks writing to redis (mail, fanout) refuse to run against the default instance without --force
+# render: compares rendering the mail templates with the explicit context against the former vars=locals()
+#
+import logging.handlers
+import argparse, sys, os, logging, json
+import time
+import random
+import socketserver
+import ssl
+import subprocess
+import threading
+from scheduLight import scheduLight
+import mailContext
+
+BENCH_SERVER = 'slBenchmark'
+
+def parseArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", help="benchmark to run", choices=['mail', 'render', 'fanout'])
+    parser.add_argument("-g","--logFile", help="path to logFile in yaml format", default="./scheduLight.log")
+    parser.add_argument("-N","--mails", help="number of synthetic mails to queue", default=1000)
+    parser.add_argument("--smtp_host", help="address of the smtp sink", default="127.0.0.1")
+    parser.add_argument("--smtp_port", help="port of the smtp sink", default=2525)
+    parser.add_argument("--latency", help="delay every delivery in the smtp sink by n milliseconds", default=0)
+    parser.add_argument("--error_rate", help="reject this share of deliveries with a temporary error (0.0 - 1.0)", default=0.0)
+    parser.add_argument("--tls_cert", help="certificate to offer STARTTLS in the smtp sink")
+    parser.add_argument("--tls_key", help="key of the certificate to offer STARTTLS in the smtp sink")
+    parser.add_argument("--template", help="render this template for every mail instead of sending plain text")
+    parser.add_argument("--timeout", help="stop waiting for deliveries after n seconds", default=600)
+    parser.add_argument("--external_processor", help="do not start a mailProcessor, use a running one", action="store_true")
+    parser.add_argument("--processor_args", help="additional arguments for the started mailProcessor", default="")
+    parser.add_argument("--min_throughput", help="exit with an error if less than n mails per second were delivered", default=0)
+    parser.add_argument("--renders", help="number of renders per template for the render benchmark", default=2000)
+    parser.add_argument("--recipients", help="number of recipients of the meeting in the render and fanout benchmark", default=500)
+    parser.add_argument("--json", help="print the results as json", action="store_true")
+    parser.add_argument("--redis_host", help="host of the test redis instance (default localhost)")
+    parser.add_argument("--redis_port", help="port of the test redis instance (default 6380)")
+    parser.add_argument("--redis_db", help="database of the test redis instance (default 1)")
+    parser.add_argument("--force", help="run the mail and fanout benchmark against the default redis instance used by the processors", action="store_true")
+    return parser.parse_args()
+
+class smtpSink(socketserver.ThreadingTCPServer):
+    """ minimal smtp server accepting every mail, recording the deliveries """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0, error_rate=0.0, tls_context=None):
+        socketserver.ThreadingTCPServer.__init__(self, address, smtpHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tls_context = tls_context
+        self.lock = threading.Lock()
+        # bench id -> time of the first successful delivery
+        self.delivered = {}
+        # bench id -> number of delivery attempts
+        self.attempts = {}
+        self.rejected = 0
+
+    def record(self, data):
+        # the bench id and the enqueue time are sent as name of the recipient
+        bench = None
+        for line in data.split('\n'):
+            if line.startswith('To: "bench|'):
+                bench = line.split('"')[1]
+                break
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if bench:
+                self.attempts[bench] = self.attempts.get(bench, 0) + 1
+            if random.random() < self.error_rate:
+                self.rejected += 1
+                return False
+            if bench and bench not in self.delivered:
+                self.delivered[bench] = time.time()
+        return True
+
+class smtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write("{}\r\n".format(line).encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        self.reply("220 slBenchmark smtp sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ')[0].upper()
+            if verb in ['EHLO', 'HELO']:
+                self.wfile.write(b"250-slBenchmark\r\n250-AUTH PLAIN\r\n")
+                if self.server.tls_context:
+                    self.wfile.write(b"250-STARTTLS\r\n")
+                self.reply("250 8BITMIME")
+            elif verb == 'STARTTLS' and self.server.tls_context:
+                self.reply("220 ready to start TLS")
+                self.request = self.server.tls_context.wrap_socket(self.request, server_side=True)
+                self.setup()
+            elif verb == 'AUTH':
+                self.reply("235 authenticated")
+            elif verb == 'DATA':
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in [b".\r\n", b".\n"]:
+                        break
+                    data.append(line.decode('utf-8', 'replace'))
+                if self.server.record(''.join(data)):
+                    self.reply("250 queued")
+                else:
+                    self.reply("451 temporary failure injected by slBenchmark")
+            elif verb == 'QUIT':
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+def queue_mails(count):
+    # queue synthetic mails, the recipient name carries the bench id and enqueue time
+    enqueued = {}
+    for n in range(count):
+        bench = "bench|{}|{}".format(n, time.time())
+        mail_job = {'server': BENCH_SERVER, 'type': 'invitation'}
+        if args.template:
+            mail_job['template'] = args.template
+            mail_job['params'] = mailContext.invitation('slBenchmark', 'https://example.org/b/benchmark', 'slBenchmark')._asdict()
+        else:
+            mail_job['mailText'] = "Subject: slBenchmark {}\n\nsynthetic mail {} of {}".format(n, n + 1, count)
+            mail_job['contentType'] = 'plain'
+        mail_job['mailFrom'] = 'benchmark@example.org'
+        mail_job['mailFromName'] = 'slBenchmark'
+        mail_job['mailTo'] = "bench{}@example.org".format(n)
+        mail_job['mailToName'] = bench
+        sl.queue_mail(BENCH_SERVER, mail_job)
+        enqueued[bench] = float(bench.split('|')[2])
+    return enqueued
+
+def run_mail_benchmark():
+    tls_context = None
+    if args.tls_cert:
+        tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        tls_context.load_cert_chain(args.tls_cert, args.tls_key)
+    sink = smtpSink((args.smtp_host, int(args.smtp_port)), float(args.latency) / 1000, float(args.error_rate), tls_context)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    logger.info("smtp sink listening on {}:{}".format(args.smtp_host, args.smtp_port))
+
+    # server config pointing the mailProcessor to the sink
+    bench_server = {'id': BENCH_SERVER, 'mailServer': "{}:{}".format(args.smtp_host, args.smtp_port), 'mailUser': 'benchmark', 'mailPassword': 'benchmark', 'mailFrom': 'benchmark@example.org', 'mailFromName': 'slBenchmark', 'mailStarttls': tls_context is not None}
+    sl.store_server(BENCH_SERVER, bench_server)
+
+    processor = None
+    if not args.external_processor:
+        command = [sys.executable, os.path.dirname(os.path.abspath(__file__)) + '/slMailProcessor.py', '-g', args.logFile, '--redis_host', sl.redis_host, '--redis_port', str(sl.redis_port), '--redis_db', str(sl.redis_db)] + args.processor_args.split()
+        processor = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        logger.info("started mailProcessor {}".format(processor.pid))
+
+    count = int(args.mails)
+    start = time.time()
+    enqueued = queue_mails(count)
+    enqueue_seconds = time.time() - start
+    logger.info("queued {} mails in {:.3f}s".format(count, enqueue_seconds))
+
+    # wait for all deliveries
+    while len(sink.delivered) < count and time.time() - start < float(args.timeout):
+        time.sleep(0.2)
+    end = time.time()
+
+    if processor:
+        processor.terminate()
+        processor.wait()
+    sink.shutdown()
+    sl.r.delete("server:{}".format(BENCH_SERVER))
+
+    latencies = [ sink.delivered[bench] - enqueued[bench] for bench in sink.delivered if bench in enqueued ]
+    delivered = len(latencies)
+    duration = (max(sink.delivered.values()) if sink.delivered else end) - start
+    results = {
+        'mails': count,
+        'delivered': delivered,
+        'undelivered': count - delivered,
+        'enqueueSeconds': round(enqueue_seconds, 3),
+        'durationSeconds': round(duration, 3),
+        'mailsPerSecond': round(delivered / duration, 2) if duration > 0 else None,
+        'latencyP50Seconds': percentile(latencies, 50),
+        'latencyP99Seconds': percentile(latencies, 99),
+        'attempts': sum(sink.attempts.values()),
+        'retries': sum(sink.attempts.values()) - delivered,
+        'rejected': sink.rejected,
+    }
+    return results
+
+def run_render_benchmark():
+    # a meeting with many recipients as stored in redis
+    recipients = int(args.recipients)
+    mDict = {'id': 'benchmark', 'server': BENCH_SERVER, 'meetingName': 'slBenchmark', 'startDate': '2020-06-24 11:00', 'owner': {'email': 'owner@example.org', 'fullName': 'slBenchmark'}}
+    for field in ['shareWith', 'sendInvitationLink', 'sendModeratorLink']:
+        mDict[field] = { "user{}@example.org".format(n): {'fullName': "user {}".format(n)} for n in range(recipients) }
+    # the namespace the templates received with vars=locals() in the processors
+    namespace = dict(globals())
+    namespace.update({'mDict': mDict, 'servers': {BENCH_SERVER: {'mailPassword': 'secret', 'BBB_SECRET': 'secret'}}, 'meetingName': 'slBenchmark', 'meetingLink': 'https://example.org/b/benchmark'})
+    recipient = {'mailFrom': 'benchmark@example.org', 'mailFromName': 'slBenchmark', 'mailTo': 'user0@example.org', 'mailToName': 'user 0'}
+    contexts = {
+        'meetingOwnerInfoTemplate.j2': ('ownerInfo', mailContext.ownerInfo('slBenchmark', 'https://example.org/b/benchmark', '2020-06-24 11:00')),
+        'meetingOwnerStartedTemplate.j2': ('ownerStarted', mailContext.ownerStarted('slBenchmark', 'https://example.org/b/benchmark')),
+        'meetingOwnerReminderTemplate.j2': ('ownerReminder', mailContext.ownerReminder('slBenchmark', 'https://example.org/b/benchmark', 15)),
+        'meetingShareInfoTemplate.j2': ('share', mailContext.share('slBenchmark', 'https://example.org/b/benchmark', 'slBenchmark')),
+        'meetingInvitationInfoTemplate.j2': ('invitation', mailContext.invitation('slBenchmark', 'https://example.org/b/benchmark', 'slBenchmark', '2020-06-24 11:00')),
+        'meetingModeratorInfoTemplate.j2': ('moderator', mailContext.moderator('slBenchmark', 'https://example.org/b/benchmark', 'slBenchmark', '2020-06-24 11:00')),
+    }
+    renders = int(args.renders)
+    results = {}
+    for template in contexts:
+        (mailType, context) = contexts[template]
+        mail_job = dict(recipient, type=mailType, template=template, params=context._asdict())
+        # compile the template before measuring
+        sl.render_template(template, **mailContext.template_context(mail_job))
+        start = time.time()
+        for n in range(renders):
+            legacy = dict(namespace)
+            legacy['mail_properties'] = dict(recipient)
+            sl.render_template(template, vars=legacy, **context._asdict())
+        locals_seconds = time.time() - start
+        start = time.time()
+        for n in range(renders):
+            sl.render_template(template, **mailContext.template_context(mail_job))
+        context_seconds = time.time() - start
+        results[template] = {
+            'localsMicroseconds': round(locals_seconds / renders * 1000000, 1),
+            'contextMicroseconds': round(context_seconds / renders * 1000000, 1),
+            'contextKeys': len(mailContext.template_context(mail_job)),
+            'localsKeys': len(namespace) + 1,
+        }
+    return results
+
+def run_fanout_benchmark():
+    # invitations and moderator links of one meeting with many recipients
+    recipients = int(args.recipients)
+    mail_jobs = []
+    for n in range(recipients):
+        mail_job = {'server': BENCH_SERVER, 'type': 'invitation', 'template': 'meetingInvitationInfoTemplate.j2'}
+        mail_job['params'] = mailContext.invitation('slBenchmark', 'https://example.org/b/benchmark', 'slBenchmark', '2020-06-24 11:00')._asdict()
+        if n % 2:
+            mail_job.update({'type': 'moderator', 'template': 'meetingModeratorInfoTemplate.j2'})
+            mail_job['params'] = mailContext.moderator('slBenchmark', "https://example.org/bigbluebutton/api/join?fullName=user+{}".format(n), 'slBenchmark', '2020-06-24 11:00')._asdict()
+        mail_job.update({'mailFrom': 'benchmark@example.org', 'mailFromName': 'slBenchmark', 'mailTo': "user{}@example.org".format(n), 'mailToName': "user {}".format(n)})
+        mail_jobs.append(mail_job)
+    # compile the templates before measuring
+    for mail_job in mail_jobs[:2]:
+        sl.render_template(mail_job['template'], **mailContext.template_context(mail_job))
+    start = time.time()
+    full = [ sl.render_template(mail_job['template'], **mailContext.template_context(mail_job)) for mail_job in mail_jobs ]
+    full_seconds = time.time() - start
+    sl.rendered = {}
+    start = time.time()
+    personalized = [ sl.render_mail(mail_job) for mail_job in mail_jobs ]
+    personalized_seconds = time.time() - start
+    # queue the jobs one by one and with one pipeline
+    start = time.time()
+    ids = [ sl.queue_mail(BENCH_SERVER, mail_job) for mail_job in mail_jobs ]
+    single_seconds = time.time() - start
+    start = time.time()
+    pipe = sl.r.pipeline(transaction=False)
+    for mail_job in mail_jobs:
+        sl.queue_mail(BENCH_SERVER, mail_job, pipe)
+    ids.extend(pipe.execute())
+    pipelined_seconds = time.time() - start
+    # do not deliver the synthetic jobs
+    sl.r.xdel('mailStream', *ids)
+    return {
+        'recipients': recipients,
+        'renderFullMilliseconds': round(full_seconds * 1000, 1),
+        'renderOnceMilliseconds': round(personalized_seconds * 1000, 1),
+        'identicalTexts': full == personalized,
+        'queueSingleMilliseconds': round(single_seconds * 1000, 1),
+        'queuePipelinedMilliseconds': round(pipelined_seconds * 1000, 1),
+    }
+
+#############
+### start ###
+#parse the commandline arguments
+args = parseArgs()
+
+## create logger with 'benchmark'
+logger = logging.getLogger('benchmark')
+logger.setLevel(logging.INFO)
+## create file handler which logs even debug messages
+fh = logging.handlers.RotatingFileHandler(args.logFile, maxBytes=1000000, backupCount=5)
+fh.setLevel(logging.INFO)
+## create console handler with a higher log level
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+## create formatter and add it to the handlers
+formatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s', '%Y-%m-%d %H:%M:%S')
+fh.setFormatter(formatter)
+formatter2 = logging.Formatter('%(levelname)-8s %(message)s')
+ch.setFormatter(formatter2)
+## add the handlers to the logger
+logger.addHandler(fh)
+logger.addHandler(ch)
+#
+# init sheduLight instance
+sl = scheduLight(args)
+# the mail and fanout benchmark write to the mailStream, keep them away from the instance the processors use
+if args.mode in ['mail', 'fanout'] and not args.force and (sl.redis_host, sl.redis_port, sl.redis_db) == (scheduLight.redis_host, scheduLight.redis_port, scheduLight.redis_db):
+    logger.error("the {} benchmark writes to the mailStream of the default redis instance {}:{} db {}, use a test instance with --redis_host, --redis_port or --redis_db or run it with --force".format(args.mode, sl.redis_host, sl.redis_port, sl.redis_db))
+    sys.exit(1)
+
+if args.mode == 'mail':
+    results = run_mail_benchmark()
+elif args.mode == 'render':
+    results = run_render_benchmark()
+elif args.mode == 'fanout':
+    results = run_fanout_benchmark()
+
+if args.json:
+    print(json.dumps(results, indent=2))
+else:
+    for field in results:
+        print("{}: {}".format(field, results[field]))
+
+sl.r.connection_pool.disconnect()
+if args.mode == 'mail' and float(args.min_throughput) > 0 and (results['mailsPerSecond'] or 0) < float(args.min_throughput):
+    logger.error("throughput {} below {} mails per second".format(results['mailsPerSecond'], args.min_throughput))
+    sys.exit(1)
@@ -12,10 +12,11 @@
 from datetime import datetime, timedelta
 import sys
 import argparse
-import yaml, json
+import json
 import logging, logging.handlers
 import time
 from scheduLight import scheduLight
+from configLoader import read_yaml, write_yaml
 from bigbluebutton_api_python import BigBlueButton
 from bigbluebutton_api_python import util as bbbUtil
 from bigbluebutton_api_python import exception as bbbexception
@@ -28,6 +29,8 @@ def parseArgs():
     parser.add_argument("--dbPassword", help="Database password", default="")
     parser.add_argument("--dbHost", help="Database host", default="127.0.0.1")
     parser.add_argument("--dbPort", help="Database port", default="5432")
+    parser.add_argument("--dbMinConn", help="open at least n database connections", default=1)
+    parser.add_argument("--dbMaxConn", help="open at most n database connections", default=2)
     parser.add_argument("-f","--find_meeting", help="find running Meeting by title")
     parser.add_argument("-d","--debug_emails", help="print mails insttead of sending them", action="store_true")
     parser.add_argument("-n","--no_emails", help="prevent sending of emails", action="store_true")
@@ -43,23 +46,12 @@ def parseArgs():
     parser.add_argument("-c","--configFile", help="path to config file in yaml format", default="./config.yml")
     parser.add_argument("-s","--server", help="server to use (has to be configured)", default="bbb")
     parser.add_argument("-S","--store_result", help="store result to configFile", action="store_true")
+    parser.add_argument("-z","--compress_mails", help="compress the mail jobs in the mail stream", action="store_true")
+    parser.add_argument("-t","--stream_stats", help="show retention metrics of the mail and command streams", action="store_true")
+    parser.add_argument("--archived", help="list the archived meetings", action="store_true")
+    parser.add_argument("--restore_meeting", help="restore the archived meeting with this id to be processed again")
     return parser.parse_args()
 
-def write_yaml(dataFile,config):
-    with open(dataFile, 'w') as outfile:
-        yaml.dump(config, outfile, default_flow_style=False, allow_unicode=True)
-
-def read_yaml(dataFile, ignore_missing_file = False):
-    try:
-        with open(dataFile, 'r') as stream:
-            try:
-                return yaml.load(stream, Loader=yaml.SafeLoader)
-            except yaml.YAMLError as ERR:
-                logger.error(ERR)
-                sys.exit()
-    except FileNotFoundError as ERR:
-        if ignore_missing_file  != True:
-            sys.exit()
 #############
 ### start ###
 #parse the commandline arguments
@@ -86,7 +78,7 @@ logger.addHandler(ch)
 logger.debug("starting...")
 # initialize greenlight
 logger.debug("initializing greenlight...")
-gl = greenLight(args.dbName, args.dbUser, args.dbPassword, args.dbHost, args.dbPort, args.logFile)
+gl = greenLight(args.dbName, args.dbUser, args.dbPassword, args.dbHost, args.dbPort, args.logFile, args.dbMinConn, args.dbMaxConn)
 # init sheduLight instance
 logger.debug("initializing scheduLight...")
 sl = scheduLight(args)
@@ -100,8 +92,27 @@ logger.debug("loading config from file...")
 meetingsConfig = read_yaml(args.configFile)
 if 'meetings' not in meetingsConfig:
     meetingsConfig['meetings'] = {}
+# show retention metrics of the streams
+if args.stream_stats:
+    for stream in sl.stream_groups:
+        print(json.dumps(sl.stream_stats(stream), indent=2))
+
+# list archived meetings
+elif args.archived:
+    for meeting in sorted(sl.archived_meetings()):
+        (mDict, version) = sl.archived_meeting(meeting)
+        if mDict:
+            print("{}: {} ({})".format(meeting, mDict.get('meetingName'), sl.r.hget('meeting:{}:archive'.format(meeting), 'date')))
+
+# restore archived meeting
+elif args.restore_meeting:
+    if sl.restore_meeting(args.restore_meeting):
+        logger.info("restored meeting {}".format(args.restore_meeting))
+    else:
+        logger.error("no archived meeting {}".format(args.restore_meeting))
+
 # show running meetings
-if args.showMeetings:
+elif args.showMeetings:
     if sl.init_bbb(args.server):
         sl.show_meetings(args.server)
 
@@ -122,19 +133,16 @@ elif args.room_links:
     logger.debug("searching rooms with {} {}...".format(args.room_by, args.room_links))
     rooms = {}
     if args.room_links == 'meetings':
-        for meeting in sl.r.smembers('meetings'):
+        (meetingDocs, meetingVersions) = sl.load_meetings(list(sl.r.smembers('meetings')))
+        for meeting in meetingDocs:
             logger.debug("processing meeting {}...".format(meeting))
-            mDict = json.loads(sl.r.get('meeting:{}'.format(meeting)))
-            errors = sl.meeting_schema.validate(mDict)
-            if errors:
-                logger.error("please provide all required fields for the meeting: {}".format(errors))
-                continue
+            mDict = meetingDocs[meeting]
 
             servers = {}
             server = mDict['server']
-            res = sl.r.get("server:{}".format(server))
+            res = sl.get_server(server)
             if res:
-                servers[server] = json.loads(res)
+                servers[server] = res
                 logger.debug("load server: {}".format(server))
             else:
                 logger.error("could not load server: {}".format(server))
@@ -161,9 +169,9 @@ elif args.room_links:
     else:
         server = args.server
         servers = {}
-        res = sl.r.get("server:{}".format(server))
+        res = sl.get_server(server)
         if res:
-            servers[server] = json.loads(res)
+            servers[server] = res
             logger.debug("load server: {}".format(server))
         else:
             logger.error("could not load server: {}".format(server))
@@ -226,11 +234,8 @@ Moderator Link ({}): {}
             roomLinks = subject + roomLinks
 
             fullName = args.email.partition('@')[0]
-            # mail server configs
-            mail_properties = {}
-            mail_properties['mailServer'] = servers[server]['mailServer']
-            mail_properties['mailUser'] = servers[server]['mailUser']
-            mail_properties['mailPassword'] = servers[server]['mailPassword']
+            # the mailProcessor resolves the mail server configs
+            mail_properties = {'server': server, 'type': 'roomLinks'}
             # sender and receiver
             mail_properties['mailFrom'] = user_data['email']
             if 'mailFrom' in servers[server]:
@@ -246,7 +251,7 @@ Moderator Link ({}): {}
             mail_properties['mailText'] = roomLinks
             mail_properties['contentType'] = "plain"
             try:
-                res = sl.r.xadd('mailStream', { meeting: json.dumps(mail_properties) })
+                res = sl.queue_mail('roomLinks', mail_properties)
                 logger.debug("queued mail successfully")
             except Exception as ERR:
                 logger.error("failed to send mail to queue.")
@@ -20,6 +20,7 @@ from bigbluebutton_api_python import BigBlueButton
 from bigbluebutton_api_python import util as bbbUtil
 from bigbluebutton_api_python import exception as bbbexception
 from greenLight import greenLight
+import mailContext
 
 def sigint_handler(sig, frame):
     logger.debug("received {}...".format(sig))
@@ -33,6 +34,11 @@ def parseArgs():
     parser.add_argument("--dbPassword", help="Database password", default="")
     parser.add_argument("--dbHost", help="Database host", default="127.0.0.1")
     parser.add_argument("--dbPort", help="Database port", default="5432")
+    parser.add_argument("--dbMinConn", help="open at least n database connections", default=1)
+    parser.add_argument("--dbMaxConn", help="open at most n database connections", default=4)
+    parser.add_argument("--dbCacheSize", help="cache up to n user and room lookups (0 disables the cache)", default=10000)
+    parser.add_argument("--dbCacheTTL", help="cache user and room lookups for n seconds", default=60)
+    parser.add_argument("--dbNotify", help="install triggers in the greenlight database to clear cached lookups on changes", action="store_true")
     parser.add_argument("-f","--findcommand", help="find running command by title")
     parser.add_argument("-d","--debug_emails", help="print mails insttead of sending them", action="store_true")
     parser.add_argument("-n","--no_emails", help="prevent sending of emails", action="store_true")
@@ -45,6 +51,9 @@ def parseArgs():
     parser.add_argument("-p","--pre_open", help="pre open the command n minutes before the startDate", default=90)
     parser.add_argument("-P","--pre_start", help="pre start the command n minutes before the startDate", default=0)
     parser.add_argument("-a","--end_after", help="end the command n minutes aftter the startDate", default=0)
+    parser.add_argument("--stream_retention", help="remove processed commands from the command stream after n seconds", default=604800)
+    parser.add_argument("--trim_interval", help="compact the command stream every n seconds", default=3600)
+    parser.add_argument("-z","--compress_mails", help="compress the mail jobs in the mail stream", action="store_true")
 
     return parser.parse_args()
 
@@ -58,9 +67,9 @@ def process_command(cDict):
 
     servers = {}
     server = cDict['server']
-    res = sl.r.get("server:{}".format(server))
+    res = sl.get_server(server)
     if res:
-        servers[server] = json.loads(res)
+        servers[server] = res
         logger.debug("load server: {}".format(server))
     else:
         logger.error("could not load server: {}".format(server))
@@ -71,8 +80,38 @@ def process_command(cDict):
         logger.error("please provide all required fields for the server: {}".format(errors))
         return False
 
+    # run all changes of the command in one transaction, the mails are queued once it is committed
+    # a command that failed for one of its elements is rolled back completely and sends no mails
+    mail_jobs = []
+    try:
+        with gl.transaction():
+            success = run_command(cDict, servers, mail_jobs)
+            if not success:
+                raise RuntimeError("not all elements of the command succeeded")
+    except Exception as ERR:
+        logger.error("command {} failed, its changes were rolled back. {}".format(command, ERR))
+        return False
+    if mail_jobs:
+        pipe = sl.r.pipeline(transaction=False)
+        for mail_job in mail_jobs:
+            sl.queue_mail(command, mail_job, pipe)
+        try:
+            res = pipe.execute()
+            logger.info("queued {} mails successfully. {}".format(len(mail_jobs), res))
+        except Exception as ERR:
+            logger.error("failed to send mails to queue. {}".format(ERR))
+            success = False
+    return success
+
+def run_command(cDict, servers, mail_jobs):
+    command = cDict['command']
+    server = cDict['server']
     cElementList = set(cDict['data'])
     success = True
+    # users and rooms to create, they are created at once after the loop
+    users = []
+    rooms = []
+    deleteUsers = []
     for cElement in cElementList:
         cData = cDict['data'][cElement]
         if command == 'rename_room':
@@ -95,30 +134,23 @@ def process_command(cDict):
             if errors:
                 logger.error("please specify all required fields. {}".format(errors))
                 success = False
+            logger.debug("sharing room {} with {}...".format(cElement, ", ".join(cData)))
+            done = gl.share_rooms(cElement, list(cData), 'uid')
             for email in cData:
-                logger.debug("sharing room {} with {}...".format(cElement, email))
-                if gl.share_room(cElement, email, 'uid'):
+                if email in done:
                     logger.info("shared room {} with {}".format(cElement, email))
                     # send mail
-                    mail_properties = {}
-                    mail_properties['mailServer'] = servers[server]['mailServer']
-                    mail_properties['mailUser'] = servers[server]['mailUser']
-                    mail_properties['mailPassword'] = servers[server]['mailPassword']
-                    mail_properties['mailFrom'] = servers[server]['mailFrom']
-                    mail_properties['mailFromName'] = servers[server]['mailFromName']
-                    mail_properties['mailTo'] = email
+                    mail_job = {'server': server, 'type': 'roomShared', 'template': 'roomSharedTemplate.j2'}
+                    mail_job['mailFrom'] = servers[server]['mailFrom']
+                    mail_job['mailFromName'] = servers[server]['mailFromName']
+                    mail_job['mailTo'] = email
                     if cData[email]:
-                        mail_properties['mailToName'] = cData[email]
+                        mail_job['mailToName'] = cData[email]
                     else:
-                        mail_properties['mailToName'] = email.partition('@')[0]
+                        mail_job['mailToName'] = email.partition('@')[0]
                     meetingLink = "{}/{}".format(servers[server]['link_base'], cElement)
-                    mail_properties['mailText'] = sl.render_template("roomSharedTemplate.j2", vars=locals())
-                    try:
-                        res = sl.r.xadd('mailStream', { command: json.dumps(mail_properties) })
-                        logger.info("queued mail successfully. {}".format(res))
-                    except Exception as ERR:
-                        logger.error("failed to send mail to queue. {} {}".format(res, ERR))
-                        success = False
+                    mail_job['params'] = mailContext.roomShared(command, cElement, meetingLink)._asdict()
+                    mail_jobs.append(mail_job)
                 else:
                     logger.error("room {} could not be shared with {}...".format(cElement, email))
                     success = False
@@ -129,30 +161,23 @@ def process_command(cDict):
             if errors:
                 logger.error("please specify all required fields. {}".format(errors))
                 success = False
+            logger.debug("unsharing room {} with {}...".format(cElement, ", ".join(cData)))
+            done = gl.unshare_rooms(cElement, list(cData), 'uid')
             for email in cData:
-                logger.debug("sharing room {} with {}...".format(cElement, email))
-                if gl.unshare_room(cElement, email, 'uid'):
+                if email in done:
                     logger.info("unshared room {} with {}".format(cElement, email))
                     # send mail
-                    mail_properties = {}
-                    mail_properties['mailServer'] = servers[server]['mailServer']
-                    mail_properties['mailUser'] = servers[server]['mailUser']
-                    mail_properties['mailPassword'] = servers[server]['mailPassword']
-                    mail_properties['mailFrom'] = servers[server]['mailFrom']
-                    mail_properties['mailFromName'] = servers[server]['mailFromName']
-                    mail_properties['mailTo'] = email
+                    mail_job = {'server': server, 'type': 'roomUnshared', 'template': 'roomUnsharedTemplate.j2'}
+                    mail_job['mailFrom'] = servers[server]['mailFrom']
+                    mail_job['mailFromName'] = servers[server]['mailFromName']
+                    mail_job['mailTo'] = email
                     if cData[email]:
-                        mail_properties['mailToName'] = cData[email]
+                        mail_job['mailToName'] = cData[email]
                     else:
-                        mail_properties['mailToName'] = email.partition('@')[0]
+                        mail_job['mailToName'] = email.partition('@')[0]
                     meetingLink = "{}/{}".format(servers[server]['link_base'], cElement)
-                    mail_properties['mailText'] = sl.render_template("roomUnsharedTemplate.j2", vars=locals())
-                    try:
-                        res = sl.r.xadd('mailStream', { command: json.dumps(mail_properties) })
-                        logger.info("queued mail successfully. {}".format(res))
-                    except Exception as ERR:
-                        logger.error("failed to send mail to queue. {} {}".format(res, ERR))
-                        success = False
+                    mail_job['params'] = mailContext.roomUnshared(command, cElement, meetingLink)._asdict()
+                    mail_jobs.append(mail_job)
                 else:
                     logger.error("room {} could not be unshared with {}...".format(cElement, email))
                     success = False
@@ -179,11 +204,7 @@ def process_command(cDict):
             accessCode = None
             if 'accessCode' in cData:
                 accessCode = cData['accessCode']
-            if gl.create_room(cData['email'], cElement, alias, None, None, None, None, accessCode):
-                logger.info("created room {} for {}".format(cElement, cData['email']))
-            else:
-                logger.error("could not create room {} for {}".format(cElement, cData['email']))
-                success = False
+            rooms.append({'email': cData['email'], 'meetingName': cElement, 'meetingUID': alias, 'accessCode': accessCode})
 
         elif command == 'delete_user':
         # delete user
@@ -194,6 +215,10 @@ def process_command(cDict):
                 logger.error("could not delete user {}".format(cElement))
                 success = False
 
+        elif command == 'delete_users':
+        # delete users, they are deleted at once after the loop
+            deleteUsers.append(cElement)
+
         elif command == 'create_user':
         # create user
             errors = sl.validate_schema(sl.command_create_user_schema, cDict)
@@ -201,20 +226,38 @@ def process_command(cDict):
                 logger.error("please specify all required fields. {}".format(errors))
                 success = False
             logger.debug("creating user {} {}...".format(cElement, cData['fullName']))
-            pwd = None
-            if 'pwd' in cData:
-                pwd = cData['pwd']
             role = None
             if 'role' in cData:
                 role = cData['role']
             provider = None
             if 'provider' in cData:
                 provider = cData['provider']
-            if gl.create_user(cElement, cData['fullName'], pwd, role, provider):
-                logger.info("created user {} {}".format(cElement, cData['fullName']))
+            # pwd is not supported yet, greenlight expects a password digest
+            users.append({'email': cElement, 'fullName': cData['fullName'], 'role_id': role, 'provider': provider})
+
+    if deleteUsers:
+        logger.debug("deleting users {}...".format(", ".join(deleteUsers)))
+        deleted = gl.delete_users(deleteUsers)
+        for email in deleteUsers:
+            if email in deleted:
+                logger.info("{} {}".format(command, email))
             else:
-                logger.error("could not create user {}".format(cElement))
+                logger.error("could not delete user {}".format(email))
                 success = False
+    if users:
+        created = gl.bulk_create_users(users)
+        for user in users:
+            if user['email'] in created:
+                logger.info("created user {} {}".format(user['email'], user['fullName']))
+            else:
+                logger.error("could not create user {}".format(user['email']))
+                success = False
+    if rooms:
+        created = gl.bulk_create_rooms(rooms)
+        logger.info("created rooms {}".format(", ".join(["{} ({})".format(uid, created[uid]) for uid in created])))
+        if len(created) < len(rooms):
+            logger.error("could not create {} of {} rooms".format(len(rooms) - len(created), len(rooms)))
+            success = False
     return success
 #############
 ### start ###
@@ -247,7 +290,7 @@ logger.addHandler(ch)
 logger.debug("starting...")
 # initialize greenlight
 logger.debug("initializing greenlight...")
-gl = greenLight(args.dbName, args.dbUser, args.dbPassword, args.dbHost, args.dbPort, args.logFile)
+gl = greenLight(args.dbName, args.dbUser, args.dbPassword, args.dbHost, args.dbPort, args.logFile, args.dbMinConn, args.dbMaxConn, gl_cacheSize=args.dbCacheSize, gl_cacheTTL=args.dbCacheTTL, gl_notify=args.dbNotify)
 # init sheduLight instance
 sl = scheduLight(args)
 #
@@ -269,6 +312,11 @@ while True:
             (id, item) = msg
             logger.debug("id: {}".format(id))
             logger.debug("item: {}".format(item))
+            if not item:
+                # the entry was removed from the stream while it was pending
+                logger.error("command {} has no content, skipping it".format(id))
+                sl.r.xack('commandStream', 'commandNotifications', id)
+                continue
             for key in item:
                 cDict = json.loads(item[key])
             if process_command(cDict):
@@ -285,6 +333,11 @@ while True:
             (id, item) = msg
             logger.debug("id: {}".format(id))
             logger.debug("item: {}".format(item))
+            if not item:
+                # the entry was removed from the stream while it was pending
+                logger.error("command {} has no content, skipping it".format(id))
+                sl.r.xack('commandStream', 'commandNotifications', id)
+                continue
             for key in item:
                 cDict = json.loads(item[key])
             if process_command(cDict):
@@ -294,6 +347,9 @@ while True:
                 logger.error("Errors during processing of command. More information can be found in the logfile")
                 logger.debug("ack msg: {}".format(sl.r.xack('commandStream', 'commandNotifications', id)))
 
+    # remove processed commands from the stream
+    sl.trim_stream('commandStream')
+
     # shut down
     time.sleep(1)
     if stop:
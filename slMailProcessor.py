@@ -19,6 +19,8 @@ import signal
 import random
 import string
 import smtplib
+from scheduLight import scheduLight
+import mailContext
 
 def get_date(dateString):
     format_string = "%Y-%m-%d %H:%M"
@@ -34,6 +36,15 @@ def parseArgs():
     parser.add_argument("-d","--debug_emails", help="print mails insttead of sending them", action="store_true")
     parser.add_argument("-n","--no_emails", help="prevent sending of emails", action="store_true")
     parser.add_argument("-g","--logFile", help="path to logFile in yaml format", default="./scheduLight.log")
+    parser.add_argument("--stream_retention", help="remove sent mails from the mail stream after n seconds", default=604800)
+    parser.add_argument("--trim_interval", help="compact the mail stream every n seconds", default=3600)
+    parser.add_argument("-w","--digest_window", help="collect mails to the same recipient for n seconds and send them as one digest mail (0 disables digests)", default=0)
+    parser.add_argument("--digest_bypass", help="comma separated mail types sent without waiting for a digest", default="ownerReminder,ownerStarted")
+    parser.add_argument("--template_cache_dir", help="store the compiled templates in this directory to speed up restarts")
+    parser.add_argument("--digest_template", help="template used to merge the mails of a digest", default="mailDigestTemplate.j2")
+    parser.add_argument("--redis_host", help="host of the redis instance (default localhost)")
+    parser.add_argument("--redis_port", help="port of the redis instance (default 6380)")
+    parser.add_argument("--redis_db", help="database of the redis instance (default 1)")
     return parser.parse_args()
 
 def config_exists(my_dict, my_list):
@@ -42,6 +53,165 @@ def config_exists(my_dict, my_list):
             return False
     return True
 
+def resolve_mail(mail_properties):
+    if 'mailServer' in mail_properties:
+        # mail queued with rendered text and credentials
+        return mail_properties
+    # resolve the mail server configs of the server
+    server = mail_properties['server']
+    if server not in servers:
+        res = sl.get_server(server)
+        if not res:
+            logger.error("could not load server: {}".format(server))
+            return None
+        servers[server] = res
+    for field in ['mailServer', 'mailUser', 'mailPassword', 'mailStarttls']:
+        if field in servers[server]:
+            mail_properties[field] = servers[server][field]
+    # render the template at send time
+    if 'template' in mail_properties:
+        mail_properties['mailText'] = sl.render_mail(mail_properties)
+    return mail_properties
+
+def dead_letter(key, raw, ERR, id=None, digest_key=None):
+    # keep a mail job that can not be decoded or rendered in mailDeadLetter and acknowledge it, so it is not read again
+    # a job of a digest is moved out of the digest, so it is not dead-lettered again when the digest is retried
+    logger.error("failed to process mail {} {}: {}".format(key, id or '', ERR))
+    pipe = r.pipeline()
+    pipe.xadd('mailDeadLetter', { 'key': key, 'id': id or '', 'error': "{}: {}".format(type(ERR).__name__, ERR), 'job': raw }, maxlen=sl.dead_letter_maxlen, approximate=True)
+    if id:
+        pipe.xack('mailStream', 'mailNotifications', id)
+    if digest_key:
+        pipe.lrem(digest_key, 1, raw)
+    pipe.execute()
+
+def use_digest(mail_properties):
+    # only templated mails of types not bypassing the digest are buffered
+    if int(args.digest_window) <= 0:
+        return False
+    if 'template' not in mail_properties or 'mailTo' not in mail_properties:
+        return False
+    return mail_properties['type'] not in args.digest_bypass.split(',')
+
+def buffer_digest(id, raw, mail_properties):
+    # store the mail for its recipient and acknowledge it in the stream
+    digest = "{}|{}".format(mail_properties['server'], mail_properties['mailTo'])
+    pipe = r.pipeline()
+    pipe.rpush("mailDigest:{}".format(digest), raw)
+    pipe.zadd('mailDigests', { digest: time.time() + int(args.digest_window) }, nx=True)
+    pipe.xack('mailStream', 'mailNotifications', id)
+    pipe.execute()
+    logger.debug("buffered mail {} for digest {}".format(id, digest))
+
+def split_subject(mailText):
+    # the templates start with the subject header followed by the body
+    if mailText.startswith('Subject:'):
+        (subject, sep, body) = mailText.partition('\n')
+        return (subject[len('Subject:'):].strip(), body)
+    return ('', mailText)
+
+def finish_digest(digest, done, kept):
+    # remove the first done jobs of the digest, the kept jobs and the mails buffered meanwhile wait for the next window
+    digest_key = "mailDigest:{}".format(digest)
+    pipe = r.pipeline()
+    pipe.ltrim(digest_key, done, -1)
+    if kept:
+        pipe.lpush(digest_key, *reversed(kept))
+    pipe.zrem('mailDigests', digest)
+    pipe.execute()
+    if r.llen(digest_key) > 0:
+        r.zadd('mailDigests', { digest: time.time() + int(args.digest_window) }, nx=True)
+
+def send_digests():
+    # send all digests whose window has passed
+    for digest in r.zrangebyscore('mailDigests', '-inf', time.time()):
+        digest_key = "mailDigest:{}".format(digest)
+        jobs = r.lrange(digest_key, 0, -1)
+        if not jobs:
+            r.zrem('mailDigests', digest)
+            continue
+        mails = []
+        failed = 0
+        unresolved = []
+        for raw in jobs:
+            try:
+                mail_properties = resolve_mail(sl.decode_mail_job(raw))
+            except redis.exceptions.RedisError:
+                raise
+            except Exception as ERR:
+                dead_letter(digest, raw, ERR, digest_key=digest_key)
+                failed += 1
+                continue
+            if mail_properties:
+                mails.append(mail_properties)
+            else:
+                unresolved.append(raw)
+        # the dead-lettered jobs were removed from the digest already
+        done = len(jobs) - failed
+        if not mails:
+            if unresolved:
+                logger.error("failed to resolve mails of digest {}".format(digest))
+            else:
+                # all mails of the digest are kept in mailDeadLetter
+                finish_digest(digest, done, [])
+            continue
+        if len(mails) == 1:
+            mail_properties = mails[0]
+        else:
+            # merge the mails into one message
+            mail_properties = dict(mails[0])
+            items = []
+            for mail in mails:
+                (subject, body) = split_subject(mail['mailText'])
+                items.append({'type': mail['type'], 'subject': subject, 'body': body})
+            digest_job = {'type': 'digest', 'params': {'items': items}}
+            for field in mailContext.recipientFields:
+                digest_job[field] = mail_properties[field]
+            try:
+                mail_properties['mailText'] = sl.render_template(args.digest_template, **mailContext.template_context(digest_job))
+            except Exception as ERR:
+                logger.error("failed to render digest {} with template {}. {}".format(digest, args.digest_template, ERR))
+                continue
+        if send_email(mail_properties) == 1:
+            logger.info("send digest of {} mails to {}".format(len(mails), mail_properties['mailTo']))
+            if unresolved:
+                logger.error("could not resolve {} mails of digest {}, they are sent with the next digest".format(len(unresolved), digest))
+            finish_digest(digest, done, unresolved)
+        else:
+            logger.error("failed to send digest to {}".format(mail_properties['mailTo']))
+
+def process_mail(id, item):
+    if not item:
+        # the entry was removed from the stream while it was pending
+        logger.error("mail {} has no content, skipping it".format(id))
+        r.xack('mailStream', 'mailNotifications', id)
+        return
+    for key in item:
+        raw = item[key]
+    try:
+        mail_properties = sl.decode_mail_job(raw)
+        digest = use_digest(mail_properties)
+        if not digest:
+            mail_properties = resolve_mail(mail_properties)
+    except redis.exceptions.RedisError:
+        raise
+    except Exception as ERR:
+        dead_letter(key, raw, ERR, id)
+        return
+    if digest:
+        buffer_digest(id, raw, mail_properties)
+        return
+    if not mail_properties:
+        logger.error("failed to resolve mail {}".format(id))
+        return
+    res = send_email(mail_properties)
+    if res == 1:
+        logger.info("send mail {} to {}".format(key, mail_properties['mailTo']))
+        logger.debug("ack msg: {}".format(r.xack('mailStream', 'mailNotifications', id)))
+    elif res == 0:
+        logger.error("failed to send mail {} for {}".format(key, mail_properties['mailTo']))
+    time.sleep(0.1)
+
 def send_email(mail_properties):
     if not config_exists(mail_properties,['mailServer', 'mailUser', 'mailPassword', 'mailFrom', 'mailFromName', 'mailTo', 'mailToName', 'mailText']):
         logger.error("MailServer not configured or parameters missing...")
@@ -66,7 +236,8 @@ MIME-Version: 1.0
 
     try:
         server = smtplib.SMTP(mail_properties['mailServer'])
-        server.starttls()
+        if mail_properties.get('mailStarttls', True):
+            server.starttls()
         server.login(mail_properties['mailUser'], mail_properties['mailPassword'])
         server.sendmail(mail_properties['mailFrom'], [mail_properties['mailTo']], mailText.encode('utf-8'))
         server.quit()
@@ -102,18 +273,20 @@ logger.addHandler(fh)
 logger.addHandler(ch)
 #
 logger.info("starting...")
-# connect to redis db
-r = redis.StrictRedis( host="localhost", port="6380", db=1, ssl=False, charset="utf-8", decode_responses=True)
-try:
-    r.info()
-except redis.exceptions.ConnectionError as ERR:
-    logger.error("Redis not ready: {}".format(ERR))
+# init sheduLight instance
+sl = scheduLight(args)
+r = sl.r
+if int(args.digest_window) > 0 and not sl.template_exists(args.digest_template):
     sys.exit()
 # run application 
 while True:
     # set startTime
     NOW = datetime.now()
     logger.debug("Date: {}".format(NOW))
+    # reload the server configs every cycle
+    servers = {}
+    # render the mails of a meeting once per cycle
+    sl.rendered = {}
     # send mails fetched from stream:
     try:
         r.xreadgroup('mailNotifications', 'consumer1', { 'mailStream': '0' }, None, None, True)
@@ -127,16 +300,7 @@ while True:
             (id, item) = msg
             logger.debug("id: {}".format(id))
             logger.debug("item: {}".format(item))
-            for key in item:
-                mail_properties = json.loads(item[key])
-            res = send_email(mail_properties)
-            if res == 1:
-                logger.info("send mail {} to {}".format(key, mail_properties['mailTo']))
-                logger.debug("ack msg: {}".format(r.xack('mailStream', 'mailNotifications', id)))
-            elif res == 0:
-                logger.error("failed to send mail {} for {}".format(key, mail_properties['mailTo']))
-            time.sleep(0.1)
-
+            process_mail(id, item)
 
     logger.debug("process new messages")
     for stream in r.xreadgroup('mailNotifications', 'consumer1', { 'mailStream': '>' }, None, None, False):
@@ -144,17 +308,14 @@ while True:
         for msg in stream[1]:
             (id, item) = msg
             logger.debug("id: {}".format(id))
-            for key in item:
-                mail_properties = json.loads(item[key])
-            res = send_email(mail_properties)
-            if res == 1:
-                logger.info("send mail {} to {}".format(key, mail_properties['mailTo']))
-                logger.debug("ack msg: {}".format(r.xack('mailStream', 'mailNotifications', id)))
-            elif res == 0:
-                logger.error("failed to send mail {} for {}".format(key, mail_properties['mailTo']))
-            time.sleep(0.1)
+            process_mail(id, item)
 
+    # send the digests whose window has passed
+    if int(args.digest_window) > 0:
+        send_digests()
 
+    # remove sent mails from the stream
+    sl.trim_stream('mailStream')
 
     # shut down
     time.sleep(1)
@@ -16,8 +16,11 @@ import json
 import logging, logging.handlers
 import time
 import signal
+import psycopg2
 from scheduLight import scheduLight
 from greenLight import greenLight
+import mailContext
+from meetingModel import meetingModel
 
 def sigint_handler(sig, frame):
     logger.debug("received {}...".format(sig))
@@ -31,6 +34,11 @@ def parseArgs():
     parser.add_argument("--dbPassword", help="Database password", default="")
     parser.add_argument("--dbHost", help="Database host", default="127.0.0.1")
     parser.add_argument("--dbPort", help="Database port", default="5432")
+    parser.add_argument("--dbMinConn", help="open at least n database connections", default=1)
+    parser.add_argument("--dbMaxConn", help="open at most n database connections", default=4)
+    parser.add_argument("--dbCacheSize", help="cache up to n user and room lookups (0 disables the cache)", default=10000)
+    parser.add_argument("--dbCacheTTL", help="cache user and room lookups for n seconds", default=60)
+    parser.add_argument("--dbNotify", help="install triggers in the greenlight database to clear cached lookups on changes", action="store_true")
     parser.add_argument("-d","--debug_emails", help="print mails insttead of sending them", action="store_true")
     parser.add_argument("-n","--no_emails", help="prevent sending of emails", action="store_true")
     parser.add_argument("-g","--logFile", help="path to logFile in yaml format", default="./scheduLight.log")
@@ -38,8 +46,26 @@ def parseArgs():
     parser.add_argument("-p","--pre_open", help="pre open the meeting n minutes before the startDate", default=90)
     parser.add_argument("-P","--pre_start", help="pre start the meeting n minutes before the startDate", default=0)
     parser.add_argument("-a","--end_after", help="end the meeting n minutes aftter the startDate", default=0)
+    parser.add_argument("-z","--compress_mails", help="compress the mail jobs in the mail stream", action="store_true")
+    parser.add_argument("--no_archive", help="keep finished and disabled meetings in the processed meetings", action="store_true")
+    parser.add_argument("--archive_ttl", help="remove archived meetings after n seconds (0 keeps them)", default=0)
     return parser.parse_args()
 
+def finished(meeting, m):
+    """ check if a started meeting can not produce any more work
+
+    The meeting is not ended after endAfterMinutes anymore, the owner mails are sent, liveStreaming was started
+    and the room is shared and all mails are sent to the recipient lists.
+    """
+    (endMeeting, infoMailSent, startMailSent, liveStreaming) = sl.get_status_many(meeting, [['endMeeting'], ['owner', 'infoMailSent'], ['owner', 'startMailSent'], ['liveStreaming']])
+    if m.startTime and m.endAfterMinutes > 0 and endMeeting != '220':
+        return False
+    if infoMailSent != '250' or startMailSent != '250':
+        return False
+    if m.liveStreaming and m.streamTarget and m.streamerHost and liveStreaming != '220':
+        return False
+    return sl.fanout_complete(meeting, {'shareWith': m.shareWith, 'sendInvitationLink': m.sendInvitationLink, 'sendModeratorLink': m.sendModeratorLink})
+
 #############
 ### start ###
 #parse the commandline arguments
@@ -71,49 +97,67 @@ logger.addHandler(ch)
 logger.debug("starting...")
 # initialize greenlight
 logger.debug("initializing greenlight...")
-gl = greenLight(args.dbName, args.dbUser, args.dbPassword, args.dbHost, args.dbPort, args.logFile)
+gl = greenLight(args.dbName, args.dbUser, args.dbPassword, args.dbHost, args.dbPort, args.logFile, args.dbMinConn, args.dbMaxConn, gl_cacheSize=args.dbCacheSize, gl_cacheTTL=args.dbCacheTTL, gl_notify=args.dbNotify)
 # init sheduLight instance
 sl = scheduLight(args)
+# minutes used if the meeting does not set them
+defaults = {'preStartMinutes': args.pre_start, 'preOpenMinutes': args.pre_open, 'endAfterMinutes': args.end_after, 'reminderMinutes': args.reminder_minutes}
 #
+# parsed meetings by version
+parsedMeetings = {}
+# meeting models by version of the meeting and its server config
+meetingModels = {}
 # run application 
 while True:
     # set startTime
     NOW = datetime.now()
     logger.debug("Date: {}".format(NOW))
-    # process all meetings on the server
-    for meeting in sl.r.smembers('meetings'):
-        logger.debug("processing meeting {}...".format(meeting))
-        mDict = json.loads(sl.r.get('meeting:{}'.format(meeting)))
-        errors = sl.meeting_schema.validate(mDict)
-        if errors:
-            logger.error("please provide all required fields for the meeting: {}".format(errors))
-            continue
-
-        servers = {}
+    # load all meetings with one request, unchanged meetings are neither parsed nor validated again
+    meetings = list(sl.r.smembers('meetings'))
+    (meetingDocs, meetingVersions) = sl.load_meetings(meetings, parsedMeetings)
+    parsedMeetings = { meetingVersions[meeting]: meetingDocs[meeting] for meeting in meetingDocs }
+    # load the configs of all servers with one request
+    serverList = list(set(mDict['server'] for mDict in meetingDocs.values()))
+    serverRaw = dict(zip(serverList, sl.r.mget(["server:{}".format(server) for server in serverList]))) if serverList else {}
+    # build the models of new or changed meetings and servers only
+    models = {}
+    for meeting in meetingDocs:
+        mDict = meetingDocs[meeting]
         server = mDict['server']
-        res = sl.r.get("server:{}".format(server))
-        if res:
-            servers[server] = json.loads(res)
-            logger.debug("load server: {}".format(server))
-        else:
+        if not serverRaw[server]:
             logger.error("could not load server: {}".format(server))
             continue
+        key = (meetingVersions[meeting], serverRaw[server])
+        if key in meetingModels:
+            models[meeting] = meetingModels[key]
+            continue
         logger.debug("loading config for {}...".format(server))
-        errors = sl.server_schema.validate(servers[server])
+        serverDict = sl.decode_doc(serverRaw[server])
+        errors = sl.server_schema.validate(serverDict)
         if errors:
             logger.error("please provide all required fields for the server: {}".format(errors))
             continue
-
-        # set send_emails for this server:
-        send_emails = False
-        if 'send_emails' in servers[server]:
-            send_emails = servers[server]['send_emails']
-        server_send_emails = send_emails
-        # set send_emails status of meeting
-        send_emails = server_send_emails
-        if 'send_emails' in mDict:
-            send_emails = mDict['send_emails']
-        meeting_send_emails  = send_emails 
+        try:
+            models[meeting] = meetingModel(mDict, serverDict, defaults, sl.get_date)
+        except ValueError as ERR:
+            logger.error("could not load meeting {}: {}".format(meeting, ERR))
+            continue
+    meetingModels = { (meetingVersions[meeting], serverRaw[models[meeting].server]): models[meeting] for meeting in models }
+    # server configs of this cycle
+    servers = { server: sl.decode_doc(serverRaw[server]) for server in serverList if serverRaw[server] }
+    # load the owners, home rooms and rooms of all meetings with one query each
+    try:
+        gl.prefetch(set(m.ownerEmail for m in models.values() if m.ownerEmail), set(m.meetingUID for m in models.values() if isinstance(m.meetingUID, str)))
+    except psycopg2.Error as ERR:
+        # the meetings look up their users and rooms on their own
+        logger.error("could not prefetch users and rooms. {}".format(ERR))
+    # process all meetings on the server
+    for meeting in meetings:
+        logger.debug("processing meeting {}...".format(meeting))
+        if meeting not in models:
+            continue
+        m = models[meeting]
+        server = m.server
 
         # init bbb
         if not sl.init_bbb(server):
@@ -125,157 +169,103 @@ while True:
             sl.set_status(meeting, ['status'], '200', 'new')
         # process meetings
         # if not disabled (status 900)
-        if sl.get_status(meeting, ['status']) != '900':
+        if sl.get_status(meeting, ['status']) == '900':
+            if not args.no_archive and sl.archive_meeting(meeting, int(args.archive_ttl)):
+                logger.info("archived disabled meeting {}".format(meeting))
+        else:
             # check if owner was provided with email otherwise fail
-            if 'owner' in mDict:
-                if 'email' in mDict['owner']:
-                    ownerEmail = mDict['owner']['email'].lower()
-                    if 'fullName' in mDict['owner']:
-                        ownerFullName = mDict['owner']['fullName']
-                    else:
-                        ownerFullName = mDict['owner']['email'].partition('@')[0]
-                    if 'socialUid' in mDict['owner']:
-                        socialUid = mDict['owner']['socialUid']
-                    else:
-                        socialUid = None
-                    if 'password' in mDict['owner']:
-                        ownerPassword = mDict['owner']['password']
-                    else:
-                        ownerPassword = None
-                    if 'uid' in mDict['owner']:
-                        ownerUid = mDict['owner']['uid']
-                    else:
-                        ownerUid = None
+            if m.hasOwner:
+                if m.ownerEmail:
+                    ownerEmail = m.ownerEmail
+                    ownerFullName = m.ownerFullName
 
-                    # process owner 
-                    user_id = gl.get_id_by_email(ownerEmail)
-                    if not user_id:
-                        logger.error("user {} does not exist. creating new user...".format(ownerEmail))
-                        user_id = gl.create_user(ownerEmail, ownerFullName, ownerUid, socialUid, ownerPassword)
-                        if user_id == 0:
-                            logger.error("user {} could not be created".format(ownerEmail))
-                            sl.set_status(meeting, ['status'], '404', 'owner not found and creation failed')
-                            continue
+                    # reconcile user and room of this meeting in one transaction
+                    try:
+                        with gl.transaction():
+                            # process owner 
+                            user_id = gl.get_id_by_email(ownerEmail)
+                            if not user_id:
+                                logger.error("user {} does not exist. creating new user...".format(ownerEmail))
+                                user_id = gl.create_user(ownerEmail, ownerFullName, m.ownerUid, m.socialUid, m.ownerPassword)
+                                if user_id == 0:
+                                    logger.error("user {} could not be created".format(ownerEmail))
+                                    sl.set_status(meeting, ['status'], '404', 'owner not found and creation failed')
+                                    continue
 
-                    #check if meetingID was provided 
-                    meetingID = None
-                    if 'meetingID' in mDict:
-                        meetingID = mDict['meetingID']
-                        logger.debug("set meetingID to {}...".format(meetingID))
-                    # check if meetingName was provided
-                    meetingName = None
-                    if 'meetingName' in mDict:
-                        meetingName = mDict['meetingName']
-                    else:
-                        meetingName = ownerFullName 
-                    logger.debug("set meetingName to {}...".format(meetingName))
-                    # set alias for room, if provided
-                    meetingUID = None
-                    if 'meetingUID' in mDict:
-                        meetingUID = mDict['meetingUID']
-                        logger.debug("set meetingUID to {}...".format(meetingUID))
-                    # set accessCode if provided
-                    accessCode = None
-                    if 'accessCode' in mDict:
-                        accessCode = mDict['accessCode']
-                        logger.debug("prepare accessCode")
+                            meetingName = m.meetingName
+                            logger.debug("set meetingName to {}...".format(meetingName))
+                            # set alias for room, if provided
+                            meetingUID = m.meetingUID
 
-                    # user exists (or was created) proceeding...
-                    room_id = 0
-                    # check if use homeroom
-                    if 'useHomeRoom' in mDict and mDict['useHomeRoom'] == True:
-                        room_id = gl.get_field_by_email(ownerEmail, 'room_id')
-                        logger.debug("checking if home room exists...")
-                        # create homeroom if not existing
-                        if not room_id:
-                            room_id = gl.create_room(ownerEmail, meetingName, meetingUID, None, None, None, None, accessCode)
-                            if room_id > 0:
-                                logger.debug("assigning home room {} to {}...".format(room_id, ownerEmail))
-                                res = gl.update_field('users', 'email', ownerEmail, 'room_id', room_id)
-                                if res == 0:
-                                    logger.error("could not assign home room to user {} ".format(ownerEmail))
-                            else:
-                                logger.error("home room for user {} could not be created".format(ownerEmail))
-                        if room_id > 0:
-                            meetingUID = gl.get_table_field('rooms', 'id', room_id, 'uid')
-                            logger.debug("using home room {} ({})".format(room_id, meetingUID))
-                        else:
-                            logger.error("home room {} cannot be used".format(ownerEmail))
-                            sl.set_status(meeting, ['status'], '404', 'home room could not be used')
-                            continue
-                    # not using homeroom, check if roomID exists else create ...
-                    # else create room 
-                    elif meetingUID:
-                        #check if meetingUID exists and fetch room_id
-                        room_id = gl.get_table_field('rooms', 'uid', meetingUID, 'id')
-                        if room_id:
-                            logger.debug("set roomID to {} ({} - not using homeroom ...".format(room_id, meetingUID))
-                        else:
-                            res = gl.create_room(ownerEmail, meetingName, meetingUID, None, None, None, None, accessCode)
-                            if res > 0:
+                            # user exists (or was created) proceeding...
+                            room_id = 0
+                            # check if use homeroom
+                            if m.useHomeRoom:
+                                room_id = gl.get_field_by_email(ownerEmail, 'room_id')
+                                logger.debug("checking if home room exists...")
+                                # create homeroom if not existing
+                                if not room_id:
+                                    room_id = gl.create_room(ownerEmail, meetingName, meetingUID, None, None, None, None, m.accessCode)
+                                    if room_id > 0:
+                                        logger.debug("assigning home room {} to {}...".format(room_id, ownerEmail))
+                                        res = gl.update_field('users', 'email', ownerEmail, 'room_id', room_id)
+                                        if res == 0:
+                                            logger.error("could not assign home room to user {} ".format(ownerEmail))
+                                    else:
+                                        logger.error("home room for user {} could not be created".format(ownerEmail))
+                                if room_id > 0:
+                                    meetingUID = gl.get_table_field('rooms', 'id', room_id, 'uid')
+                                    logger.debug("using home room {} ({})".format(room_id, meetingUID))
+                                else:
+                                    logger.error("home room {} cannot be used".format(ownerEmail))
+                                    sl.set_status(meeting, ['status'], '404', 'home room could not be used')
+                                    continue
+                            # not using homeroom, check if roomID exists else create ...
+                            # else create room 
+                            elif meetingUID:
+                                #check if meetingUID exists and fetch room_id
                                 room_id = gl.get_table_field('rooms', 'uid', meetingUID, 'id')
-                            else:
-                                logger.error("room for {} could not be created".format(meetingName))
-                                sl.set_status(meeting, ['status'], '401', 'room could not be created')
-                                continue
+                                if room_id:
+                                    logger.debug("set roomID to {} ({} - not using homeroom ...".format(room_id, meetingUID))
+                                else:
+                                    res = gl.create_room(ownerEmail, meetingName, meetingUID, None, None, None, None, m.accessCode)
+                                    if res > 0:
+                                        room_id = gl.get_table_field('rooms', 'uid', meetingUID, 'id')
+                                    else:
+                                        logger.error("room for {} could not be created".format(meetingName))
+                                        sl.set_status(meeting, ['status'], '401', 'room could not be created')
+                                        continue
+                            if room_id >0:
+                                room_data = gl.table_row_as_dict('rooms', 'id', room_id, gl.roomsTableList)
+                                # set room config (name, uid, accessCode,... only the changed columns are written
+                                roomConfig = {}
+                                if meetingName:
+                                    roomConfig['name'] = meetingName
+                                if meetingUID:
+                                    roomConfig['uid'] = meetingUID
+                                if m.accessCode:
+                                    roomConfig['access_code'] = m.accessCode
+                                if m.meetingID:
+                                    roomConfig['bbb_id'] = m.meetingID
+                                room_data = gl.sync_room(room_data, roomConfig)
+                    except psycopg2.Error as ERR:
+                        # the changes were rolled back, the meeting is processed again in the next cycle
+                        logger.error("database error, skipping meeting {} in this cycle. {}".format(meeting, ERR))
+                        continue
                     #get room info / join urls 
                     if room_id >0:
                         #a room for the meeting does exist
                         # execute all tasks for this meeting on this level (sharing, reminding, starting...
-                        room_data = gl.table_row_as_dict('rooms', 'id', room_id, gl.roomsTableList)
-                        # set room config (name, uid, accessCode,...
-                        if meetingName:
-                            gl.update_field('rooms', 'id', room_data['id'], 'name', meetingName)
-                        if meetingUID:
-                            gl.update_field('rooms', 'id', room_data['id'], 'uid', meetingUID)
-                        if accessCode:
-                            gl.update_field('rooms', 'id', room_data['id'], 'access_code', accessCode)
-                        if meetingID:
-                            gl.update_field('rooms', 'id', room_data['id'], 'bbb_id', meetingID)
                         meetingID = room_data['bbb_id']
                         # create meetingLink
                         meetingLink = "{}/{}".format(servers[server]['link_base'], room_data['uid'])
                         #create moderatorLink
                         moderatorLink = sl.get_join_url(room_data['bbb_id'], 'Moderator', 'moderator', room_data['moderator_pw'])
-                        #set additional meeting properties
-                        muteOnStart = None
-                        if 'muteOnStart' in mDict:
-                            muteOnStart = mDict['muteOnStart']
-                        welcome = None
-                        if 'welcome' in mDict:
-                            welcome = mDict['welcome']
-                            if 'startDate' in mDict:
-                                welcome = welcome.replace('__startDate__', mDict['startDate'])
-                        bannerText = None
-                        if 'bannerText' in mDict:
-                            bannerText = mDict['bannerText']
-                            if 'startDate' in mDict:
-                                bannerText = bannerText.replace('__startDate__', mDict['startDate'])
-                        maxParticipants = None
-                        if 'maxParticipants' in mDict:
-                            maxParticipants = mDict['maxParticipants']
-                        logoutURL = None
-                        if 'logoutURL' in mDict:
-                            logoutURL = mDict['logoutURL']
-                        record = None
-                        if 'record' in mDict:
-                            record = mDict['record']
-                        duration = None
-                        if 'duration' in mDict:
-                            duration = mDict['duration']
-                        autoStartRecording = None
-                        if 'autoStartRecording' in mDict:
-                            autoStartRecording = mDict['autoStartRecording']
-                        allowStartStopRecording = None
-                        if 'allowStartStopRecording' in mDict:
-                            allowStartStopRecording = mDict['allowStartStopRecording']
                         # correct startDate with preSTartMinutes
-                        preStartMinutes = int(args.pre_start)
-                        if 'preStartMinutes' in mDict:
-                            preStartMinutes = mDict['preStartMinutes']
+                        preStartMinutes = m.preStartMinutes
                         minutesLeft = 0
-                        if 'startDate' in mDict:
-                            td = sl.get_date(mDict['startDate']) - NOW
+                        if m.startTime:
+                            td = m.startTime - NOW
                             minutesLeft = int(td.total_seconds()/60)
 
                         # check status of meeting 
@@ -283,8 +273,8 @@ while True:
                         if sl.get_status(meeting, ['status']) != '220':
                             # check if startdate is set and reached...
                             # if no startdate was provided, start now
-                            if not 'startDate' in mDict:
-                                res = sl.start_meeting(room_data['bbb_id'], meetingName, room_data['moderator_pw'], room_data['attendee_pw'], muteOnStart, welcome, bannerText, maxParticipants, logoutURL, record, duration, autoStartRecording, allowStartStopRecording)
+                            if not m.startDate:
+                                res = sl.start_meeting(room_data['bbb_id'], meetingName, room_data['moderator_pw'], room_data['attendee_pw'], *m.start_params())
                                 # set status: 0 failed - keep trying. 2 started - no users have joined, keep open. 1 started and users joined - stop processing
                                 if res == 1:
                                     logger.info("started meeting {} - users have joined".format(meetingName))
@@ -299,8 +289,8 @@ while True:
                                     sl.set_status(meeting, ['status'],  '400', 'meeting could not be started')
                             # if startdate set and now > startdate - preStartMinutes start meeting
                             elif minutesLeft - preStartMinutes <= 0:
-                                logger.info("starting meeting {} now! Startdate: {}".format(meetingName, mDict['startDate']))
-                                res = sl.start_meeting(room_data['bbb_id'], meetingName, room_data['moderator_pw'], room_data['attendee_pw'], muteOnStart, welcome, bannerText, maxParticipants, logoutURL, record, duration, autoStartRecording, allowStartStopRecording)
+                                logger.info("starting meeting {} now! Startdate: {}".format(meetingName, m.startDate))
+                                res = sl.start_meeting(room_data['bbb_id'], meetingName, room_data['moderator_pw'], room_data['attendee_pw'], *m.start_params())
                                 if res == 1:
                                     logger.info("started meeting {} - users have joined".format(meetingName))
                                     status = "started"
@@ -315,10 +305,7 @@ while True:
                             else:
                                 # check if room is to be preopened and
                                 # keep open or wait...
-                                preOpenMinutes = int(args.pre_open)
-                                if 'preOpenMinutes' in mDict:
-                                    preOpenMinutes  = mDict['preOpenMinutes']
-                                preOpenMinutes   = preOpenMinutes + preStartMinutes
+                                preOpenMinutes   = m.preOpenMinutes + preStartMinutes
                                 # if minutes left - pre open minutes <= now
                                 if minutesLeft - preOpenMinutes <= 0:
                                     # check if preopenstatus not 220
@@ -338,7 +325,7 @@ while True:
                                             sl.set_status(meeting, ['preOpen'], '220', 'meeting was not running')
 
                                     # open room
-                                    res = sl.start_meeting(room_data['bbb_id'], meetingName, room_data['moderator_pw'], room_data['attendee_pw'], muteOnStart, welcome, bannerText, maxParticipants, logoutURL, record, duration, autoStartRecording, allowStartStopRecording)
+                                    res = sl.start_meeting(room_data['bbb_id'], meetingName, room_data['moderator_pw'], room_data['attendee_pw'], *m.start_params())
                                     if res == 1:
                                         logger.info("opened meeting {} - users have joined".format(meetingName))
                                         sl.set_status(meeting, ['preOpen'], '220', 'meeting opened, users joined')
@@ -349,20 +336,18 @@ while True:
                                         logger.error("meeting {} could not be pre opened - trying again...".format(meetingName))
                                         sl.set_status(meeting, ['preOpen'], '400', 'meeting could not be started')
 
-                                logger.info("waiting for startDate of meeting {} - startdate: {} (starting in {} minutes). Opening room in {} minutes.".format(meetingName, mDict['startDate'], minutesLeft - preStartMinutes, minutesLeft - preOpenMinutes))
-                                sl.set_status(meeting, ['status'], '201', 'waiting for startDate {}'.format(mDict['startDate']))
+                                logger.info("waiting for startDate of meeting {} - startdate: {} (starting in {} minutes). Opening room in {} minutes.".format(meetingName, m.startDate, minutesLeft - preStartMinutes, minutesLeft - preOpenMinutes))
+                                sl.set_status(meeting, ['status'], '201', 'waiting for startDate {}'.format(m.startDate))
                         # 
                         # if endAfterMinutes is set, close meeting when time is passed
-                        endAfterMinutes = int(args.end_after)
-                        if 'endAfterMinutes' in mDict:
-                            endAfterMinutes = mDict['endAfterMinutes']
+                        endAfterMinutes = m.endAfterMinutes
                         minutesPassed = 0
-                        if 'startDate' in mDict:
-                            td = NOW - sl.get_date(mDict['startDate'])
+                        if m.startTime:
+                            td = NOW - m.startTime
                             minutesPassed = int(td.total_seconds()/60)
                         if minutesPassed > 0 and endAfterMinutes > 0:
                             if minutesPassed < endAfterMinutes:
-                                logger.info("closing meeting {} in {} minutes".format(mDict['meetingName'], endAfterMinutes - minutesPassed))
+                                logger.info("closing meeting {} in {} minutes".format(meetingName, endAfterMinutes - minutesPassed))
                             if minutesPassed >= endAfterMinutes:
                                 # check if endStatus not 220
                                 if sl.get_status(meeting, ['endMeeting']) != '220':
@@ -379,22 +364,19 @@ while True:
                                     else:
                                         logger.info("meeting was not running")
                                         sl.set_status(meeting, ['endMeeting'], '220', 'meeting was not running')
-                                    logger.info("mark meeting {} as finished".format(mDict['meetingName']))
+                                    logger.info("mark meeting {} as finished".format(meetingName))
                                     sl.set_status(meeting, ['status'], '220', 'meeting has finished and was closed')
 
                         #
                         # meeting processed - handle other tasks and mails...
                         # aktivate liveStreaming if configured
                         # 
-                        if 'liveStreaming' in mDict:
+                        if m.liveStreaming:
                             # check if all required parameters are given
-                            liveStreaming = mDict['liveStreaming']
-                            if 'targetUrl' in liveStreaming and 'streamerHost' in liveStreaming:
-                                targetUrl = liveStreaming['targetUrl']
-                                streamerHost = liveStreaming['streamerHost']
-                                playIntro = ""
-                                if 'playIntro' in liveStreaming:
-                                    playIntro = liveStreaming['playIntro']
+                            if m.streamTarget and m.streamerHost:
+                                targetUrl = m.streamTarget
+                                streamerHost = m.streamerHost
+                                playIntro = m.playIntro
 
                                 #parameters are available check if streaming has to be started
                                 logger.debug("liveStreaming configured - check wether to start or not...")
@@ -438,332 +420,195 @@ while True:
                             else:
                                 logger.error("liveStreaming not correctly configured")
 
+
                         # Mail handling
-                        # mail server configs
-                        mail_properties = {}
-                        mail_properties['mailServer'] = servers[server]['mailServer']
-                        mail_properties['mailUser'] = servers[server]['mailUser']
-                        mail_properties['mailPassword'] = servers[server]['mailPassword']
+                        # mail jobs only carry the server id, the template and its parameters
                         # send owner email with infos / links
                         # if  not 250 owner info mail sent
                         if sl.get_status(meeting, ['owner', 'infoMailSent']) != '250':
-                            # sender and receiver
-                            # set mailFrom as required but override if provided on server or meeting basis
-                            mail_properties['mailFrom'] = ownerEmail
-                            if 'mailFrom' in servers[server]:
-                                mail_properties['mailFrom'] = servers[server]['mailFrom']
-                            if 'mailFrom' in mDict:
-                                mail_properties['mailFrom'] = mDict['mailFrom']
-                            # set mailFromName as required but override if provided on server or meeting basis
-                            mail_properties['mailFromName'] = ownerFullName
-                            if 'mailFromName' in servers[server]:
-                                mail_properties['mailFromName'] = servers[server]['mailFromName']
-                            if 'mailFromName' in mDict:
-                                mail_properties['mailFromName'] = mDict['mailFromName']
-                            # set mailTo as required but override if provided on server or meeting basis
-                            mail_properties['mailTo'] = ownerEmail
-                            if 'mailTo' in servers[server]:
-                                mail_properties['mailTo'] = servers[server]['mailTo']
-                            if 'mailTo' in mDict:
-                                mail_properties['mailTo'] = mDict['mailTo']
-                            # set mailToName as required but override if provided on server or meeting basis
-                            mail_properties['mailToName'] = ownerFullName
-                            if 'mailToName' in servers[server]:
-                                mail_properties['mailToName'] = servers[server]['mailToName']
-                            if 'mailToName' in mDict:
-                                mail_properties['mailToName'] = mDict['mailToName']
                             # template to use
-                            mailTemplate = "meetingOwnerInfoTemplate.j2"
-                            if 'meetingOwnerInfoTemplate' in mDict:
-                                mailTemplate = mDict['meetingOwnerInfoTemplate']
-                            mail_properties['mailText'] = sl.render_template(mailTemplate, vars=locals())
-                            try:
-                                res = sl.r.xadd('mailStream', { meeting: json.dumps(mail_properties) })
-                                logger.debug("send owner info mail with template {}".format(mailTemplate))
-                                sl.set_status(meeting, ['owner', 'infoMailSent'], '250', 'sent owner info mail')
-                            except Exception as ERR:
-                                logger.error("failed to send owner info mail for {} to queue. {}".format(meetingName, ERR))
-                                sl.set_status(meeting, ['owner', 'infoMailSent'],  '550', 'sending mail failed')
+                            mailTemplate = m.ownerInfoTemplate
+                            mail_job = {'server': server, 'type': 'ownerInfo', 'template': mailTemplate}
+                            mail_job['params'] = mailContext.ownerInfo(meetingName, meetingLink, m.startDate)._asdict()
+                            mail_job.update(m.mail_addresses(ownerEmail, ownerFullName, ownerEmail, ownerFullName))
+                            if not sl.template_exists(mailTemplate):
+                                sl.set_status(meeting, ['owner', 'infoMailSent'], '550', 'mail template {} not found'.format(mailTemplate))
+                            else:
+                                try:
+                                    res = sl.queue_mail(meeting, mail_job)
+                                    logger.debug("send owner info mail with template {}".format(mailTemplate))
+                                    sl.set_status(meeting, ['owner', 'infoMailSent'], '250', 'sent owner info mail')
+                                except Exception as ERR:
+                                    logger.error("failed to send owner info mail for {} to queue. {}".format(meetingName, ERR))
+                                    sl.set_status(meeting, ['owner', 'infoMailSent'],  '550', 'sending mail failed')
                         # send started mail if status 210 or 220 
                         # if  not 250 owner start mail sent
                         if sl.get_status(meeting, ['owner', 'startMailSent']) != '250':
                             if sl.get_status(meeting, ['status']) == '220' or sl.get_status(meeting, ['status']) == '210':
-                                # set mailFrom as required but override if provided on server or meeting basis
-                                mail_properties['mailFrom'] = ownerEmail
-                                if 'mailFrom' in servers[server]:
-                                    mail_properties['mailFrom'] = servers[server]['mailFrom']
-                                if 'mailFrom' in mDict:
-                                    mail_properties['mailFrom'] = mDict['mailFrom']
-                                # set mailFromName as required but override if provided on server or meeting basis
-                                mail_properties['mailFromName'] = ownerFullName
-                                if 'mailFromName' in servers[server]:
-                                    mail_properties['mailFromName'] = servers[server]['mailFromName']
-                                if 'mailFromName' in mDict:
-                                    mail_properties['mailFromName'] = mDict['mailFromName']
-                                # set mailTo as required but override if provided on server or meeting basis
-                                mail_properties['mailTo'] = ownerEmail
-                                if 'mailTo' in servers[server]:
-                                    mail_properties['mailTo'] = servers[server]['mailTo']
-                                if 'mailTo' in mDict:
-                                    mail_properties['mailTo'] = mDict['mailTo']
-                                # set mailToName as required but override if provided on server or meeting basis
-                                mail_properties['mailToName'] = ownerFullName
-                                if 'mailToName' in servers[server]:
-                                    mail_properties['mailToName'] = servers[server]['mailToName']
-                                if 'mailToName' in mDict:
-                                    mail_properties['mailToName'] = mDict['mailToName']
                                 # template to use
-                                mailTemplate = "meetingOwnerStartedTemplate.j2"
-                                if 'meetingOwnerStartedTemplate' in mDict:
-                                    mailTemplate = mDict['meetingOwnerStartedTemplate']
-                                mail_properties['mailText'] = sl.render_template(mailTemplate, vars=locals())
-                                try:
-                                    res = sl.r.xadd('mailStream', { meeting: json.dumps(mail_properties) })
-                                    # set status to sent owner mail
-                                    logger.debug("sent owner started mail with template {}".format(mailTemplate))
-                                    sl.set_status(meeting, ['owner', 'startMailSent'], '250', 'sent owner start mail')
-                                except Exception as ERR:
-                                    logger.debug("failed to send owner started mail with template {}. {}".format(mailTemplate, ERR))
-                                    sl.set_status(meeting, ['owner', 'startMailSent'], '550', 'sending mail failed')
+                                mailTemplate = m.ownerStartedTemplate
+                                mail_job = {'server': server, 'type': 'ownerStarted', 'template': mailTemplate}
+                                mail_job['params'] = mailContext.ownerStarted(meetingName, meetingLink)._asdict()
+                                mail_job.update(m.mail_addresses(ownerEmail, ownerFullName, ownerEmail, ownerFullName))
+                                if not sl.template_exists(mailTemplate):
+                                    sl.set_status(meeting, ['owner', 'startMailSent'], '550', 'mail template {} not found'.format(mailTemplate))
+                                else:
+                                    try:
+                                        res = sl.queue_mail(meeting, mail_job)
+                                        # set status to sent owner mail
+                                        logger.debug("sent owner started mail with template {}".format(mailTemplate))
+                                        sl.set_status(meeting, ['owner', 'startMailSent'], '250', 'sent owner start mail')
+                                    except Exception as ERR:
+                                        logger.debug("failed to send owner started mail with template {}. {}".format(mailTemplate, ERR))
+                                        sl.set_status(meeting, ['owner', 'startMailSent'], '550', 'sending mail failed')
                         # handle reminder
                         # if startDate set and ( args.reminder_minutes set or mdict['reminder'] ) and now > startDate reminder meeting - reminder (in minutes)
                         # if meeting has no users joined
                         if sl.get_status(meeting, ['status']) != '220':
-                            reminderMinutes =  0
-                            if args.reminder_minutes:
-                                reminderMinutes = int(args.reminder_minutes)
-                            if 'reminderMinutes' in mDict:
-                                reminderMinutes = mDict['reminderMinutes']
-                            if 'startDate' in mDict and reminderMinutes > 0:
+                            reminderMinutes = m.reminderMinutes
+                            if m.startDate and reminderMinutes > 0:
                                 if minutesLeft - preStartMinutes - reminderMinutes > 0:
-                                    logger.debug("meeting {} starting at {} - reminding in {} minutes!".format(meetingName, mDict['startDate'], int(minutesLeft - reminderMinutes - preStartMinutes)))
+                                    logger.debug("meeting {} starting at {} - reminding in {} minutes!".format(meetingName, m.startDate, int(minutesLeft - reminderMinutes - preStartMinutes)))
                                 elif minutesLeft - preStartMinutes > 0:
                                     logger.debug("reminding of meeting {} now!".format(meetingName))
                                     # send reminder mail
                                     # if  not 250 owner reminder mail sent
                                     if sl.get_status(meeting, ['owner', 'reminderMailSent']) != '250':
-                                        # sender and receiver
-                                        # set mailFrom as required but override if provided on server or meeting basis
-                                        mail_properties['mailFrom'] = ownerEmail
-                                        if 'mailFrom' in servers[server]:
-                                            mail_properties['mailFrom'] = servers[server]['mailFrom']
-                                        if 'mailFrom' in mDict:
-                                            mail_properties['mailFrom'] = mDict['mailFrom']
-                                        # set mailFromName as required but override if provided on server or meeting basis
-                                        mail_properties['mailFromName'] = ownerFullName
-                                        if 'mailFromName' in servers[server]:
-                                            mail_properties['mailFromName'] = servers[server]['mailFromName']
-                                        if 'mailFromName' in mDict:
-                                            mail_properties['mailFromName'] = mDict['mailFromName']
-                                        # set mailTo as required but override if provided on server or meeting basis
-                                        mail_properties['mailTo'] = ownerEmail
-                                        if 'mailTo' in servers[server]:
-                                            mail_properties['mailTo'] = servers[server]['mailTo']
-                                        if 'mailTo' in mDict:
-                                            mail_properties['mailTo'] = mDict['mailTo']
-                                        # set mailToName as required but override if provided on server or meeting basis
-                                        mail_properties['mailToName'] = ownerFullName
-                                        if 'mailToName' in servers[server]:
-                                            mail_properties['mailToName'] = servers[server]['mailToName']
-                                        if 'mailToName' in mDict:
-                                            mail_properties['mailToName'] = mDict['mailToName']
                                         # template to use
-                                        mailTemplate = "meetingOwnerReminderTemplate.j2"
-                                        if 'meetingOwnerReminderTemplate' in mDict:
-                                            mailTemplate = mDict['meetingOwnerReminderTemplate']
-                                        mail_properties['mailText'] = sl.render_template(mailTemplate, vars=locals())
-                                        try:
-                                            res = sl.r.xadd('mailStream', { meeting: json.dumps(mail_properties) })
-                                            # set status to sent owner mail
-                                            logger.debug("sent owner reminder mail with template {}".format(mailTemplate))
-                                            sl.set_status(meeting, ['owner', 'reminderMailSent'], '250', 'sent owner reminder mail')
-                                        except Exception as ERR:
-                                            logger.debug("failed to send owner reminder mail with template {}. {}".format(mailTemplate, ERR))
-                                            sl.set_status(meeting, ['owner', 'reminderMailSent'], '550', 'sending mail failed')
-                        #
-                        # check if share_with was provided containing email -> fullName otherwise fail
-                        #todo: remove continue replace with if else
-                        if 'shareWith' in mDict:
-                            if isinstance(mDict['shareWith'], dict):
-                                for email in mDict['shareWith']:
-                                    send_emails = meeting_send_emails
-                                    if 'send_emails' in mDict['shareWith'][email]:
-                                        send_emails = mDict['shareWith'][email]['send_emails']
-                                    logger.debug("sharing room with {}".format(email))
-                                    if sl.get_status(meeting, ['shareWith', email]) != '220':
-                                        if 'fullName' in mDict['shareWith'][email]:
-                                            fullName = mDict['shareWith'][email]['fullName']
+                                        mailTemplate = m.ownerReminderTemplate
+                                        mail_job = {'server': server, 'type': 'ownerReminder', 'template': mailTemplate}
+                                        mail_job['params'] = mailContext.ownerReminder(meetingName, meetingLink, minutesLeft)._asdict()
+                                        mail_job.update(m.mail_addresses(ownerEmail, ownerFullName, ownerEmail, ownerFullName))
+                                        if not sl.template_exists(mailTemplate):
+                                            sl.set_status(meeting, ['owner', 'reminderMailSent'], '550', 'mail template {} not found'.format(mailTemplate))
                                         else:
-                                            fullName = email.partition('@')[0]
-                                        res = gl.share_room(room_id, email)
-                                        if res > 0:
-                                            logger.debug("shared room {} with {}".format(room_id, email))
-                                            sl.set_status(meeting, ['shareWith', email], '220', 'room shared')
-                                    else:
-                                        logger.debug("room already shared {} with {}".format(room_id, email))
+                                            try:
+                                                res = sl.queue_mail(meeting, mail_job)
+                                                # set status to sent owner mail
+                                                logger.debug("sent owner reminder mail with template {}".format(mailTemplate))
+                                                sl.set_status(meeting, ['owner', 'reminderMailSent'], '250', 'sent owner reminder mail')
+                                            except Exception as ERR:
+                                                logger.debug("failed to send owner reminder mail with template {}. {}".format(mailTemplate, ERR))
+                                                sl.set_status(meeting, ['owner', 'reminderMailSent'], '550', 'sending mail failed')
+                        #
+                        # share the room with the recipients of shareWith (email -> fullName)
+                        if m.shareWith:
+                            # only recipients not completed yet, nothing once the room is shared with all and all mails were sent
+                            pending = sl.fanout_pending(meeting, 'shareWith', list(m.shareWith), [([], '220'), (['sendShareMail'], '250')])
+                            # template to use
+                            mailTemplate = m.shareTemplate
+                            # the share mails stay pending until the template exists
+                            templateFound = sl.template_exists(mailTemplate)
+                            for n in range(0, len(pending), sl.fanout_chunk):
+                                chunk = pending[n:n + sl.fanout_chunk]
+                                # status of the chunk with one request
+                                returnCodes = sl.get_status_many(meeting, [['shareWith', email] for email in chunk] + [['shareWith', email, 'sendShareMail'] for email in chunk])
+                                shared = dict(zip(chunk, returnCodes[:len(chunk)]))
+                                mailed = dict(zip(chunk, returnCodes[len(chunk):]))
+                                statusList = []
+                                queued = []
+                                # share the room with all users of the chunk at once
+                                unshared = [email for email in chunk if shared[email] != '220']
+                                if unshared:
+                                    logger.debug("sharing room with {}".format(", ".join(unshared)))
+                                    try:
+                                        sharedEmails = gl.share_rooms(room_id, unshared)
+                                    except psycopg2.Error as ERR:
+                                        # the shares stay pending and are retried in the next cycle
+                                        logger.error("could not share room {}. {}".format(room_id, ERR))
+                                        sharedEmails = []
+                                    for email in sharedEmails:
+                                        logger.debug("shared room {} with {}".format(room_id, email))
+                                        statusList.append((['shareWith', email], '220', 'room shared'))
+                                        shared[email] = '220'
+                                pipe = sl.r.pipeline(transaction=False)
+                                for email in chunk:
                                     # send share mail
-                                    if sl.get_status(meeting, ['shareWith', email, 'sendShareMail']) != '250':
-                                        # mail server configs
-                                        mail_properties = {}
-                                        mail_properties['mailServer'] = servers[server]['mailServer']
-                                        mail_properties['mailUser'] = servers[server]['mailUser']
-                                        mail_properties['mailPassword'] = servers[server]['mailPassword']
-                                        # sender and receiver
-                                        # set mailFrom as required but override if provided on server or meeting basis
-                                        mail_properties['mailFrom'] = ownerEmail
-                                        if 'mailFrom' in servers[server]:
-                                            mail_properties['mailFrom'] = servers[server]['mailFrom']
-                                        if 'mailFrom' in mDict:
-                                            mail_properties['mailFrom'] = mDict['mailFrom']
-                                        # set mailFromName as required but override if provided on server or meeting basis
-                                        mail_properties['mailFromName'] = ownerFullName
-                                        if 'mailFromName' in servers[server]:
-                                            mail_properties['mailFromName'] = servers[server]['mailFromName']
-                                        if 'mailFromName' in mDict:
-                                            mail_properties['mailFromName'] = mDict['mailFromName']
-                                        # set mailTo as required but override if provided on server or meeting basis
-                                        mail_properties['mailTo'] = email
-                                        if 'mailTo' in servers[server]:
-                                            mail_properties['mailTo'] = servers[server]['mailTo']
-                                        if 'mailTo' in mDict:
-                                            mail_properties['mailTo'] = mDict['mailTo']
-                                        # set mailToName as required but override if provided on server or meeting basis
-                                        mail_properties['mailToName'] = fullName
-                                        if 'mailToName' in servers[server]:
-                                            mail_properties['mailToName'] = servers[server]['mailToName']
-                                        if 'mailToName' in mDict:
-                                            mail_properties['mailToName'] = mDict['mailToName']
-                                        # template to use
-                                        mailTemplate = "meetingShareInfoTemplate.j2"
-                                        if 'meetingShareInfoTemplate' in mDict:
-                                            mailTemplate = mDict['meetingShareInfoTemplate']
-                                        mail_properties['mailText'] = sl.render_template(mailTemplate, vars=locals())
-                                        try:
-                                            res = sl.r.xadd('mailStream', { meeting: json.dumps(mail_properties) })
-                                            logger.debug("sent share mail with template {}".format(mailTemplate))
-                                            sl.set_status(meeting, ['shareWith', email, 'sendShareMail'], '250', 'sent mail')
-                                        except Exception as ERR:
-                                            logger.error("could not send share mail with template {}. {}".format(mailTemplate, ERR))
-                                            sl.set_status(meeting, ['shareWith', email, 'sendShareMail'], '440', 'could not send share mail')
+                                    if mailed[email] != '250' and templateFound:
+                                        mail_job = {'server': server, 'type': 'share', 'template': mailTemplate}
+                                        mail_job['params'] = mailContext.share(meetingName, meetingLink, ownerFullName)._asdict()
+                                        mail_job.update(m.mail_addresses(ownerEmail, ownerFullName, email, m.shareWith[email]))
+                                        sl.queue_mail(meeting, mail_job, pipe)
+                                        queued.append(email)
+                                try:
+                                    res = pipe.execute()
+                                    logger.debug("sent {} share mails with template {}".format(len(queued), mailTemplate))
+                                    statusList.extend([(['shareWith', email, 'sendShareMail'], '250', 'sent mail') for email in queued])
+                                    for email in queued:
+                                        mailed[email] = '250'
+                                except Exception as ERR:
+                                    logger.error("could not send share mails with template {}. {}".format(mailTemplate, ERR))
+                                    statusList.extend([(['shareWith', email, 'sendShareMail'], '440', 'could not send share mail') for email in queued])
+                                sl.set_status_many(meeting, statusList)
+                                sl.fanout_done(meeting, 'shareWith', [email for email in chunk if shared[email] == '220' and mailed[email] == '250'])
 
                         #        sendInvitationLink:
-                        if 'sendInvitationLink' in mDict:
-                            if isinstance(mDict['sendInvitationLink'], dict):
-                                for email in mDict['sendInvitationLink']:
-                                    # get status
-                                    if sl.get_status(meeting, ['sendInvitationLink', email]) == '250':
-                                        logger.debug("invitation to {} already sent".format(email))
-                                        continue 
-
-                                    # prepare and send mail
-                                    if 'fullName' in mDict['sendInvitationLink'][email]:
-                                        fullName = mDict['sendInvitationLink'][email]['fullName']
-                                    else:
-                                        fullName = email.partition('@')[0]
-                                    # mail server configs
-                                    mail_properties = {}
-                                    mail_properties['mailServer'] = servers[server]['mailServer']
-                                    mail_properties['mailUser'] = servers[server]['mailUser']
-                                    mail_properties['mailPassword'] = servers[server]['mailPassword']
-                                    # sender and receiver
-                                    # set mailFrom as required but override if provided on server or meeting basis
-                                    mail_properties['mailFrom'] = ownerEmail
-                                    if 'mailFrom' in servers[server]:
-                                        mail_properties['mailFrom'] = servers[server]['mailFrom']
-                                    if 'mailFrom' in mDict:
-                                        mail_properties['mailFrom'] = mDict['mailFrom']
-                                    # set mailFromName as required but override if provided on server or meeting basis
-                                    mail_properties['mailFromName'] = ownerFullName
-                                    if 'mailFromName' in servers[server]:
-                                        mail_properties['mailFromName'] = servers[server]['mailFromName']
-                                    if 'mailFromName' in mDict:
-                                        mail_properties['mailFromName'] = mDict['mailFromName']
-                                    # set mailTo as required but override if provided on server or meeting basis
-                                    mail_properties['mailTo'] = email
-                                    if 'mailTo' in servers[server]:
-                                        mail_properties['mailTo'] = servers[server]['mailTo']
-                                    if 'mailTo' in mDict:
-                                        mail_properties['mailTo'] = mDict['mailTo']
-                                    # set mailToName as required but override if provided on server or meeting basis
-                                    mail_properties['mailToName'] = fullName
-                                    if 'mailToName' in servers[server]:
-                                        mail_properties['mailToName'] = servers[server]['mailToName']
-                                    if 'mailToName' in mDict:
-                                        mail_properties['mailToName'] = mDict['mailToName']
-                                    # template to use
-                                    mailTemplate = "meetingInvitationInfoTemplate.j2"
-                                    if 'meetingInvitationInfoTemplate' in mDict:
-                                        mailTemplate = mDict['meetingInvitationInfoTemplate']
-                                    mail_properties['mailText'] = sl.render_template(mailTemplate, vars=locals())
-                                    try:
-                                        res = sl.r.xadd('mailStream', { meeting: json.dumps(mail_properties) })
-                                        logger.debug("invitation to {} sent".format(email))
-                                        sl.set_status(meeting, ['sendInvitationLink', email], '250', 'invitation mail sent')
-                                    except Exception as ERR:
-                                        logger.error("invitation to {} could not be send. {}".format(email, ERR))
-                                        sl.set_status(meeting, ['sendInvitationLink', email], '550', 'invitation mail could not be send')
+                        if m.sendInvitationLink:
+                            # only recipients without sent invitation, nothing once all invitations were sent
+                            pending = sl.fanout_pending(meeting, 'sendInvitationLink', list(m.sendInvitationLink), [([], '250')])
+                            # template to use
+                            mailTemplate = m.invitationTemplate
+                            if not sl.template_exists(mailTemplate):
+                                # the invitations stay pending until the template exists
+                                pending = []
+                            for n in range(0, len(pending), sl.fanout_chunk):
+                                chunk = pending[n:n + sl.fanout_chunk]
+                                # queue the mails of the chunk with one request
+                                pipe = sl.r.pipeline(transaction=False)
+                                for email in chunk:
+                                    mail_job = {'server': server, 'type': 'invitation', 'template': mailTemplate}
+                                    mail_job['params'] = mailContext.invitation(meetingName, meetingLink, ownerFullName, m.startDate)._asdict()
+                                    mail_job.update(m.mail_addresses(ownerEmail, ownerFullName, email, m.sendInvitationLink[email]))
+                                    sl.queue_mail(meeting, mail_job, pipe)
+                                try:
+                                    res = pipe.execute()
+                                    logger.debug("invitations to {} sent".format(", ".join(chunk)))
+                                    sl.set_status_many(meeting, [(['sendInvitationLink', email], '250', 'invitation mail sent') for email in chunk])
+                                    sl.fanout_done(meeting, 'sendInvitationLink', chunk)
+                                except Exception as ERR:
+                                    logger.error("invitations to {} could not be send. {}".format(", ".join(chunk), ERR))
+                                    sl.set_status_many(meeting, [(['sendInvitationLink', email], '550', 'invitation mail could not be send') for email in chunk])
 
                         #        sendModeratorLink:
-                        if 'sendModeratorLink' in mDict:
-                            if isinstance(mDict['sendModeratorLink'], dict):
-                                for email in mDict['sendModeratorLink']:
-                                    send_emails = meeting_send_emails
-                                    if 'send_emails' in mDict['sendModeratorLink'][email]:
-                                        send_emails = mDict['sendModeratorLink'][email]['send_emails']
-                                    if sl.get_status(meeting, ['sendModeratorLink', email]) == '250':
-                                        logger.debug("moderator link already sent")
-                                        continue
-                                    if 'fullName' in mDict['sendModeratorLink'][email]:
-                                        fullName = mDict['sendModeratorLink'][email]['fullName']
-                                    else:
-                                        fullName = email.partition('@')[0]
+                        if m.sendModeratorLink:
+                            # only recipients without sent moderator link, nothing once all links were sent
+                            pending = sl.fanout_pending(meeting, 'sendModeratorLink', list(m.sendModeratorLink), [([], '250')])
+                            # template to use
+                            mailTemplate = m.moderatorTemplate
+                            if not sl.template_exists(mailTemplate):
+                                # the moderator links stay pending until the template exists
+                                pending = []
+                            for n in range(0, len(pending), sl.fanout_chunk):
+                                chunk = pending[n:n + sl.fanout_chunk]
+                                statusList = []
+                                queued = []
+                                pipe = sl.r.pipeline(transaction=False)
+                                for email in chunk:
+                                    fullName = m.sendModeratorLink[email]
                                     moderatorLink = sl.get_join_url(room_data['bbb_id'], fullName, 'moderator', room_data['moderator_pw'])
                                     if moderatorLink:
-                                        # mail server configs
-                                        mail_properties = {}
-                                        mail_properties['mailServer'] = servers[server]['mailServer']
-                                        mail_properties['mailUser'] = servers[server]['mailUser']
-                                        mail_properties['mailPassword'] = servers[server]['mailPassword']
-                                        # sender and receiver
-                                        # set mailFrom as required but override if provided on server or meeting basis
-                                        mail_properties['mailFrom'] = ownerEmail
-                                        if 'mailFrom' in servers[server]:
-                                            mail_properties['mailFrom'] = servers[server]['mailFrom']
-                                        if 'mailFrom' in mDict:
-                                            mail_properties['mailFrom'] = mDict['mailFrom']
-                                        # set mailFromName as required but override if provided on server or meeting basis
-                                        mail_properties['mailFromName'] = ownerFullName
-                                        if 'mailFromName' in servers[server]:
-                                            mail_properties['mailFromName'] = servers[server]['mailFromName']
-                                        if 'mailFromName' in mDict:
-                                            mail_properties['mailFromName'] = mDict['mailFromName']
-                                        # set mailTo as required but override if provided on server or meeting basis
-                                        mail_properties['mailTo'] = email
-                                        if 'mailTo' in servers[server]:
-                                            mail_properties['mailTo'] = servers[server]['mailTo']
-                                        if 'mailTo' in mDict:
-                                            mail_properties['mailTo'] = mDict['mailTo']
-                                        # set mailToName as required but override if provided on server or meeting basis
-                                        mail_properties['mailToName'] = fullName
-                                        if 'mailToName' in servers[server]:
-                                            mail_properties['mailToName'] = servers[server]['mailToName']
-                                        if 'mailToName' in mDict:
-                                            mail_properties['mailToName'] = mDict['mailToName']
-                                        # template to use
-                                        mailTemplate = "meetingModeratorInfoTemplate.j2"
-                                        if 'meetingModeratorInfoTemplate' in mDict:
-                                            mailTemplate = mDict['meetingModeratorInfoTemplate']
-                                        mail_properties['mailText'] = sl.render_template(mailTemplate, vars=locals())
-                                        try:
-                                            res = sl.r.xadd('mailStream', { meeting: json.dumps(mail_properties) })
-                                            logger.debug("sent moderator info mail with template {}".format(mailTemplate))
-                                            sl.set_status(meeting, ['sendModeratorLink', email], '250', 'sent moderator info mail')
-                                        except Exception as ERR:
-                                            logger.error("could not send moderator info mail with template {}. {}".format(mailTemplate, ERR))
-                                            sl.set_status(meeting, ['sendModeratorLink', email], '440', 'could not send moderator link')
+                                        mail_job = {'server': server, 'type': 'moderator', 'template': mailTemplate}
+                                        mail_job['params'] = mailContext.moderator(meetingName, moderatorLink, ownerFullName, m.startDate)._asdict()
+                                        mail_job.update(m.mail_addresses(ownerEmail, ownerFullName, email, fullName))
+                                        sl.queue_mail(meeting, mail_job, pipe)
+                                        queued.append(email)
                                     else:
                                         logger.debug("Could not create and send moderator link")
-                                        sl.set_status(meeting, ['sendModeratorLink', email], '440', 'could not create moderator link')
+                                        statusList.append((['sendModeratorLink', email], '440', 'could not create moderator link'))
+                                try:
+                                    res = pipe.execute()
+                                    logger.debug("sent {} moderator info mails with template {}".format(len(queued), mailTemplate))
+                                    statusList.extend([(['sendModeratorLink', email], '250', 'sent moderator info mail') for email in queued])
+                                    sl.fanout_done(meeting, 'sendModeratorLink', queued)
+                                except Exception as ERR:
+                                    logger.error("could not send moderator info mails with template {}. {}".format(mailTemplate, ERR))
+                                    statusList.extend([(['sendModeratorLink', email], '440', 'could not send moderator link') for email in queued])
+                                sl.set_status_many(meeting, statusList)
+
+                        # archive the meeting, once it is running or has finished and all its work is done
+                        if not args.no_archive and sl.get_status(meeting, ['status']) == '220' and finished(meeting, m):
+                            if sl.archive_meeting(meeting, int(args.archive_ttl)):
+                                logger.info("archived finished meeting {}".format(meeting))
                     else:
                         logger.error("no room available")
                         sl.set_status(meeting, ['status'], '404', 'no room available')
@@ -774,9 +619,6 @@ while True:
                 logger.debug("No owner found. Provide one Owner with email and optional fullName")
                 sl.set_status(meeting, ['status'], '404', 'no owner with email provided')
 
-        # finally store processed meeting
-        logger.debug("saving meeting...")
-        logger.debug("saved meeting: {}".format(sl.r.set('meeting:{}'.format(meeting), json.dumps(mDict))))
         logger.debug("waiting...")
         time.sleep(0.1)
 
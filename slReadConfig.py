@@ -10,34 +10,150 @@
 # You should have received a copy of the GNU General Public License along with Foobar.  If not, see <https://www.gnu.org/licenses/>.
 #
 import logging.handlers
-import argparse, sys, os, logging, yaml, json
+import argparse, sys, os, logging, json
 from datetime import datetime, timedelta
 from scheduLight import scheduLight
+from configLoader import read_yaml, write_yaml, fragment_files, file_hash, read_fragment, read_fragments
+import csvImport
 
 def parseArgs():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c","--configFile", help="path to config file in yaml format", default="./config.yml")
     parser.add_argument("-k","--keep_redis_cache", help="keep the status and config in redis cache for n seconds", default="31536000")
     parser.add_argument("-i","--importCSV", help="path to meetings csv file to import")
+    parser.add_argument("--importFragment", help="write the imported meetings to the fragment <name>.yml in the configDir instead of the configFile")
+    parser.add_argument("--configDir", help="directory of yaml config fragments merged into the config, default: conf.d next to the configFile")
+    parser.add_argument("-a","--reload_all", help="read all fragments of the configDir, also the unchanged ones", action="store_true")
+    parser.add_argument("-w","--workers", help="validate the imported rows and parse the changed fragments in n processes", default=os.cpu_count() or 1)
     parser.add_argument("-d","--delete_meetings", help="delete meetings from redis if they where remove from the config file", action="store_true")
     parser.add_argument("-g","--logFile", help="path to logFile in yaml format", default="./scheduLight.log")
+    parser.add_argument("--doc_codec", help="store meetings and servers with this codec: json, msgpack, optionally compressed (json+zlib, msgpack+zlib, msgpack+zstd)")
     return parser.parse_args()
 
-def write_yaml(dataFile,config):
-    with open(dataFile, 'w') as outfile:
-        yaml.dump(config, outfile, default_flow_style=False, allow_unicode=True)
+def sync_server(server, entry, entryHash):
+    # store a server if it was added or changed, returns False if it is invalid
+    field = 'server:{}'.format(server)
+    if serverRaw[server] is not None and configHashes.get(field) == '{}:{}'.format(entryHash, sl.doc_version(serverRaw[server])):
+        # unchanged, keep it for another keep_redis_cache seconds
+        pipe.expire(field, expire)
+        return True
+    errors = sl.server_schema.validate(entry)
+    if errors:
+        logger.error("please provide all required fields for the server: {}".format(errors))
+        return False
+    version = sl.store_server(server, entry, expire, pipe)
+    pipe.hset('configHashes', field, '{}:{}'.format(entryHash, version))
+    logger.info("added server {}".format(server))
+    return True
 
-def read_yaml(dataFile, ignore_missing_file = False):
-    try:
-        with open(dataFile, 'r') as stream:
-            try:
-                return yaml.load(stream, Loader=yaml.SafeLoader)
-            except yaml.YAMLError as ERR:
-                logger.error(ERR)
-                sys.exit()
-    except FileNotFoundError as ERR:
-        if ignore_missing_file  != True:
-            sys.exit()
+def sync_meeting(m, entry, entryHash):
+    # store a meeting if it was added or changed, returns False if it is invalid
+    field = 'meeting:{}'.format(m)
+    (storedHash, sep, storedVersion) = configHashes.get(field, '').partition(':')
+    if storedHash == entryHash:
+        # archived meetings stay archived unless they were changed in the configFile
+        if m in archivedList:
+            logger.debug("meeting {} is archived and unchanged".format(m))
+            return True
+        if versions[m] is not None and versions[m] == storedVersion:
+            # unchanged, keep it for another keep_redis_cache seconds
+            pipe.expire(field, expire)
+            pipe.expire('meeting:{}:version'.format(m), expire)
+            newMeetings.add(m)
+            return True
+    (errors, mDict) = sl.ingest_meeting(entry)
+    if errors:
+        logger.error("please provide all required fields for the meeting: {}".format(errors))
+        return False
+    if m in archivedList:
+        (archivedDict, version) = sl.archived_meeting(m)
+        if archivedDict == mDict:
+            logger.debug("meeting {} is archived and unchanged".format(m))
+            pipe.hset('configHashes', field, '{}:{}'.format(entryHash, version))
+            return True
+        sl.drop_archive(m, pipe)
+    version = sl.store_meeting(m, mDict, expire, pipe)
+    pipe.hset('configHashes', field, '{}:{}'.format(entryHash, version))
+    newMeetings.add(m)
+    logger.info("added meeting {}".format(m))
+    return True
+
+def sync_entries(config):
+    """ store the servers and meetings of the configFile or a fragment that are not configured by a file merged later
+
+    returns name -> hash of the valid servers and meetings taken from the file
+    """
+    synced = {}
+    for (section, sync) in [('servers', sync_server), ('meetings', sync_meeting)]:
+        if section not in config:
+            continue
+        sections.add(section)
+        synced[section] = {}
+        entries = config[section] or {}
+        for name in entries:
+            if section == 'meetings':
+                configuredMeetings.add(name)
+            if name in claimed[section]:
+                logger.debug("{} is configured by a fragment merged later".format(name))
+                continue
+            logger.debug("processing {}...".format(name))
+            entryHash = sl.config_hash(entries[name])
+            if sync(name, entries[name], entryHash):
+                synced[section][name] = entryHash
+        claimed[section].update(synced[section])
+    return synced
+
+def keep_fragment(name, record):
+    """ keep the servers and meetings of an unchanged fragment, they are refreshed every keep_redis_cache / 2 seconds
+
+    returns False if an entry of the fragment is stored from another file, was changed or deleted (e.g. via the api),
+    the fragment has to be read again
+    """
+    entries = {}
+    for (section, type) in [('servers', 'server'), ('meetings', 'meeting')]:
+        if record.get(section) is None:
+            continue
+        entries[section] = [entry for entry in record[section] if entry not in claimed[section]]
+        stored = {}
+        for entry in entries[section]:
+            (storedHash, sep, stored[entry]) = configHashes.get('{}:{}'.format(type, entry), '').partition(':')
+            if storedHash != record[section][entry]:
+                return False
+        # the stored documents still have the version written from the fragment, archived meetings are not stored
+        if section == 'servers':
+            check = entries[section]
+            raw = sl.r.mget(['server:{}'.format(server) for server in check]) if check else []
+            current = [sl.doc_version(doc) if doc is not None else None for doc in raw]
+        else:
+            check = [m for m in entries[section] if m not in archivedList]
+            current = sl.r.mget(['meeting:{}:version'.format(m) for m in check]) if check else []
+        for (entry, version) in zip(check, current):
+            if version is None or version != stored[entry]:
+                logger.debug("{} {} of config fragment {} was changed or deleted".format(type, entry, name))
+                return False
+    refresh = now - record.get('refreshed', 0) > expire / 2
+    for section in entries:
+        sections.add(section)
+        claimed[section].update(entries[section])
+        if section == 'servers':
+            if refresh:
+                for server in entries[section]:
+                    pipe.expire('server:{}'.format(server), expire)
+            continue
+        configuredMeetings.update(record[section])
+        for m in entries[section]:
+            if m in archivedList:
+                continue
+            newMeetings.add(m)
+            if refresh:
+                pipe.expire('meeting:{}'.format(m), expire)
+                pipe.expire('meeting:{}:version'.format(m), expire)
+    if refresh:
+        record['refreshed'] = now
+    if refresh or name in touchedFragments:
+        pipe.hset('configFragments', name, json.dumps(record))
+    logger.debug("config fragment {} is unchanged".format(name))
+    return True
 
 #############
 ### start ###
@@ -72,142 +188,183 @@ logger.debug("Date: {}".format(NOW))
 # loading config
 logger.debug("loading config from {}...".format(args.configFile))
 meetingsConfig = read_yaml(args.configFile)
+if not meetingsConfig:
+    meetingsConfig = {}
+configDir = args.configDir or os.path.join(os.path.dirname(os.path.abspath(args.configFile)), 'conf.d')
 
-#import meetings csv to configFile
+#import meetings csv to redis and to the configFile or a fragment in the configDir
 if args.importCSV:
-    logger.debug("import meetings csv from {} to config file...".format(args.importCSV))
-    if 'meetings' not in meetingsConfig:
-        meetingsConfig['meetings'] = {}
-    mDict = meetingsConfig['meetings']
-
-    with open(args.importCSV, 'r') as csv:
-        for line in csv:
-            (givenname, sn, email, password, startdate, room_url, live_url, title, server) = line.strip().split(';')
-            givenname = givenname.strip()
-            sn = sn.strip()
-            name = "{} {}".format(givenname, sn)
-            orig_email = email.strip()
-            email = email.lower().strip()
-            password = password.strip()
-            startdate = startdate.strip()
-            if startdate  == '0000-00-00':
-                startdate = None
-            meetingTitle = title
-            meetingKey = email.replace('@', '_').replace('.', '_')
-            server = server.strip()
-
-            # meeting infos
-            mDict[meetingKey] = {}
-            mDict[meetingKey]['id'] = meetingKey
-            mDict[meetingKey]['server'] = server
-            mDict[meetingKey]['meetingName'] = "{}".format(name)
-            mDict[meetingKey]['meetingTitle'] = meetingTitle
-            if startdate:
-                mDict[meetingKey]['startDate'] = startdate
-            # owner info
-            mDict[meetingKey]['owner'] = {}
-            mDict[meetingKey]['useHomeRoom'] = True
-            mDict[meetingKey]['owner']['email'] = email
-            mDict[meetingKey]['owner']['password'] = password
-            mDict[meetingKey]['owner']['socialUid'] = "CN={},OU=USERS,OU=EXTERNAL,DC=ldap,DC=domain,DC=tld".format(orig_email)
-            mDict[meetingKey]['owner']['fullName'] = name
-            # templates
-            mDict[meetingKey]['meetingOwnerInfoTemplate'] = "imported-meetingOwnerInfoTemplate.j2"
-            mDict[meetingKey]['meetingModeratorInfoTemplate'] = "imported-meetingModeratorInfoTemplate.j2"
-            mDict[meetingKey]['meetingShareInfoTemplate'] = "imported-meetingShareInfoTemplate.j2"
-            mDict[meetingKey]['meetingInvitationInfoTemplate'] = "imported-meetingInvitationInfoTemplate.j2"
-            mDict[meetingKey]['meetingOwnerStartedTemplate'] = "imported-meetingOwnerStartedTemplate.j2"
-            mDict[meetingKey]['meetingOwnerReminderTemplate'] = "imported-meetingOwnerReminderTemplate.j2"
-            #settings
-            mDict[meetingKey]['muteOnStart'] = "true"
-#                        mDict[meetingKey]['welcome'] = None
-#                        mDict[meetingKey]['bannerText'] = None
-            mDict[meetingKey]['maxParticipants'] = 150
-            mDict[meetingKey]['logoutURL'] = "importet.logout.url"
-#                        mDict[meetingKey]['record'] = None
-#                        mDict[meetingKey]['duration'] = None
-#                        mDict[meetingKey]['autoStartRecording'] = False
-#                        mDict[meetingKey]['allowStartStopRecording'] = None
-            #mDict[meetingKey]['accessCode'] = ""
-                        # prepare         liveStreaming parameters
-            mDict[meetingKey]['liveStreaming'] = {}
-            mDict[meetingKey]['liveStreaming']['playIntro'] = "/video/5min.mp4"
-            mDict[meetingKey]['liveStreaming']['streamerHost'] = live_url
-            mDict[meetingKey]['liveStreaming']['targetUrl'] = "rtmp://{}/stream/bbb".format(live_url)
-    write_yaml(args.configFile, meetingsConfig)
+    logger.debug("import meetings csv from {}...".format(args.importCSV))
+    expire = int(args.keep_redis_cache)
+    workers = int(args.workers)
+    if args.importFragment:
+        fragmentFile = os.path.join(configDir, "{}.yml".format(args.importFragment))
+        os.makedirs(configDir, exist_ok=True)
+        try:
+            (imported, failed) = csvImport.import_csv(sl, args.importCSV, logger, expire, workers, fragmentFile=fragmentFile)
+        except Exception as ERR:
+            logger.error("failed to import {}. {}".format(args.importCSV, ERR))
+            sys.exit()
+        logger.info("imported {} meetings to {}, {} rows failed".format(imported, fragmentFile, failed))
+    else:
+        if 'meetings' not in meetingsConfig or not meetingsConfig['meetings']:
+            meetingsConfig['meetings'] = {}
+        try:
+            (imported, failed) = csvImport.import_csv(sl, args.importCSV, logger, expire, workers, meetings=meetingsConfig['meetings'])
+        except Exception as ERR:
+            logger.error("failed to import {}. {}".format(args.importCSV, ERR))
+            sys.exit()
+        write_yaml(args.configFile, meetingsConfig)
+        logger.info("imported {} meetings to {}, {} rows failed".format(imported, args.configFile, failed))
 
 # read config from file
 else:
-    if 'servers'  in meetingsConfig:
-        serversList = set(meetingsConfig['servers'])
-        # update servers list in redis
-        if sl.r.exists('servers'):
-            logger.debug("store last servers to compare: {}".format(sl.r.rename('servers', 'oldservers')))
-        # process servers in config
-        for server in serversList:
-            logger.debug("processing {}...".format(server))
-            errors = sl.server_schema.validate(meetingsConfig['servers'][server])
-            if errors:
-                logger.error("please provide all required fields for the server: {}".format(errors))
-                continue
+    # only added or changed entries are written, the hash of every entry is kept in configHashes together with the
+    # version of the stored document. All changes are applied in one transaction.
+    configHashes = sl.r.hgetall('configHashes')
+    expire = int(args.keep_redis_cache)
+    now = int(NOW.timestamp())
+    pipe = sl.r.pipeline()
 
+    # fragments of the configDir with the same size and mtime or content as when they were read last are not parsed again,
+    # the entries they configured are kept in configFragments. The changed fragments are parsed in parallel.
+    fragments = fragment_files(configDir)
+    fragmentRecords = { name: json.loads(record) for (name, record) in sl.r.hgetall('configFragments').items() }
+    changedFragments = []
+    touchedFragments = set()
+    for name in fragments:
+        record = fragmentRecords.get(name)
+        if record and not args.reload_all and record.get('codec') == sl.doc_codec:
+            fragmentFile = os.path.join(configDir, name)
             try:
-                sl.r.sadd('servers', server)
-                sl.r.set('server:{}'.format(server), json.dumps(meetingsConfig['servers'][server]))
-                sl.r.expire('server:{}'.format(server), args.keep_redis_cache)
-                logger.info("added server {}".format(server))
-            except Exception as ERR:
-                logger.error("failed to add server {} to queue. {}".format(m, ERR))
+                stat = os.stat(fragmentFile)
+                if stat.st_size == record['size'] and (stat.st_mtime_ns == record['mtime'] or file_hash(fragmentFile) == record['hash']):
+                    if stat.st_mtime_ns != record['mtime']:
+                        # touched but unchanged
+                        record['mtime'] = stat.st_mtime_ns
+                        touchedFragments.add(name)
+                    continue
+            except OSError:
+                pass
+        changedFragments.append(name)
+    fragmentConfigs = {}
+    for (fragmentFile, (mtime, size, contentHash, config, error)) in read_fragments([os.path.join(configDir, name) for name in changedFragments], int(args.workers)):
+        name = os.path.basename(fragmentFile)
+        if error:
+            # a fragment read before keeps its entries until it can be read again
+            logger.error("failed to read config fragment {}. {}".format(name, error))
+            continue
+        logger.debug("loaded config fragment {}".format(name))
+        fragmentConfigs[name] = ({ 'mtime': mtime, 'size': size, 'hash': contentHash, 'codec': sl.doc_codec }, config)
+
+    # load the stored servers and meetings of the parsed files with one request each
+    serversList = set()
+    meetingsList = set()
+    for config in [meetingsConfig] + [config for (record, config) in fragmentConfigs.values()]:
+        serversList.update(config.get('servers') or {})
+        meetingsList.update(config.get('meetings') or {})
+    serversList = list(serversList)
+    meetingsList = list(meetingsList)
+    serverRaw = dict(zip(serversList, sl.r.mget(['server:{}'.format(server) for server in serversList]))) if serversList else {}
+    versions = dict(zip(meetingsList, sl.r.mget(['meeting:{}:version'.format(m) for m in meetingsList]))) if meetingsList else {}
+    oldServers = sl.r.smembers('servers')
+    oldMeetings = sl.r.smembers('meetings')
+    archivedList = set(sl.archived_meetings())
+
+    # entries of a fragment override the entries with the same name of the configFile and of the fragments before it,
+    # the files are processed in reverse order and every entry is taken from the first file that configures it
+    sections = set()
+    claimed = { 'servers': set(), 'meetings': set() }
+    configuredMeetings = set()
+    newMeetings = set()
+    commandsConfig = {}
+    for name in reversed(fragments):
+        if name not in fragmentConfigs:
+            if name not in fragmentRecords:
+                continue
+            if keep_fragment(name, fragmentRecords[name]):
+                continue
+            # an entry it configured was stored from another file, e.g. because it was removed from a fragment that overrode it
+            logger.debug("config fragment {} has to be read again".format(name))
+            (mtime, size, contentHash, config, error) = read_fragment(os.path.join(configDir, name))
+            if error:
+                logger.error("failed to read config fragment {}. {}".format(name, error))
+                continue
+            fragmentConfigs[name] = ({ 'mtime': mtime, 'size': size, 'hash': contentHash, 'codec': sl.doc_codec }, config)
+            missingServers = [server for server in (config.get('servers') or {}) if server not in serverRaw]
+            if missingServers:
+                serverRaw.update(zip(missingServers, sl.r.mget(['server:{}'.format(server) for server in missingServers])))
+            missingMeetings = [m for m in (config.get('meetings') or {}) if m not in versions]
+            if missingMeetings:
+                versions.update(zip(missingMeetings, sl.r.mget(['meeting:{}:version'.format(m) for m in missingMeetings])))
+        (record, config) = fragmentConfigs[name]
+        record.update(sync_entries(config))
+        record['refreshed'] = now
+        pipe.hset('configFragments', name, json.dumps(record))
+        commandsConfig = dict(config.get('commands') or {}, **commandsConfig)
+        logger.info("read config fragment {}".format(name))
+    sync_entries(meetingsConfig)
+    commandsConfig = dict(meetingsConfig.get('commands') or {}, **commandsConfig)
+    # fragments that were removed from the configDir
+    for name in set(fragmentRecords) - set(fragments):
+        logger.info("config fragment {} was removed".format(name))
+        pipe.hdel('configFragments', name)
+
+    if 'servers' in sections:
+        # update servers list in redis
+        newServers = claimed['servers']
+        removedServers = oldServers - newServers
+        if removedServers:
+            pipe.srem('servers', *removedServers)
+        if newServers:
+            pipe.sadd('servers', *newServers)
         if args.delete_meetings:
             # delete servers that where removed from the configFile
-            logger.debug("store removed servers for deletion: {}".format(sl.r.sdiffstore('delservers', 'oldservers', 'servers')))
-            for server in sl.r.smembers('delservers'):
+            for server in removedServers:
                 logger.info("Remove server: {}".format(server))
-                sl.r.delete("server:{}".format(server))
-                sl.r.delete("server:{}:status".format(server))
-                sl.r.srem('servers', server)
-        logger.debug("clear cache of removed servers: {}".format(sl.r.delete('oldservers')))
+                pipe.delete("server:{}".format(server), "server:{}:status".format(server))
+                pipe.hdel('configHashes', 'server:{}'.format(server))
 
-    if 'meetings' in meetingsConfig:
+    if 'meetings' in sections:
         # update meetings list in redis
-        if sl.r.exists('meetings'):
-            logger.debug("store last meetings to compare: {}".format(sl.r.rename('meetings', 'oldMeetings')))
-        meetingsList = set(meetingsConfig['meetings'])
-        for m in meetingsList:
-            logger.debug("processing {}...".format(m))
-            errors = sl.meeting_schema.validate(meetingsConfig['meetings'][m])
-            if errors:
-                logger.error("please provide all required fields for the meeting: {}".format(errors))
-                continue
-            try:
-                sl.r.sadd('meetings', m)
-                sl.r.set('meeting:{}'.format(m), json.dumps(meetingsConfig['meetings'][m]))
-                sl.r.expire('meeting:{}'.format(m), args.keep_redis_cache)
-                logger.info("added meeting {}".format(m))
-            except Exception as ERR:
-                logger.error("failed to add meeting {} to queue. {}".format(m, ERR))
+        removedMeetings = oldMeetings - newMeetings
+        if removedMeetings:
+            pipe.srem('meetings', *removedMeetings)
+        if newMeetings:
+            pipe.sadd('meetings', *newMeetings)
         if args.delete_meetings:
             # delete meetings that where removed from the configFile
-            logger.debug("store removed meetings for deletion: {}".format(sl.r.sdiffstore('delMeetings', 'oldMeetings', 'meetings')))
-            for meeting in sl.r.smembers('delMeetings'):
+            for meeting in removedMeetings:
                 logger.info("Remove meeting: {}".format(meeting))
-                sl.r.delete("meeting:{}".format(meeting))
-                sl.r.delete("meeting:{}:status".format(meeting))
-                sl.r.srem('meetings', meeting)
-        logger.debug("clear cache of removed meetings: {}".format(sl.r.delete('oldMeetings')))
-
-    if 'commands' in meetingsConfig:
-        # add commands to redis queue 
-        commandsList = set(meetingsConfig['commands'])
+                pipe.delete("meeting:{}".format(meeting), "meeting:{}:version".format(meeting), "meeting:{}:status".format(meeting))
+                sl.reset_fanout(meeting, pipe=pipe)
+                pipe.hdel('configHashes', 'meeting:{}'.format(meeting))
+            # delete archived meetings that where removed from the configFile
+            for meeting in archivedList - configuredMeetings:
+                logger.info("Remove archived meeting: {}".format(meeting))
+                sl.drop_archive(meeting, pipe)
+                pipe.delete("meeting:{}:status".format(meeting))
+                sl.reset_fanout(meeting, pipe=pipe)
+                pipe.hdel('configHashes', 'meeting:{}'.format(meeting))
+
+    try:
+        pipe.execute()
+    except Exception as ERR:
+        logger.error("failed to store the config. {}".format(ERR))
+        sys.exit()
+
+    if commandsConfig:
+        # add commands of the configFile and of the changed fragments to redis queue 
+        commandsList = set(commandsConfig)
         for m in commandsList:
             logger.debug("processing {}...".format(m))
-            errors = sl.command_schema.validate(meetingsConfig['commands'][m])
+            errors = sl.command_schema.validate(commandsConfig[m])
             if errors:
                 logger.error("please provide all required fields for the command: {}".format(errors))
                 continue
             # put command to queue
             try:
-                res = sl.r.xadd('commandStream', { m: json.dumps(meetingsConfig['commands'][m]) })
+                res = sl.queue_message('commandStream', { m: json.dumps(commandsConfig[m]) })
                 logger.info("queued command {}".format(m))
             except Exception as ERR:
                 logger.error("failed to queue command {} to queue. {}".format(m, ERR))